@@ -0,0 +1,77 @@
+"""
+Benchmarks for BifrostData (get_var, get_varTime) and stagger, using synthetic snapshots.
+Run via asv (see asv.conf.json in the top-level folder), e.g.:
+    asv run                         # benchmark the latest commit
+    asv continuous main HEAD        # compare two commits; report regressions
+"""
+
+# import external public modules
+import numpy as np
+
+# import internal modules
+from helita.sim import bifrost, stagger
+
+from . import synthetic
+
+# quantities to benchmark, by kind.
+SIMPLE_VARS = ['r', 'e', 'bx']          # read directly from file
+STAGGERED_VARS = ['ux', 'u2', 'b2', 'divb']   # require stagger operations
+EOS_VARS = ['tg', 'ne', 'kr']           # interpolated from EOS table
+
+
+class BifrostSetup:
+    '''writes synthetic bifrost snapshots (once per environment; shared by all benchmarks in class).'''
+    timeout = 300
+
+    def setup_cache(self):
+        root = 'helita_bench'
+        for n in synthetic.SIZES:
+            synthetic.write_bifrost(synthetic.bifrost_dir(root, n), n)
+        return root
+
+    def _data(self, root, n, snap=1):
+        return bifrost.BifrostData(synthetic.SNAPNAME, snap=snap, fdir=synthetic.bifrost_dir(root, n),
+                                   verbose=False)
+
+
+class GetVar(BifrostSetup):
+    '''BifrostData.get_var for simple, staggered, and EOS-table quantities.'''
+    params = (synthetic.SIZES, SIMPLE_VARS + STAGGERED_VARS + EOS_VARS)
+    param_names = ['n', 'var']
+
+    def setup(self, root, n, var):
+        self.dd = self._data(root, n)
+
+    def time_get_var(self, root, n, var):
+        self.dd.get_var(var)
+
+    def peakmem_get_var(self, root, n, var):
+        self.dd.get_var(var)
+
+
+class GetVarTime(BifrostSetup):
+    '''BifrostData.get_varTime across all synthetic snapshots.'''
+    params = (synthetic.SIZES, ['r', 'u2', 'tg'])
+    param_names = ['n', 'var']
+
+    def setup(self, root, n, var):
+        self.dd = self._data(root, n)
+        self.snaps = list(range(1, synthetic.NSNAPS + 1))
+
+    def time_get_varTime(self, root, n, var):
+        self.dd.get_varTime(var, snap=self.snaps, print_freq=-1)
+
+
+class StaggerDo:
+    '''stagger.do for each stagger_kind.'''
+    params = (synthetic.SIZES, list(stagger.VALID_STAGGER_KINDS), ['xup', 'zdn', 'ddxup', 'ddzdn'])
+    param_names = ['n', 'stagger_kind', 'operation']
+
+    def setup(self, n, stagger_kind, operation):
+        self.arr = np.random.default_rng(0).random((n, n, n), dtype='float32')
+        self.diff = np.full(n, 1.0 / n, dtype='float32') if operation.startswith('dd') else None
+        # compile numba functions (if any) before timing.
+        stagger.do(self.arr, operation, diff=self.diff, stagger_kind=stagger_kind)
+
+    def time_do(self, n, stagger_kind, operation):
+        stagger.do(self.arr, operation, diff=self.diff, stagger_kind=stagger_kind)
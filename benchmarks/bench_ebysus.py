@@ -0,0 +1,79 @@
+"""
+Benchmarks for EbysusData (multifluid quantities, collisions, compress/decompress), using synthetic snapshots.
+These require at_tools, and the supporting materials (mhd.in, mf_params.in, .atom files, ...)
+for a multifluid run, in the folder given by the HELITA_BENCH_EBYSUS_TEMPLATE environment variable.
+Otherwise, they are skipped. See synthetic.write_ebysus for details.
+"""
+
+# import built-ins
+import os
+
+from . import synthetic
+
+# quantities to benchmark.
+MULTIFLUID_VARS = ['r', 'tg', 'nr', 'ui_x']
+COLLISION_VARS = ['nu_ij', 'nu_en', 'nu_ei']
+
+
+class EbysusSetup:
+    '''writes synthetic ebysus snapshots (once per environment; shared by all benchmarks in class).'''
+    timeout = 600
+
+    def setup_cache(self):
+        try:
+            synthetic.ebysus_template()
+        except NotImplementedError:
+            return None
+        root = os.path.abspath('helita_bench')
+        for n in synthetic.SIZES:
+            synthetic.write_ebysus(synthetic.ebysus_dir(root, n), n)
+        return root
+
+    def _setup(self, root, n, **kw__ebysus):
+        '''chdir to the snapshot folder for n; return EbysusData. (Skip benchmark if there is no data.)'''
+        if root is None:
+            synthetic.ebysus_template()   # raises NotImplementedError --> asv skips this benchmark.
+        from helita.sim import ebysus
+        self._cwd = os.getcwd()
+        os.chdir(synthetic.ebysus_dir(root, n))
+        return ebysus.EbysusData(synthetic.SNAPNAME, snap=0, verbose=False, **kw__ebysus)
+
+    def teardown(self, *args):
+        if hasattr(self, '_cwd'):
+            os.chdir(self._cwd)
+
+
+class GetVar(EbysusSetup):
+    '''EbysusData.get_var for multifluid and collision quantities.'''
+    params = (synthetic.SIZES, MULTIFLUID_VARS + COLLISION_VARS)
+    param_names = ['n', 'var']
+
+    def setup(self, root, n, var):
+        self.dd = self._setup(root, n, do_caching=False)
+        self.fluids = self.dd.fluid_SLs(with_electrons=False)
+
+    def time_get_var(self, root, n, var):
+        self.dd.get_var(var, ifluid=self.fluids[0], jfluid=self.fluids[-1])
+
+
+class Compress(EbysusSetup):
+    '''EbysusData.compress, decompress, and reading from compressed data.'''
+    params = (synthetic.SIZES,)
+    param_names = ['n']
+    number = 1   # compress and decompress (over)write whole folders; one call per sample is plenty.
+
+    def setup(self, root, n):
+        self.dd = self._setup(root, n)
+        self.dd.compress(skip_existing=True, verbose=0)   # ensure .zc exists (for decompress & zc reading).
+
+    def time_compress(self, root, n):
+        self.dd.compress(skip_existing=False, verbose=0)
+
+    def time_decompress(self, root, n):
+        self.dd.decompress(verbose=0)
+
+    def time_get_var_zc(self, root, n):
+        from helita.sim import ebysus
+        dd = ebysus.EbysusData(synthetic.SNAPNAME, snap=0, verbose=False, read_mode='zc', do_caching=False)
+        for var in ('r', 'px', 'e'):
+            dd.get_var(var)
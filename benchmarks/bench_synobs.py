@@ -0,0 +1,62 @@
+"""
+Benchmarks for synobs: spectral convolution of a spectral cube (imgspec_conv's hot loop)
+with SharedArrayExecutor in serial, thread, and process modes, and the PSFConvolver.
+Run via asv (see asv.conf.json in the top-level folder).
+"""
+
+# import external public modules
+import numpy as np
+
+# import internal modules
+from helita.sim import synobs
+
+# (nx, ny, nwave) of the synthetic spectral cubes.
+SHAPES = [(64, 64, 400), (128, 128, 400)]
+MODES = list(synobs.SharedArrayExecutor.MODES)
+NPROC = 4
+
+
+def _cube(shape):
+    '''returns (wave, spec): a wavelength grid around Mg II k, and a cube of random line profiles.'''
+    rng = np.random.default_rng(0)
+    wave = np.linspace(278.0, 283.5, shape[-1])
+    centre = 279.6 + 0.01 * rng.standard_normal(shape[:-1] + (1,))
+    spec = 1 - 0.8 * np.exp(-((wave - centre) / 0.02)**2)
+    return wave, spec.astype('f4')
+
+
+class SpectralConvolve:
+    '''SharedArrayExecutor.map with synobs.spectral_convolve, for each executor mode.'''
+    params = (SHAPES, MODES)
+    param_names = ['shape', 'mode']
+    timeout = 300
+
+    def setup(self, shape, mode):
+        wave, spec = _cube(shape)
+        self.nwave = np.arange(278.1779, 283.3067, 0.002546 / 3.)
+        wsigma = 0.006 / ((self.nwave[1] - self.nwave[0]) * 2 * np.sqrt(2 * np.log(2)))
+        self.inputs = {'spec': spec}
+        self.outputs = {'result': (spec.shape[:-1] + self.nwave.shape, 'f4')}
+        self.args = (wsigma, wave, self.nwave)
+        self.executor = synobs.SharedArrayExecutor(nproc=NPROC, mode=mode)
+        # start the workers before timing.
+        self.executor.map(synobs.spectral_convolve, self.inputs, self.outputs, self.args, nitems=1)
+
+    def teardown(self, shape, mode):
+        self.executor.close()
+
+    def time_spectral_convolve(self, shape, mode):
+        self.executor.map(synobs.spectral_convolve, self.inputs, self.outputs, self.args)
+
+
+class PSFConvolve:
+    '''PSFConvolver on all wavelengths of a cube, in float32 and float64.'''
+    params = (SHAPES, ['f4', 'f8'])
+    param_names = ['shape', 'dtype']
+
+    def setup(self, shape, dtype):
+        _, self.spec = _cube(shape)
+        self.conv = synobs.PSFConvolver(synobs.gaussian_psf(3.), shape[:2], dtype=dtype)
+
+    def time_psf_convolve(self, shape, dtype):
+        self.conv(self.spec)
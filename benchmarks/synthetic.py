@@ -0,0 +1,149 @@
+"""
+File purpose:
+    Write synthetic Bifrost and Ebysus snapshots of configurable size, for the benchmarks.
+
+    Bifrost snapshots are written from scratch (snap, idl, mesh, and EOS + radiation tables),
+    using write_br_snap and Create_new_br_files.write_mesh from helita.sim.bifrost.
+
+    Ebysus snapshots need the usual "supporting materials" (mhd.in, mf_params.in, .atom files,
+    collision tables), and reading them needs at_tools. Those are copied from the folder in
+    the HELITA_BENCH_EBYSUS_TEMPLATE environment variable; the snapshot data itself is
+    synthetic, written via fake_ebysus_data.FakeEbysusData.
+"""
+
+import os
+# import built-ins
+import shutil
+
+# import external public modules
+import numpy as np
+
+# import internal modules
+from helita.sim import bifrost
+
+# sizes of the synthetic snapshots (number of cells along each axis).
+# Override via the HELITA_BENCH_SIZES environment variable, e.g. HELITA_BENCH_SIZES="32,64,128".
+SIZES = [int(n) for n in os.environ.get('HELITA_BENCH_SIZES', '32,64').split(',')]
+SNAPNAME = 'bench'
+NSNAPS = 3   # number of snapshots to write (for get_varTime).
+EBYSUS_TEMPLATE_ENV = 'HELITA_BENCH_EBYSUS_TEMPLATE'
+
+# EOS table parameters, chosen to cover the values in the synthetic snapshots.
+TABPARAMS = dict(nrhobin=64, rhomin=1e-12, rhomax=1e-4,
+                 neibin=64, eimin=1e10, eimax=1e15, nradbins=4)
+UNITS = dict(u_l=1e8, u_t=1e2, u_r=1e-7, u_b=1.121e3, u_ee=1e12)
+
+
+def bifrost_dir(root, n):
+    '''returns name of folder (inside root) which contains the bifrost snapshots with n**3 cells.'''
+    return os.path.join(root, f'bifrost_{n}')
+
+
+def ebysus_dir(root, n):
+    '''returns name of folder (inside root) which contains the ebysus snapshots with n**3 cells.'''
+    return os.path.join(root, f'ebysus_{n}')
+
+
+def _fields(n, seed=0):
+    '''returns dict of smooth-but-random fields (r, px, py, pz, e, bx, by, bz) of shape (n, n, n).'''
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 2 * np.pi, n, endpoint=False)
+    xx, yy, zz = np.meshgrid(x, x, x, indexing='ij')
+    wave = np.sin(xx) * np.cos(yy) * np.sin(2 * zz)
+    noise = lambda: 0.01 * rng.standard_normal((n, n, n))   # noqa: E731
+    result = dict(r=1 + 0.5 * wave + noise(),
+                  e=2 + 0.5 * wave + noise(),
+                  )
+    for i, x in enumerate(('x', 'y', 'z')):
+        result[f'p{x}'] = 0.1 * np.roll(wave, i, axis=i) + noise()
+        result[f'b{x}'] = np.roll(wave, i + 1, axis=i) + noise()
+    return result
+
+
+def _write_eos_tables(fdir):
+    '''write tabparam.in, and synthetic EOS & radiation tables, to fdir.'''
+    p = TABPARAMS
+    nei, nrho, nbins = p['neibin'], p['nrhobin'], p['nradbins']
+    lnei = np.linspace(np.log(p['eimin']), np.log(p['eimax']), nei)[:, None]
+    lnrho = np.linspace(np.log(p['rhomin']), np.log(p['rhomax']), nrho)[None, :]
+    eos = np.zeros((nei, nrho, 4), dtype='f4', order='F')
+    eos[..., 0] = lnrho + lnei + np.log(0.6)          # lnpg
+    eos[..., 1] = np.exp(lnei - np.log(p['eimin'])) * 1e3   # tg
+    eos[..., 2] = lnrho + 0.5 * lnei                  # lnne
+    eos[..., 3] = 2 * lnrho - lnei                    # lnkr
+    eos.ravel(order='F').tofile(os.path.join(fdir, 'eostable.dat'))
+    rad = np.ones((nei, nrho, nbins, 3), dtype='f4', order='F')
+    rad.ravel(order='F').tofile(os.path.join(fdir, 'radtab.dat'))
+    with open(os.path.join(fdir, 'tabparam.in'), 'w') as f:
+        for key, val in p.items():
+            f.write(f'{key} = {val}\n')
+        f.write("eostablefile = 'eostable.dat'\n")
+        f.write("rhoeiradtablefile = 'radtab.dat'\n")
+
+
+def write_bifrost(fdir, n, nsnaps=NSNAPS, snapname=SNAPNAME):
+    '''write synthetic bifrost snapshots (with n**3 cells) to fdir.
+    Writes snaps 1 to nsnaps, plus mesh file and EOS tables.
+    '''
+    os.makedirs(fdir, exist_ok=True)
+    dx = 2 * np.pi / n
+    bifrost.Create_new_br_files().write_mesh(nx=n, ny=n, nz=n, dx=dx, dy=dx, dz=dx,
+                                             meshfile=os.path.join(fdir, f'{snapname}.mesh'))
+    _write_eos_tables(fdir)
+    for snap in range(1, nsnaps + 1):
+        fields = _fields(n, seed=snap)
+        bifrost.write_br_snap(os.path.join(fdir, f'{snapname}_{snap:03d}.snap'),
+                              *[fields[var] for var in ('r', 'px', 'py', 'pz', 'e', 'bx', 'by', 'bz')])
+        idl = dict(mx=n, my=n, mz=n, mb=5, dx=dx, dy=dx, dz=dx, do_mhd=1,
+                   t=0.1 * snap, isnap=snap, gamma=1.667, **UNITS)
+        with open(os.path.join(fdir, f'{snapname}_{snap:03d}.idl'), 'w') as f:
+            for key, val in idl.items():
+                f.write(f'{key} = {val}\n')
+            f.write("aux = ''\n")
+            f.write(f"meshfile = '{snapname}.mesh'\n")
+            f.write(f"snapname = '{snapname}'\n")
+            f.write("tabinputfile = 'tabparam.in'\n")
+
+
+def ebysus_template():
+    '''returns folder with supporting materials for ebysus benchmarks.
+    raises NotImplementedError if it is not available (asv skips benchmarks in that case).
+    '''
+    template = os.environ.get(EBYSUS_TEMPLATE_ENV, None)
+    if template is None:
+        raise NotImplementedError(f'set {EBYSUS_TEMPLATE_ENV} to enable ebysus benchmarks.')
+    try:
+        import at_tools  # noqa: F401
+    except ImportError:
+        raise NotImplementedError('ebysus benchmarks require at_tools.') from None
+    return template
+
+
+def write_ebysus(fdir, n, snapname=SNAPNAME):
+    '''write synthetic ebysus snapshot 0 (with n**3 cells) to fdir, using FakeEbysusData.
+    The supporting materials are copied from ebysus_template().
+    '''
+    from helita.sim import fake_ebysus_data   # (imported here since it requires ebysus dependencies.)
+    template = ebysus_template()
+    shutil.copytree(template, fdir, dirs_exist_ok=True)
+    dx = 2 * np.pi / n
+    bifrost.Create_new_br_files().write_mesh(nx=n, ny=n, nz=n, dx=dx, dy=dx, dz=dx,
+                                             meshfile=os.path.join(fdir, f'{snapname}.mesh'))
+    # override size & names of template mhd.in. (When reading, the last value for each key is used.)
+    with open(os.path.join(fdir, 'mhd.in')) as f:
+        mhd_in = f.read()
+    with open(os.path.join(fdir, f'{snapname}.idl'), 'w') as f:
+        f.write(mhd_in)
+        f.write(f'\nmx = {n}\nmy = {n}\nmz = {n}\ndx = {dx}\ndy = {dx}\ndz = {dx}\n')
+        f.write(f"meshfile = '{snapname}.mesh'\nsnapname = '{snapname}'\n")
+    os.makedirs(os.path.join(fdir, f'{snapname}.io'), exist_ok=True)
+    cwd = os.getcwd()
+    os.chdir(fdir)
+    try:
+        dd = fake_ebysus_data.FakeEbysusData(snapname, snap=0, verbose=False)
+        fields = _fields(n)
+        for var in dd.iter_fundamentals():
+            dd.set_fundamental_var(var, fields[var], units='simu')
+        dd.write_snap0(warning=False)
+    finally:
+        os.chdir(cwd)
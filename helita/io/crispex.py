@@ -91,18 +91,19 @@ def write_from_rh(files, outfile, mode='im', stokes=False, waveidx=None,
                 iterator = tqdm(enumerate(files), total=len(files))
             except ModuleNotFoundError:
                 pass
-        for i, f in iterator:
-            dataset = xarray.open_dataset(f)
-            for v in variables:
-                data = dataset[v].data
-                if waveidx is not None:
-                    data = data[:, :, waveidx]
-                if waveinterp is not None:
-                    fint = interp.interp1d(wave, data, kind='linear')
-                    data = fint(waveinterp).astype(dtype)
-                lp.writeto('im_' + outfile, data, append=True,
-                           extraheader=extrahd)
-            dataset.close()
+        with lp.LpWriter('im_' + outfile, extraheader=extrahd,
+                         append=True) as writer:
+            for i, f in iterator:
+                dataset = xarray.open_dataset(f)
+                for v in variables:
+                    data = dataset[v].data
+                    if waveidx is not None:
+                        data = data[:, :, waveidx]
+                    if waveinterp is not None:
+                        fint = interp.interp1d(wave, data, kind='linear')
+                        data = fint(waveinterp).astype(dtype)
+                    writer.write(data)
+                dataset.close()
         print()
     elif mode.lower() == 'sp':
         # write spectral cube
@@ -115,59 +116,138 @@ def write_from_rh(files, outfile, mode='im', stokes=False, waveidx=None,
                 iterator = tqdm(range(ny))
             except ModuleNotFoundError:
                 pass
-        for y in iterator:
-            for i, f in enumerate(files):
-                dataset = xarray.open_dataset(f)
-                for j, v in enumerate(variables):
-                    data = dataset[v].data[:, y]
-                    if waveidx is not None:
-                        data = data[:, waveidx]
-                    if waveinterp is not None:
-                        fint = interp.interp1d(wave, data, kind='linear')
-                        data = fint(waveinterp).astype(dtype)
-                    isave[:, i, j::ns] = np.transpose(data)
-                dataset.close()
-            lp.writeto('sp_' + outfile, isave, append=True,
-                       extraheader=extrahd)
+        with lp.LpWriter('sp_' + outfile, extraheader=extrahd,
+                         append=True) as writer:
+            for y in iterator:
+                for i, f in enumerate(files):
+                    dataset = xarray.open_dataset(f)
+                    for j, v in enumerate(variables):
+                        data = dataset[v].data[:, y]
+                        if waveidx is not None:
+                            data = data[:, waveidx]
+                        if waveinterp is not None:
+                            fint = interp.interp1d(wave, data, kind='linear')
+                            data = fint(waveinterp).astype(dtype)
+                        isave[:, i, j::ns] = np.transpose(data)
+                    dataset.close()
+                writer.write(isave)
 
 
-def sp_from_im(infile, outfile, nwave, maxmem=4, verbose=True):
+def _im_tiles(nx, ny, npix):
+    ''' Yields (x0, x1, y0, y1) tiles of at most npix pixels covering an
+        (nx, ny) image. Tiles span full rows whenever a row fits in npix, so
+        that they map to a single contiguous block of the spectral cube. '''
+    if npix >= nx:
+        sy = min(ny, npix // nx)
+        for y0 in range(0, ny, sy):
+            yield 0, nx, y0, min(y0 + sy, ny)
+    else:
+        for y0 in range(ny):
+            for x0 in range(0, nx, npix):
+                yield x0, min(x0 + npix, nx), y0, y0 + 1
+
+
+def _read_im_tile(imc, tile):
+    ''' Reads an (x, y) tile over all (t, s, wave) from an image cube memmap. '''
+    x0, x1, y0, y1 = tile
+    return np.array(imc[x0:x1, y0:y1])
+
+
+def sp_from_im(infile, outfile, nwave, maxmem=4, ns=None, readahead=True,
+               verbose=True):
     ''' Creates a CRISPEX spectral cube from a quasi-transposition of an
         image cube.
 
+        The image cube is read in (x, y) tiles spanning all (t, stokes, wave),
+        each tile is transposed in memory and written as contiguous blocks
+        of the spectral cube. With readahead, the next tile is read in a
+        separate thread while the current one is transposed and written.
+
         IN:
-          infile  - lp image cube file to read.
-          outfile - lp spectral cube file to write. Overwritten if exists.
-          nwave   - number of spectral points.
-          maxmem  - maximum memory (in GB) to use when creating temporary arrays
+          infile    - lp image cube file to read.
+          outfile   - lp spectral cube file to write. Overwritten if exists.
+          nwave     - number of spectral points.
+          maxmem    - maximum memory (in GB) to use when creating temporary
+                      arrays. Includes the read-ahead buffer.
+          ns        - number of Stokes parameters. If None, taken from the
+                      'ns=' entry of the image cube header (default 1).
+          readahead - if True, reads the next tile in a background thread.
+          verbose   - if True, shows a progress bar (needs tqdm).
     '''
+    from multiprocessing.dummy import Pool as ThreadPool
 
     from . import lp
 
     GB = 2**30
-    nx, ny, ntl = lp.getheader(infile)[0]
-    ns = 1  # for now
-    nt = ntl / nwave
-    if (ntl % nwave != 0):
-        raise ValueError('sp_from_im: image cube nlt axis not multiple of' +
-                         ' given nwave (%i).' % (nwave) + ' Check values!')
-    ninc = maxmem * GB / (ntl * nx * ns * 4)
-    if ninc < 1:
+    (nx, ny, ntl), dtype, header = lp.getheader(infile)
+    extrahd = header.split(':', 1)[1].strip() if ':' in header else ''
+    if ns is None:
+        ns = 1
+        for item in extrahd.replace(' ', '').split(','):
+            if item.lower().startswith('ns='):
+                ns = int(item[3:])
+    if ntl % (nwave * ns) != 0:
+        raise ValueError('sp_from_im: image cube nlt axis (%i) not multiple' %
+                         ntl + ' of nwave * ns (%i * %i).' % (nwave, ns) +
+                         ' Check values!')
+    nt = ntl // (nwave * ns)
+    # native byte order for the output, lp.make_header only knows those
+    dtype = np.dtype(dtype).newbyteorder('=')
+    # tile as read, its transpose, and the read-ahead tile
+    nbuf = 3 if readahead else 2
+    npix = int(maxmem * GB) // (nbuf * ntl * dtype.itemsize)
+    if npix < 1:
         raise MemoryError('sp_from_im: memory supplied for temporary arrays' +
-                          ' (%i GB) not enough.' % (maxmem) +
-                          ' Need at least %f.2 GB.' % (ntl * nx * ns * 4. / GB))
-    iterator = range(ny / ninc + 1)
+                          ' (%s GB) not enough.' % (maxmem) +
+                          ' Need at least %.2f GB.' %
+                          (nbuf * ntl * dtype.itemsize / GB))
+    # header and full-size output file, filled in below
+    sp_header = lp.make_header(np.broadcast_to(np.zeros((), dtype=dtype),
+                                               (nwave, nt, nx * ny * ns)))
+    if extrahd:
+        sp_header += ' : ' + extrahd
+    with open(outfile, 'wb') as fobj:
+        fobj.truncate(512 + nwave * ntl * nx * ny * dtype.itemsize)
+    lp.writeheader(outfile, sp_header)
+    imc = lp.getdata(infile)
+    tiles = list(_im_tiles(nx, ny, npix))
+    iterator = tiles
     if verbose:
         try:
             from tqdm import tqdm
-            iterator = tqdm(range(ny / ninc + 1))
+            iterator = tqdm(tiles)
         except ModuleNotFoundError:
             pass
-    for i in iterator:
-        imc = lp.getdata(infile)
-        isave = imc[:, i * ninc:(i + 1) * ninc]
-        sy = isave.shape[1]
-        isave = np.transpose(
-            np.transpose(isave).reshape(nt, nwave, nx * sy), axes=(1, 0, 2))
-        lp.writeto(outfile, isave, append=i != 0, extraheader='')
-        imc.close()
+    # bytes per (x, y, s) column of the spectral cube
+    colbytes = nwave * nt * dtype.itemsize
+    pool = ThreadPool(1) if readahead else None
+    try:
+        if readahead:
+            pending = pool.apply_async(_read_im_tile, (imc, tiles[0]))
+        with open(outfile, 'r+b') as fobj:
+            for i, (x0, x1, y0, y1) in enumerate(iterator):
+                if readahead:
+                    data = pending.get()
+                    if i + 1 < len(tiles):
+                        pending = pool.apply_async(_read_im_tile,
+                                                   (imc, tiles[i + 1]))
+                else:
+                    data = _read_im_tile(imc, (x0, x1, y0, y1))
+                sx, sy = x1 - x0, y1 - y0
+                # [x, y, wave, s, t] -> C-ordered [y, x, s, t, wave], which is
+                # the Fortran order of the (nwave, nt, (y * nx + x) * ns + s)
+                # spectral cube
+                data = data.reshape((sx, sy, nwave, ns, nt), order='F')
+                data = np.ascontiguousarray(data.transpose(1, 0, 3, 4, 2),
+                                            dtype=dtype)
+                # full rows are a single block, otherwise one block per row
+                blocks = [data] if sx == nx else data
+                for j, block in enumerate(blocks):
+                    fobj.seek(512 + ((y0 + j) * nx + x0) * ns * colbytes)
+                    block.tofile(fobj)
+                del data, blocks
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    del imc
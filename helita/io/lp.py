@@ -2,9 +2,12 @@
 Set of tools to read and write 'La Palma' cubes
 """
 import os
+import re
 
 import numpy as np
 
+HEADER_SIZE = 512
+
 
 def make_header(image):
     ''' Creates header for La Palma images. '''
@@ -34,6 +37,17 @@ def make_header(image):
     return header
 
 
+def _header_bytes(header):
+    ''' Converts header string into the 512-byte, zero-padded file header. '''
+    raw = np.frombuffer(header.encode('ascii'), dtype='uint8')
+    if raw.size > HEADER_SIZE:
+        raise ValueError('header is %i characters long, maximum is %i'
+                         % (raw.size, HEADER_SIZE))
+    hh = np.zeros(HEADER_SIZE, dtype='uint8')
+    hh[:raw.size] = raw
+    return hh
+
+
 def writeto(filename, image, extraheader='', dtype=None, verbose=False,
             append=False):
     '''Writes image into cube, La Palma format. Analogous to IDL's lp_write.'''
@@ -46,61 +60,230 @@ def writeto(filename, image, extraheader='', dtype=None, verbose=False,
         dtype = image.dtype
     image = image.astype(dtype)
     if append:
-        # check if image sizes/types are consistent with file
-        sin, t, h = getheader(filename)
-        if sin[:2] != image.shape[:2]:
-            raise IOError('writeto: trying to write' +
-                          ' %s images, but %s has %s images!' %
-                          (repr(image.shape[:2]), filename, repr(sin[:2])))
-        if np.dtype(t) != image.dtype:
-            raise IOError('writeto: trying to write' +
-                          ' %s type images, but %s nas %s images' %
-                          (image.dtype, filename, np.dtype(t)))
-        # add the nt of current image to the header
-        hloc = h.lower().find('nt=')
-        new_nt = str(sin[-1] + image.shape[-1])
-        header = h[:hloc + 3] + new_nt + h[hloc + 3 + len(str(sin[-1])):]
-    else:
-        header = make_header(image)
+        with LpWriter(filename, dtype=dtype, extraheader=extraheader,
+                      append=True) as writer:
+            writer.write(image)
+        if verbose:
+            print(('Appended %s %s array into %s.' % (image.shape, dtype,
+                                                      filename)))
+        return
+    header = make_header(image)
     if extraheader:
         header += ' : ' + extraheader
-    # convert string to [unsigned] byte array
-    hh = np.zeros(512, dtype='uint8')
-    for i, ss in enumerate(header):
-        hh[i] = ord(ss)
-    # write header to file
-    file_arr = np.memmap(filename, dtype='uint8', mode=append and 'r+' or 'w+',
-                         shape=(512,))
-    file_arr[:512] = hh[:]
-    del file_arr
-    # offset if appending
-    apoff = append and np.prod(sin) * image.dtype.itemsize or 0
-    # write array to file
-    file_arr = np.memmap(filename, dtype=dtype, mode='r+', order='F',
-                         offset=512 + apoff, shape=image.shape)
-    file_arr[:] = image[:]
-    del file_arr
+    with open(filename, 'wb') as fobj:
+        _header_bytes(header).tofile(fobj)
+        # Fortran order
+        image.T.tofile(fobj)
     if verbose:
-        if append:
-            print(('Appended %s %s array into %s.' % (image.shape, dtype,
-                                                      filename)))
-        else:
-            print(('Wrote %s, %s array of shape %s' % (filename, dtype,
-                                                       image.shape)))
+        print(('Wrote %s, %s array of shape %s' % (filename, dtype,
+                                                   image.shape)))
     return
 
 
+class LpWriter:
+    """
+    Streaming writer for La Palma format cubes.
+
+    The 512-byte header is reserved when the file is opened, frames are
+    appended with `write`, and the header (with the final number of frames)
+    is written when the writer is closed. Use as a context manager.
+
+    Parameters
+    ----------
+    filename : str
+        File to write.
+    shape : tuple, optional
+        Frame shape (nx, ny). If None, taken from the first `write`.
+    dtype : str or numpy.dtype, optional
+        Data type of the cube. If None, taken from the first `write`.
+    extraheader : str, optional
+        Extra header, written after ' : ' in the header. When appending,
+        replaces the existing extra header if given.
+    append : bool, optional
+        If True and filename exists, frames are appended to the existing
+        cube instead of overwriting it.
+
+    Examples
+    --------
+    >>> with LpWriter('cube.lp', extraheader='stokes=[I]') as writer:
+    ...     for frame in frames:
+    ...         writer.write(frame)
+    """
+    def __init__(self, filename, shape=None, dtype=None, extraheader='',
+                 append=False):
+        self.filename = filename
+        self.extraheader = extraheader
+        self.shape = None if shape is None else tuple(shape)
+        self.dtype = None if dtype is None else np.dtype(dtype)
+        self.nt = 0
+        self._header = None
+        if append and os.path.isfile(filename):
+            sin, dt, self._header = getheader(filename)
+            self.nt = sin[2] if len(sin) == 3 else 1
+            if self.shape is not None and self.shape != sin[:2]:
+                raise IOError('LpWriter: trying to write %s images, but %s'
+                              ' has %s images!' % (repr(self.shape),
+                                                   filename, repr(sin[:2])))
+            if self.dtype is not None and self.dtype != np.dtype(dt):
+                raise IOError('LpWriter: trying to write %s type images, but'
+                              ' %s has %s images' % (self.dtype, filename,
+                                                     np.dtype(dt)))
+            self.shape, self.dtype = sin[:2], np.dtype(dt)
+            self._file = open(filename, 'r+b')
+            self._file.seek(HEADER_SIZE + self.nt * self._frame_bytes)
+        else:
+            self._file = open(filename, 'wb')
+            self._file.write(bytes(HEADER_SIZE))
+
+    @property
+    def _frame_bytes(self):
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    def write(self, image):
+        """
+        Appends image to the cube.
+
+        Parameters
+        ----------
+        image : ndarray
+            Single frame of shape (nx, ny), or several frames of shape
+            (nx, ny, nt).
+        """
+        image = np.asarray(image)
+        if image.ndim == 2:
+            image = image[..., np.newaxis]
+        if image.ndim != 3:
+            raise IndexError('LpWriter.write: input array must be 2D or 3D,'
+                             ' got %iD' % image.ndim)
+        if self.shape is None:
+            self.shape = image.shape[:2]
+        if self.dtype is None:
+            self.dtype = image.dtype
+        if self._header is None and self.nt == 0:
+            # fail early for unsupported types
+            make_header(np.broadcast_to(np.zeros((), self.dtype),
+                                        self.shape + (1,)))
+        if image.shape[:2] != self.shape:
+            raise IOError('LpWriter.write: trying to write %s images, but %s'
+                          ' has %s images!' % (repr(image.shape[:2]),
+                                               self.filename,
+                                               repr(self.shape)))
+        # Fortran order
+        image.astype(self.dtype, copy=False).T.tofile(self._file)
+        self.nt += image.shape[2]
+
+    def _make_header(self):
+        if self._header is None:
+            header = make_header(np.broadcast_to(np.zeros((), self.dtype),
+                                                 self.shape + (self.nt,)))
+        else:
+            # patch dimensions of existing header, keep the rest
+            header = self._header.split(':', 1)[0].rstrip()
+            header = re.sub(r'dims=\d+', 'dims=3', header)
+            if re.search(r'nt=\d+', header):
+                header = re.sub(r'nt=\d+', 'nt=%i' % self.nt, header)
+            else:
+                header = re.sub(r'(ny=\d+)', r'\1, nt=%i' % self.nt, header)
+            if not self.extraheader and ':' in self._header:
+                return header + ' :' + self._header.split(':', 1)[1]
+        if self.extraheader:
+            header += ' : ' + self.extraheader
+        return header
+
+    def close(self):
+        """
+        Writes the final header and closes the file.
+        """
+        if self._file.closed:
+            return
+        try:
+            if self.shape is not None:
+                self._file.seek(0)
+                _header_bytes(self._make_header()).tofile(self._file)
+        finally:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class LpReader:
+    """
+    Reader for La Palma format cubes, with access to individual frames.
+
+    Frames are memmaps into the file, so nothing is read until used.
+
+    Parameters
+    ----------
+    filename : str
+        File to read.
+    rw : bool, optional
+        If True, then any change to the data will be written to file.
+
+    Examples
+    --------
+    >>> with LpReader('cube.lp') as cube:
+    ...     for frame in cube:
+    ...         total += frame.sum()
+    """
+    def __init__(self, filename, rw=False):
+        self.filename = filename
+        self.shape, dtype, self.header = getheader(filename)
+        self.dtype = np.dtype(dtype)
+        self.data = getdata(filename, rw=rw)
+        if self.data.ndim == 2:
+            self.data = self.data[..., np.newaxis]
+
+    @property
+    def nt(self):
+        ''' Number of frames. '''
+        return self.data.shape[2]
+
+    @property
+    def extraheader(self):
+        ''' Part of the header after ' : ', if any. '''
+        if ':' not in self.header:
+            return ''
+        return self.header.split(':', 1)[1].strip()
+
+    def frame(self, i):
+        """
+        Returns memmap of frame i, with shape (nx, ny).
+        """
+        return self.data[:, :, i]
+
+    def __len__(self):
+        return self.nt
+
+    def __getitem__(self, i):
+        return self.frame(i)
+
+    def __iter__(self):
+        for i in range(self.nt):
+            yield self.frame(i)
+
+    def close(self):
+        self.data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
 def writeheader(filename, header):
     """
     Writes header (proper format, from make_header) into existing filename.
     """
-    # convert string to [unsigned] byte array
-    hh = np.zeros(512, dtype='uint8')
-    for i, ss in enumerate(header):
-        hh[i] = ord(ss)
+    hh = _header_bytes(header)
     # write header to file
-    file_arr = np.memmap(filename, dtype='uint8', mode='r+', shape=(512,))
-    file_arr[:512] = hh[:]
+    file_arr = np.memmap(filename, dtype='uint8', mode='r+',
+                         shape=(HEADER_SIZE,))
+    file_arr[:] = hh
     del file_arr
     return
 
@@ -121,10 +304,8 @@ def getheader(filename):
         datatype (with endianness), header string.
     """
     # read header and convert to string
-    h = np.fromfile(filename, dtype='uint8', count=512)
-    header = ''
-    for s in h[h > 0]:
-        header += chr(s)
+    h = np.fromfile(filename, dtype='uint8', count=HEADER_SIZE)
+    header = h[h > 0].tobytes().decode('latin-1')
     # start reading at 'datatype'
     hd = header[header.lower().find('datatype'):]
     hd = hd.split(':')[0].replace(',', ' ').split()
@@ -209,4 +390,4 @@ def getdata(filename, rw=False, verbose=False):
         print(('Reading %s...\n%s' % (filename, header)))
     mode = ['c', 'r+']
     return np.memmap(filename, mode=mode[rw], shape=sh, dtype=dt, order='F',
-                     offset=512)
+                     offset=HEADER_SIZE)
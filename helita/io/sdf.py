@@ -3,6 +3,9 @@ Set of tools to read SDF format.
 
 First coded: 20111227 by Tiago Pereira (tiago.pereira@nasa.gov)
 """
+import os
+import json
+
 import numpy as np
 
 
@@ -13,9 +16,9 @@ class SDFHeader:
 
     def query(self, filename, verbose=False):
         ''' Queries the file, returning datasets and shapes.'''
-        f = open(filename, 'r')
+        f = open(filename, 'rb')
         h = f.read(11)
-        hdstr = str(h[:-1])
+        hdstr = h[:-1].decode('latin-1')
         if hdstr != 'SDF format':
             raise IOError('SDF header not found in' +
                           ' %s, probably wrong or corrupt file.' % filename)
@@ -23,7 +26,7 @@ class SDFHeader:
         self.datapos = np.fromfile(f, dtype='>l', count=1)[0]
         self.norder = np.fromfile(f, dtype='>i', count=1)[0]
         self.hdrsize = np.fromfile(f, dtype='>l', count=1)[0]
-        header = f.read(self.hdrpos - f.tell())
+        header = f.read(self.hdrpos - f.tell()).decode('latin-1')
         self.header = header
         if self.verbose:
             print(header)
@@ -55,6 +58,116 @@ class SDFHeader:
         return
 
 
+class SDFFile:
+    ''' Indexed reader for SDF files.
+
+        The header is parsed only once, into a table of variable name ->
+        (order, dtype, nbpw, offset, shape), where dtype includes the
+        endianness. Variables are then returned as views of a single memmap
+        of the file, without any further parsing or seeking.
+
+        IN:
+            filename - string with filename
+            index    - [OPTIONAL] sidecar index file. If True, uses
+                       filename + '.idx'. If a string, uses it as the index
+                       file name. The table is read from the index if it
+                       matches the size and modification time of filename,
+                       otherwise the header is parsed and the index written.
+                       If None (default), no index file is used.
+
+        Example:
+            with SDFFile('snap.sdf', index=True) as sdf:
+                rho = sdf['rho']
+                data = sdf.getvars(['ux', 'uy', 'uz'], memmap=False)
+    '''
+    def __init__(self, filename, index=None):
+        self.filename = filename
+        if index is True:
+            index = filename + '.idx'
+        self.index = index
+        self.variables = None
+        if index is not None:
+            self.variables = self._read_index(index)
+        if self.variables is None:
+            self.variables = SDFHeader(filename).variables
+            if index is not None:
+                self._write_index(index)
+        self._mmap = None
+
+    def _stamp(self):
+        st = os.stat(self.filename)
+        return [st.st_size, st.st_mtime_ns]
+
+    def _read_index(self, index):
+        ''' Returns variable table from index file, or None if missing or
+            out of date. '''
+        try:
+            with open(index, 'r') as f:
+                idx = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if idx.get('stamp') != self._stamp():
+            return None
+        return {k: [v[0], v[1], v[2], v[3], tuple(v[4])]
+                for k, v in idx['variables'].items()}
+
+    def _write_index(self, index):
+        variables = {k: [int(v[0]), v[1], int(v[2]), int(v[3]),
+                         [int(n) for n in v[4]]]
+                     for k, v in self.variables.items()}
+        try:
+            with open(index, 'w') as f:
+                json.dump({'stamp': self._stamp(), 'variables': variables}, f)
+        except OSError:
+            print('(WWW) SDFFile: could not write index file %s' % index)
+
+    def keys(self):
+        return self.variables.keys()
+
+    def __contains__(self, variable):
+        return variable in self.variables
+
+    def __getitem__(self, variable):
+        return self.getvar(variable)
+
+    def getvar(self, variable, memmap=True):
+        ''' Returns variable, as a memmap view if memmap, otherwise loaded
+            into memory. '''
+        if variable not in self.variables:
+            raise KeyError('(EEE) getvar: variable %s not found in %s' %
+                           (variable, self.filename))
+        order, dtype, nbpw, offset, shape = self.variables[variable]
+        if self._mmap is None:
+            self._mmap = np.memmap(self.filename, dtype='u1', mode='r')
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        data = self._mmap[offset:offset + nbytes].view(dtype)
+        data = data.reshape(shape, order='F')
+        if not memmap:
+            data = np.array(data, order='F')
+        return data
+
+    def getvars(self, variables=None, memmap=True):
+        ''' Returns dictionary with several variables (default all). When
+            loading into memory, variables are read in file order. '''
+        if variables is None:
+            variables = list(self.variables)
+        result = {}
+        for v in sorted(variables, key=lambda v: self.variables[v][3]
+                        if v in self.variables else -1):
+            result[v] = self.getvar(v, memmap=memmap)
+        return {v: result[v] for v in variables}
+
+    def close(self):
+        self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
 def getvar(filename, variable, memmap=False):
     ''' Reads variable from SDF file.
 
@@ -66,29 +179,10 @@ def getvar(filename, variable, memmap=False):
         OUT:
             data - array with data
     '''
-    ff = SDFHeader(filename, verbose=False)
-    if variable not in ff.variables:
-        raise KeyError(
-            '(EEE) getvar: variable %s not found in %s' %
-            (variable, filename))
-    order, dtype, nbpw, offset, shape = ff.variables[variable]
-    if memmap:
-        data = np.memmap(filename, dtype=dtype, mode='r', shape=shape,
-                         offset=offset, order='F')
-    else:
-        f = open(filename, 'r')
-        f.seek(offset)
-        data = np.fromfile(f, dtype=dtype,
-                           count=np.prod(shape)).reshape(shape[::-1]).T
-        f.close()
-    return data
+    return SDFFile(filename).getvar(variable, memmap=memmap)
 
 
-def getall(filename, memmap=False):
+def getall(filename, memmap=False, index=None):
     ''' Reads all the variables of an SDF file. Loads into a dictionary indexed
         by variable name. '''
-    ff = SDFHeader(filename, verbose=False)
-    result = {}
-    for v in ff.variables:
-        result[v] = getvar(filename, v, memmap)
-    return result
+    return SDFFile(filename, index=index).getvars(memmap=memmap)
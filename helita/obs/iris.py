@@ -279,27 +279,138 @@ def make_fits_level3_skel(filename, dtype, naxis, times, waves, wsizes,
     return
 
 
-def transpose_fits_level3(filename, outfile=None):
+def transpose_fits_level3(filename, outfile=None, tile_bytes=2**28):
     """
-    Transposes an 'im' level 3 FITS file into 'sp' file
-    (ie, transposed). INCOMPLETE, ONLY HEADER SO FAR.
+    Transposes an 'im' level 3 FITS file into 'sp' file (ie, transposed),
+    with index order (lambda, t, x, y).
+
+    The transpose is done out-of-core, in blocks of the slowest output axis,
+    so that peak memory is bounded by tile_bytes rather than the cube size.
+
+    Parameters
+    ----------
+    filename : string
+        Name of 'im' file to read.
+    outfile : string, optional
+        Name of 'sp' file to write. If not given, will use sp_filename(filename).
+    tile_bytes : int, optional
+        Maximum size (in bytes) of a block of data held in memory.
+
+    Returns
+    -------
+    outfile : string
+        Name of written file.
     """
     from astropy.io import fits as pyfits
-    hdr_in = pyfits.getheader(filename)
+    if outfile is None:
+        outfile = sp_filename(filename)
+    fin = pyfits.open(filename, memmap=True)
+    hdr_in = fin[0].header
     hdr_out = hdr_in.copy()
-    (nx, ny, nz, nt) = [hdr_in['NAXIS*'][i] for i in range(1, 5)]
     TRANSP_KEYS = ['NAXIS', 'CDELT', 'CRPIX', 'CRVAL', 'CTYPE', 'CUNIT']
     ORDER = [2, 3, 0, 1]
     for item in TRANSP_KEYS:
         for i in range(4):
             hdr_out[item + str(ORDER[i] + 1)] = hdr_in[item + str(i + 1)]
-    return hdr_out
+    hdr_out['COMMENT'] = 'Index order is (lambda,t,x,y)'
+    data_in = fin[0].data     # (nt, nwave, nx, ny), C order
+    nt, nwave, nx, ny = data_in.shape
+    out_shape = (nx, ny, nt, nwave)
+    _write_fits_skel(outfile, hdr_out, out_shape, data_in.dtype, [h.copy() for h in fin[1:]])
+    with pyfits.open(outfile) as fout:
+        offset = fout.fileinfo(0)['datLoc']
+    data_out = np.memmap(outfile, dtype=data_in.dtype, mode='r+', offset=offset, shape=out_shape)
+    # block along output x (and y, if a single x is still too big)
+    row_bytes = ny * nt * nwave * data_in.dtype.itemsize
+    xstep = max(1, tile_bytes // row_bytes)
+    ystep = ny if xstep > 1 else max(1, tile_bytes // (nt * nwave * data_in.dtype.itemsize))
+    for x0 in range(0, nx, xstep):
+        for y0 in range(0, ny, ystep):
+            block = data_in[:, :, x0:x0 + xstep, y0:y0 + ystep]
+            data_out[x0:x0 + xstep, y0:y0 + ystep] = block.transpose((2, 3, 0, 1))
+    data_out.flush()
+    del data_out
+    fin.close()
+    return outfile
+
+
+def sp_filename(filename):
+    """
+    Returns name of 'sp' file for an 'im' level 3 file: replaces the last
+    'im' token (delimited by '_', '.' or the start/end of the file name) by
+    'sp' if present, else adds '_sp' before the extension.
+    """
+    import os
+    import re
+    fdir, name = os.path.split(filename)
+    tokens = list(re.finditer(r'(?:^|(?<=[_.]))im(?=[_.]|$)', name))
+    if tokens:
+        start, end = tokens[-1].span()
+        name = name[:start] + 'sp' + name[end:]
+    else:
+        root, ext = os.path.splitext(name)
+        name = root + '_sp' + ext
+    return os.path.join(fdir, name)
+
+
+def _write_fits_skel(filename, header, shape, dtype, extensions=()):
+    """
+    Writes FITS header, then fills the file up to the size of the data
+    (without writing any data), then appends the extensions.
+    """
+    from astropy.io import fits as pyfits
+    FITSBLOCK = 2880  # FITS blocksize in bytes
+    header.tofile(filename, overwrite=True)
+    with open(filename, 'rb+') as fobj:
+        fsize = len(header.tostring()) + int(np.prod(shape)) * np.dtype(dtype).itemsize
+        fobj.seek(int(np.ceil(fsize / float(FITSBLOCK)) * FITSBLOCK) - 1)
+        fobj.write(b'\0')
+    for ext in extensions:
+        pyfits.append(filename, ext.data, ext.header)
+
+
+def _rh_to_level3_slab(i, rayfile, outfile, offset, shape, dtype, wave_idx,
+                       clean, time_collapse_2d, tile_bytes):
+    """
+    Reads one RH ray file and writes it directly into its final place (index i
+    along the time axis) in the level 3 FITS file. Reads tiles of wavelengths,
+    so that memory is bounded by tile_bytes (except if clean, which needs
+    the whole cube).
+    """
+    from ..sim import rh15d
+    robj = rh15d.Rh15dout(verbose=False, autoread=False)
+    robj.read_ray(rayfile)
+    intensity = robj.ray.intensity
+    nwave = len(wave_idx)
+    if time_collapse_2d:  # whole file goes into the output, as (nt, nwave, nx, 1)
+        out = np.memmap(outfile, dtype=dtype, mode='r+', offset=offset, shape=shape)
+    else:
+        slab_shape = shape[1:]
+        slab_bytes = int(np.prod(slab_shape)) * np.dtype(dtype).itemsize
+        out = np.memmap(outfile, dtype=dtype, mode='r+', offset=offset + i * slab_bytes,
+                        shape=slab_shape)
+    wstep = nwave if clean else max(1, tile_bytes // max(1, np.prod(intensity.shape[:2]) * 8))
+    for w0 in range(0, nwave, wstep):
+        tmp = np.asarray(intensity[:, :, wave_idx[w0:w0 + wstep]])
+        if not time_collapse_2d:
+            tmp = tmp[:, ::-1]  # right-handed system
+        if clean:
+            tmp = rh15d.clean_var(tmp, only_positive=True)
+        else:   # always clean up for NaNs, Infs, masked, and negative
+            idx = (~np.isfinite(tmp)) | (tmp < 0) | (tmp > 9e36)
+            tmp[idx] = 0.0
+        if time_collapse_2d:
+            out[:, w0:w0 + wstep] = tmp[:, :, np.newaxis].transpose((1, 3, 0, 2))
+        else:
+            out[w0:w0 + wstep] = tmp.T
+    out.flush()
+    robj.close()
 
 
 def rh_to_fits_level3(filelist, outfile, windows, window_desc, times=None,
                       xsize=24., clean=False, time_collapse_2d=False,
                       cwaves=None, make_sp=False, desc=None, wave2vac=None,
-                      wave_select=np.array([False])):
+                      wave_select=np.array([False]), nproc=1, tile_bytes=2**28):
     """
     Converts a sequence of RH netCDF/HDF5 ray files to a FITS file
     compliant with IRIS level 3 for use in CRISPEX.
@@ -345,7 +456,16 @@ def rh_to_fits_level3(filelist, outfile, windows, window_desc, times=None,
         If present, will only use wavelengths that are contained in this
         array. Must be exact match. Useful to combine output files that
         have common wavelengths.
+    nproc : int, optional
+        Number of processes. Each process reads whole ray files and writes
+        them directly to their place in the output file. Default is 1.
+    tile_bytes : int, optional
+        Maximum size (in bytes) of the blocks of data held in memory (per
+        process), when reading ray files (unless clean) and making the sp
+        cube. Default is 256 MB.
     """
+    import multiprocessing
+
     from astropy import units as u
     from astropy.io import fits as pyfits
     from specutils.utils.wcs_utils import air_to_vac
@@ -404,32 +524,27 @@ def rh_to_fits_level3(filelist, outfile, windows, window_desc, times=None,
     make_fits_level3_skel(outfile, robj.ray.intensity.dtype,
                           (ny, nx), times, waves, nwaves, descw=window_desc,
                           cwaves=cwaves, header_extra=header_extra)
-    fobj = pyfits.open(outfile, mode="update", memmap=True)
+    # indices of the full wavelength array to write
+    wave_idx = np.arange(robj.ray.wavelength.size)
+    if wave_select.size == robj.ray.wavelength.size:
+        wave_idx = wave_idx[wave_select]   # common wavelengths, if applicable
+    wave_idx = wave_idx[indices]
+    robj.close()
+    fobj = pyfits.open(outfile)
+    offset = fobj.fileinfo(0)['datLoc']
+    shape = fobj[0].data.shape
+    dtype = fobj[0].data.dtype
+    fobj.close()
     if time_collapse_2d:
-        robj.read_ray(filelist[0])
-        tmp = robj.ray.intensity[:]
-        if wave_select.size == robj.ray.wavelength.size:
-            tmp = tmp[..., wave_select]
-        tmp = tmp[:, :, indices]
-        if clean:
-            tmp = rh15d.clean_var(tmp, only_positive=True)
-        else:   # always clean up for NaNs, Infs, masked, and negative
-            idx = (~np.isfinite(tmp)) | (tmp < 0) | (tmp > 9e36)
-            tmp[idx] = 0.0
-        fobj[0].data[:] = tmp[:, :, np.newaxis].transpose((1, 3, 0, 2))
+        filelist = filelist[:1]
+    tasks = [(i, f, outfile, offset, shape, dtype, wave_idx, clean, time_collapse_2d, tile_bytes)
+             for i, f in enumerate(filelist)]
+    if nproc == 1:
+        for task in tasks:
+            _rh_to_level3_slab(*task)
     else:
-        for i, f in enumerate(filelist):
-            robj.read_ray(f)
-            tmp = robj.ray.intensity[:]
-            if wave_select.size == robj.ray.wavelength.size:
-                # common wavelengths, if applicable
-                tmp = tmp[..., wave_select]
-            tmp = tmp[:, ::-1, indices]  # right-handed system
-            if clean:
-                tmp = rh15d.clean_var(tmp, only_positive=True)
-            else:   # always clean up for NaNs, Infs, masked, and negative
-                idx = (~np.isfinite(tmp)) | (tmp < 0) | (tmp > 9e36)
-                tmp[idx] = 0.0
-            fobj[0].data[i] = tmp.T
-    fobj.close()
+        with multiprocessing.Pool(nproc) as pool:
+            pool.starmap(_rh_to_level3_slab, tasks)
+    if make_sp:
+        transpose_fits_level3(outfile, tile_bytes=tile_bytes)
     return
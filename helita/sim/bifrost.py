@@ -12,13 +12,14 @@ import functools
 import collections
 from glob import glob
 import re
+from multiprocessing.dummy import Pool as ThreadPool
 
 # import external public modules
 import numpy as np
 from scipy import interpolate
 from scipy.ndimage import map_coordinates
 
-from . import document_vars, file_memory, load_fromfile_quantities, stagger, tools, units
+from . import dataset_export, document_vars, file_memory, load_fromfile_quantities, stagger, tools, units
 from .load_arithmetic_quantities import *
 
 # import internal modules
@@ -32,6 +33,7 @@ from .tools import (
 # defaults
 whsp = '  '
 AXES = ('x', 'y', 'z')
+ATMOS_HALO = 5   # halo points read around tiles in write_rh15d, write_multi3d (for staggering)
 
 # BifrostData class
 
@@ -769,10 +771,15 @@ class BifrostData(Plottable3D):
         internal: bool (default: False)
             if internal and self.do_stagger, don't change slices.
             internal=True inside get_var.
+            (Except while getting a z-slab; see load_arithmetic_quantities.iter_z_slabs.
+            Then, use slices as provided, since the slab already includes a halo for stagger.)
 
         updates x, y, z, dx1d, dy1d, dz1d afterwards, if any domains were changed.
         '''
-        if internal and self.do_stagger:
+        if internal and self.do_stagger and getattr(self, '_slab_mode', False):
+            # getting a z-slab; keep the slab's domain.
+            slices = (None, None, None)
+        elif internal and self.do_stagger:
             # we slice at the end, only. For now, set all to slice(None)
             slices = (slice(None), slice(None), slice(None))
         else:
@@ -804,6 +811,8 @@ class BifrostData(Plottable3D):
         self.varn['by'] = 'by'
         self.varn['bz'] = 'bz'
 
+    @document_vars.quant_profiling
+    @file_memory.with_shared_intermediates
     @document_vars.quant_tracking_top_level
     def _load_quantity(self, var, cgsunits=1.0, **kwargs):
         '''helper function for get_var; actually calls load_quantities for var.'''
@@ -889,6 +898,112 @@ class BifrostData(Plottable3D):
         val = self._get_var_postprocess(val, var=var, original_slice=original_slice, printing_stats=printing_stats)
         return val
 
+    def get_vars(self, vars, *args__get_var, **kw__get_var):
+        """
+        Reads many variables at once. Returns dict of {var: value}.
+
+        Intermediate quantities needed by more than one of the vars (e.g. 'r'
+        and 'rxdn' for 'ux', 'uy', 'uz', 'tg', ...) are evaluated exactly once,
+        and forgotten as soon as the last var needing them is done.
+
+        This works by first doing a dry run (which does not read any data)
+        to count how many times each intermediate is needed.
+        See file_memory.SharedIntermediates for details.
+
+        Parameters
+        ----------
+        vars - list of strings
+            Names of the variables to read.
+
+        *args and **kwargs go to self.get_var.
+        """
+        plan = self.plan_intermediates(vars, *args__get_var, **kw__get_var)
+        result = dict()
+        with file_memory.SharedIntermediates(self, plan=plan):
+            for var in vars:
+                result[var] = self.get_var(var, *args__get_var, **kw__get_var)
+        return result
+
+    def plan_intermediates(self, vars, *args__get_var, **kw__get_var):
+        """
+        Dry run of get_var for each var in vars, without reading any data.
+        Returns file_memory.SharedIntermediates object which knows how many
+        times each intermediate quantity is requested.
+
+        If the dry run fails for a var, that var is skipped
+        (its intermediates will just not be shared).
+        """
+        with file_memory.SharedIntermediates(self, dry_run=True) as plan:
+            with self.maintaining('printing_stats', 'verbose'):
+                self.printing_stats = False
+                self.verbose = False
+                for var in vars:
+                    try:
+                        self.get_var(var, *args__get_var, **kw__get_var)
+                    except Exception:
+                        pass  # the real get_var will raise a proper error, if the problem persists.
+        return plan
+
+    def plan(self, var, *args__get_var, shared=False, read_rate=None, flop_rate=None, **kw__get_var):
+        """
+        Dry run of get_var(var), without reading any data. Returns document_vars.QuantPlan,
+        which tells:
+            tree - the dependency tree (a QuantTree, like from got_vars_tree).
+                Each node has node.stats with size, nbytes, and dtype of the result.
+            reads - list of dicts with filename, offset, shape, dtype, nbytes
+                of the data from files which would be read.
+            nbytes_read - total number of bytes which would be read.
+            peak_ntemp, peak_nbytes - estimated peak number (and total bytes) of
+                arrays which would be in memory at the same time.
+            nflops, time_estimate - estimated number of floating point operations,
+                and estimated time [seconds] to get var.
+
+        Useful e.g. to check if there is enough memory before getting a heavy quantity.
+        Note: sizes of arrays are estimated from the current domain (self.shape);
+        values from files are assumed to be read in full, even if only part of them is needed.
+
+        Parameters
+        ----------
+        var - string
+            Name of the variable to plan.
+        shared - bool, optional
+            False (default) --> plan for get_var(var).
+            True --> plan for get_vars([var]), i.e. repeated intermediates are only evaluated once.
+        read_rate, flop_rate - None or number, optional
+            assumed rate of reading [bytes/s] and computing [flops/s].
+            None --> use document_vars.PLAN_READ_RATE, PLAN_FLOP_RATE.
+
+        *args and **kwargs go to self.get_var.
+        """
+        with file_memory.SharedIntermediates(self, dry_run=True, share=shared) as dry_run:
+            with self.maintaining('printing_stats', 'verbose'):
+                self.printing_stats = False
+                self.verbose = False
+                self.get_var(var, *args__get_var, **kw__get_var)
+            tree = document_vars.got_vars_tree(self, as_data=True)
+        return document_vars.quant_plan(tree, dry_run.reads, read_rate=read_rate, flop_rate=flop_rate)
+
+    def profiling(self, trace_memory=False):
+        """
+        Returns a context manager which profiles all calls to get_var inside of it.
+        Results are stored in the nodes of the quant tree (node.stats), and can be
+        exported as a JSON trace or as folded stacks for a flame graph.
+        Example:
+            with dd.profiling() as prof:
+                dd('b2')
+            print(prof.trees[-1].str())
+            prof.save('b2.json')
+
+        To profile every call instead, set self.profiler = document_vars.QuantProfiler(self).
+        See document_vars.QuantProfiler for details.
+
+        Parameters
+        ----------
+        trace_memory - bool, default False
+            whether to also track memory allocations (via tracemalloc). This slows things down.
+        """
+        return document_vars.QuantProfiler(self, trace_memory=trace_memory)
+
     def _get_var_postprocess(self, val, var='', printing_stats=None, original_slice=[slice(None) for x in ('x', 'y', 'z')]):
         '''does post-processing for get_var.
         This includes:
@@ -923,6 +1038,10 @@ class BifrostData(Plottable3D):
         if self.do_stagger and not self._getting_internal_var():
             self.set_domain_iiaxes(*original_slice, internal=False)
 
+        # during a dry run (see get_vars) val is just a placeholder; skip all remaining post-processing.
+        if file_memory.is_planning(self):
+            return val
+
         # handle "don't know how to get this var" case
         if val is None:
             errmsg = ('get_var: do not know (yet) how to calculate quantity {}. '
@@ -1004,7 +1123,28 @@ class BifrostData(Plottable3D):
         '''
         return getattr(self, document_vars.LOADING_LEVEL) >= 0
 
-    def trans2comm(self, varname, snap=None, *args, **kwargs):
+    def _metadata(self, none=None, with_nfluid=2):
+        '''returns dict of metadata for self, i.e. the attrs which may affect the output of _load_quantity.
+        if self.snap is an array, set result['snaps']=snap and result['snap']=snaps[self.snapInd].
+
+        none: any value (default None)
+            metadata attrs which are not yet set will be set to this value.
+        with_nfluid: any value.
+            ignored; accepted for compatibility with EbysusData._metadata.
+        '''
+        METADATA_ATTRS = ['snap', 'iix', 'iiy', 'iiz', 'do_stagger', 'stagger_kind', 'sel_units']
+        result = {attr: getattr(self, attr, none) for attr in METADATA_ATTRS}
+        if result['snap'] is not none:
+            if len(np.shape(result['snap'])) > 0:
+                result['snaps'] = result['snap']
+                result['snap'] = result['snap'][self.snapInd]
+        return result
+
+    def _metadata_matches(self, alt_metadata, none=None):
+        '''return whether alt_metadata matches self._metadata().'''
+        return file_memory._dict_equals(self._metadata(none=none), alt_metadata)
+
+    def trans2comm(self, varname, snap=None, *args, out=None, **kwargs):
         '''
         Transform the domain into a "common" format. All arrays will be 3D. The 3rd axis
         is:
@@ -1022,24 +1162,33 @@ class BifrostData(Plottable3D):
 
         Units: everything is in cgs.
 
-        If an array is reverse, do ndarray.copy(), otherwise pytorch will complain.
+        The result is never a reversed view (pytorch would complain), but it is made in a
+        single pass: sign flip and z reversal are written directly into the result.
 
+        out: None or array
+            if provided, write result into out (e.g. a slice of a preallocated training buffer),
+            instead of allocating a new array.
         '''
-
-        sign = 1.0
-        if varname[-1] in ['x', 'y', 'z']:
-            varname = varname+'c'
-            if varname[-2] in ['y', 'z']:
-                sign = -1.0
-
+        varname, sign = trans2comm_varname(varname)
         var = self.get_var(varname, snap=snap, *args, **kwargs)
-        var = sign * var
-        var = var[..., ::-1].copy()
+        out = trans2comm_into(var, sign, out=out)
 
         self.trans2commaxes()
         self.sel_units = 'cgs'
-        
-        return var
+
+        return out
+
+    @tools.maintain_attrs('snap')
+    def export_dataset(self, varnames, snaps=None, out='dataset', format='zarr', **kw__export):
+        '''export varnames at snaps, in the "common" format (see self.trans2comm), to a dataset at out.
+        format: 'zarr' or 'npy-shards'.
+        Streams snapshots directly into fixed-size shards; computes normalisation stats on the fly.
+        returns dict of normalisation stats: {var: dict(count=, mean=, std=, min=, max=)}.
+
+        See helita.sim.dataset_export.export_dataset for details and additional kwargs
+        (e.g. crop, shard_size, nproc, dtype).
+        '''
+        return dataset_export.export_dataset(self, varnames, snaps=snaps, out=out, format=format, **kw__export)
 
     def trans2commaxes(self):
         if self.transunits == False:
@@ -1197,8 +1346,9 @@ class BifrostData(Plottable3D):
             ss = (self.nx, self.ny, self.nz)
 
         if var in self.heliumvars:
-            return np.exp(np.memmap(filename, dtype=self.dtype, order=order,
-                                    mode=mode, offset=offset, shape=ss))
+            memmap = np.memmap(filename, dtype=self.dtype, order=order,
+                               mode=mode, offset=offset, shape=ss)
+            return np.exp(file_memory.planning_placeholder(self, memmap))
         else:
             return np.memmap(filename, dtype=self.dtype, order=order,
                              mode=mode, offset=offset, shape=ss)
@@ -1277,25 +1427,132 @@ class BifrostData(Plottable3D):
                 nh[k] = nv[sx, sy, sz]
         else:
             rho = self.r[sx, sy, sz] * self.uni.u_r
-            subsfile = os.path.join(self.fdir, 'subs.dat')
-            tabfile = os.path.join(self.fdir, self.get_param('tabinputfile', error_prop=True).strip())
-            tabparams = []
-            if os.access(tabfile, os.R_OK):
-                tabparams = read_idl_ascii(tabfile, obj=self)
-            if 'abund' in tabparams and 'aweight' in tabparams:
-                abund = np.array(tabparams['abund'].split()).astype('f')
-                aweight = np.array(tabparams['aweight'].split()).astype('f')
-                grph = calc_grph(abund, aweight)
-            elif os.access(subsfile, os.R_OK):
-                grph = subs2grph(subsfile)
-            else:
-                grph = 2.380491e-24
-            nh = rho / grph
+            nh = rho / self._grph()
             nh = nh[None]  # add extra empty dimension when nhydr = 1
         return Quantity(nh, unit='1/cm3')
 
+    def _grph(self):
+        """
+        Returns grams per hydrogen atom, from the abundances in the
+        tabinputfile, or from subs.dat, or the solar default.
+        """
+        subsfile = os.path.join(self.fdir, 'subs.dat')
+        tabfile = os.path.join(self.fdir, self.get_param('tabinputfile', error_prop=True).strip())
+        tabparams = []
+        if os.access(tabfile, os.R_OK):
+            tabparams = read_idl_ascii(tabfile, obj=self)
+        if 'abund' in tabparams and 'aweight' in tabparams:
+            abund = np.array(tabparams['abund'].split()).astype('f')
+            aweight = np.array(tabparams['aweight'].split()).astype('f')
+            return calc_grph(abund, aweight)
+        elif os.access(subsfile, os.R_OK):
+            return subs2grph(subsfile)
+        return 2.380491e-24
+
+    def _atmos_tile(self, ix, iy, iz, velocities='xyz', eostab=None, grph=None):
+        """
+        Gets atmosphere quantities for a tile of columns, in cgs units and
+        at cell centres. Only the needed parts of the snapshot are read,
+        plus a few halo points for the horizontal staggering.
+
+        Parameters
+        ----------
+        ix, iy, iz : 1D arrays of ints
+            Indices of the tile along x and y, and of the depth points.
+        velocities : string, optional
+            Velocity components to get, e.g. 'xyz' or 'z'.
+        eostab : Rhoeetab instance, optional
+            EOS table, needed unless the snapshot has hion and tg.
+        grph : float, optional
+            Grams per hydrogen atom, needed unless hion.
+
+        Returns
+        -------
+        tile : dict
+            temp, rho, ne, nh (with shape (nhydr, nx, ny, nz)), 'v' + axis
+            for axis in velocities, and bx, by, bz (if do_mhd).
+        """
+        ur = self.params['u_r'][self.snapInd]
+        uv = self.params['u_l'][self.snapInd] / self.params['u_t'][self.snapInd]
+        ub = self.params['u_b'][self.snapInd]
+
+        def read(var, op=None):
+            # read var (from memmap) in the tile, staggered to cell centres by op
+            xi, yi = ix, iy
+            ext = [slice(None), slice(None)]
+            axis = 'xyz'.index(op[0]) if op else -1
+            if axis in (0, 1):
+                idx = (ix, iy)[axis]
+                n = (self.nx, self.ny)[axis]
+                halo = ATMOS_HALO if n > 5 else 0
+                if self.get_param('periodic_' + op[0]) in (False, 0):   # (0 from the idl file)
+                    lo = min(idx[0], halo)
+                    ext_idx = np.arange(idx[0] - lo, min(idx[-1] + halo + 1, n))
+                else:
+                    lo = halo
+                    ext_idx = np.arange(idx[0] - halo, idx[-1] + halo + 1) % n
+                ext[axis] = idx - idx[0] + lo
+                if axis == 0:
+                    xi = ext_idx
+                else:
+                    yi = ext_idx
+            data = self.variables[var][xi[:, None], yi[None, :]]
+            if op:
+                data = do_stagger(data, op, obj=self)[tuple(ext)]
+            return data[..., iz]
+
+        rho = read('r')
+        tile = {'rho': rho * ur}
+        for x in velocities:
+            tile['v' + x] = read('p' + x, x + 'up') / rho * uv
+        if self.do_mhd:
+            for x in 'xyz':
+                tile['b' + x] = read('b' + x, x + 'up') * ub
+        if 'tg' in self.variables:
+            tile['temp'] = read('tg')
+        if self.hion:
+            tile['ne'] = read('hionne')
+            tile['nh'] = np.array([read('n%i' % (k + 1)) for k in range(6)])
+        else:
+            ee = read('e') / rho * self.uni.u_ee
+            tile['ne'] = eostab.tab_interp(rho * self.uni.u_r, ee, order=1)
+            tile['nh'] = (rho * self.uni.u_r / grph)[None]
+            if 'temp' not in tile:
+                tile['temp'] = eostab.tab_interp(rho * self.uni.u_r, ee, out='tg', order=1)
+        return tile
+
+    def _iter_atmos_tiles(self, sx, sy, sz, tile_size=64, nthreads=1, velocities='xyz'):
+        """
+        Iterates over tiles of columns of the snapshot, within the slices
+        sx, sy, sz. Yields (xs, ys, tile), where xs, ys are slices into the
+        sliced x and y axes, and tile is a dict from _atmos_tile. With
+        nthreads > 1, tiles are computed by a pool of threads, and are
+        yielded in the order they finish.
+        """
+        ix = np.arange(self.nx)[sx]
+        iy = np.arange(self.ny)[sy]
+        iz = np.arange(self.nz)[sz]
+        eostab = grph = None
+        if not self.hion:
+            eostab = Rhoeetab(fdir=self.fdir)
+            grph = self._grph()
+        tiles = [(slice(i, i + tile_size), slice(j, j + tile_size))
+                 for i in range(0, len(ix), tile_size) for j in range(0, len(iy), tile_size)]
+
+        def compute(xy):
+            xs, ys = xy
+            return xs, ys, self._atmos_tile(ix[xs], iy[ys], iz, velocities=velocities,
+                                            eostab=eostab, grph=grph)
+        if nthreads == 1:
+            for xy in tiles:
+                yield compute(xy)
+        else:
+            with ThreadPool(nthreads) as pool:
+                yield from pool.imap_unordered(compute, tiles)
+
     def write_rh15d(self, outfile, desc=None, append=True, sx=slice(None),
-                    sy=slice(None), sz=slice(None), write_all_v=False):
+                    sy=slice(None), sz=slice(None), write_all_v=False,
+                    tile_size=64, nthreads=1, complevel=0):
         """
         Writes snapshot in RH 1.5D format.
         Parameters
@@ -1313,83 +1570,69 @@ class BifrostData(Plottable3D):
             for every second point up to 100.
         write_all_v - bool, optional
             If true, will write also the vx and vy components.
+        tile_size - int, optional
+            The snapshot is converted and written in tiles of
+            tile_size x tile_size columns, so that memory use does not
+            depend on the size of the snapshot. Also the HDF5 chunk size.
+        nthreads - int, optional
+            Number of threads computing tiles.
+        complevel - int, optional
+            zlib compression level of the output (0 for no compression).
         Returns
         -------
         None.
         """
         from . import rh15d
-        verbose = self.verbose
-        if verbose:
-            try:
-                from tqdm import tqdm
-                pbar = tqdm(total=4)
-            except ModuleNotFoundError:
-                verbose = False
         # unit conversion to SI
-        # Comment to Tiago, params['units'] is hard coded. I
-        # strongly recoment to use Bifrost_units.
         ul = self.params['u_l'][self.snapInd] / 1.e2  # to metres
-        # to g/cm^3  (for ne_rt_table)
-        self.params['u_r'][self.snapInd]
-        ut = self.params['u_t'][self.snapInd]         # to seconds
-        uv = ul / ut
-        ub = self.params['u_b'][self.snapInd] * 1e-4  # to Tesla
-        ue = self.params['u_ee'][self.snapInd]        # to erg/g
-        if verbose:
-            pbar.set_description("Slicing and unit conversion")
-        temp = self.tg[sx, sy, sz]
-        rho = self.r[sx, sy, sz]
-
-        if self.do_mhd:
-            Bx = do_stagger(self.bx, 'xup', obj=self)[sx, sy, sz]
-            By = do_stagger(self.by, 'yup', obj=self)[sx, sy, sz]
-            Bz = do_stagger(self.bz, 'zup', obj=self)[sx, sy, sz]
-            # Change sign of Bz (because of height scale) and By
-            # (to make right-handed system)
-            Bx = Bx * ub
-            By = -By * ub
-            Bz = -Bz * ub
-        else:
-            Bx = By = Bz = None
-
-        vz = do_stagger(self.pz, 'zup', obj=self)[sx, sy, sz] / rho
-        vz *= -uv
-        if write_all_v:
-            vx = do_stagger(self.px, 'xup', obj=self)[sx, sy, sz] / rho
-            vx *= uv
-            vy = do_stagger(self.py, 'yup', obj=self)[sx, sy, sz] / rho
-            vy *= -uv
-        else:
-            vx = None
-            vy = None
         x = self.x[sx] * ul
         y = self.y[sy] * (-ul)
         z = self.z[sz] * (-ul)
-        if verbose:
-            pbar.update()
-            pbar.set_description("Getting hydrogen populations")
-        nh = self.get_hydrogen_pops(sx, sy, sz).to_value('1/m3')
-        if verbose:
-            pbar.update()
-            pbar.set_description("Getting electron density")
-        ne = self.get_electron_density(sx, sy, sz).to_value('1/m3')
+        nx, ny, nz = len(x), len(y), len(z)
         if desc is None:
             desc = 'BIFROST snapshot from sequence %s, sx=%s sy=%s sz=%s.' % \
                    (self.file_root, repr(sx), repr(sy), repr(sz))
             if self.hion:
                 desc = 'hion ' + desc
-        # write to file
-        if verbose:
-            pbar.update()
-            pbar.set_description("Writing to file")
-        rh15d.make_xarray_atmos(outfile, temp, vz, z, nH=nh, ne=ne, x=x, y=y,
-                                vx=vx, vy=vy, Bx=Bx, By=By, Bz=Bz, desc=desc,
-                                append=append, snap=self.snap)
-        if verbose:
-            pbar.update()
+        velocities = 'xyz' if write_all_v else 'z'
+        variables = ['temperature', 'electron_density', 'hydrogen_populations']
+        variables += ['velocity_' + v for v in velocities]
+        if self.do_mhd:
+            variables += ['B_x', 'B_y', 'B_z']
+        ncfile, nti = rh15d.create_atmos_file(
+            outfile, nx, ny, nz, variables, z, x=x, y=y, nhydr=6 if self.hion else 1,
+            desc=desc, snap=self.snap, append=append, chunks=(tile_size, tile_size),
+            complevel=complevel)
+        tiles = self._iter_atmos_tiles(sx, sy, sz, tile_size=tile_size,
+                                       nthreads=nthreads, velocities=velocities)
+        if self.verbose:
+            try:
+                from tqdm import tqdm
+                ntiles = -(-nx // tile_size) * -(-ny // tile_size)
+                tiles = tqdm(tiles, total=ntiles, desc="Writing tiles")
+            except ModuleNotFoundError:
+                pass
+        try:
+            for xs, ys, tile in tiles:
+                # Change sign of vz, Bz (because of height scale) and vy, By
+                # (to make right-handed system)
+                signs = {'x': 1, 'y': -1, 'z': -1}
+                out = {'temperature': tile['temp'],
+                       'electron_density': tile['ne'] * 1e6}    # to m^-3
+                for v in velocities:
+                    out['velocity_' + v] = tile['v' + v] * (signs[v] / 1e2)   # to m/s
+                if self.do_mhd:
+                    for v in 'xyz':
+                        out['B_' + v] = tile['b' + v] * (signs[v] * 1e-4)   # to Tesla
+                for var, data in out.items():
+                    ncfile[var][nti, xs, ys] = data
+                ncfile['hydrogen_populations'][nti, :, xs, ys] = tile['nh'] * 1e6
+        finally:
+            ncfile.close()
 
     def write_multi3d(self, outfile, mesh='mesh.dat', desc=None,
-                      sx=slice(None), sy=slice(None), sz=slice(None)):
+                      sx=slice(None), sy=slice(None), sz=slice(None),
+                      tile_size=64, nthreads=1):
         """
         Writes snapshot in Multi3D format.
         Parameters
@@ -1404,6 +1647,12 @@ class BifrostData(Plottable3D):
             Slice objects for x, y, and z dimensions, when not all points
             are needed. E.g. use slice(None) for all points, slice(0, 100, 2)
             for every second point up to 100.
+        tile_size - int, optional
+            The snapshot is converted and written in tiles of
+            tile_size x tile_size columns, so that memory use does not
+            depend on the size of the snapshot.
+        nthreads - int, optional
+            Number of threads computing tiles.
         Returns
         -------
         None.
@@ -1412,43 +1661,28 @@ class BifrostData(Plottable3D):
 
         # unit conversion to cgs and km/s
         ul = self.params['u_l'][self.snapInd]   # to cm
-        ur = self.params['u_r'][self.snapInd]   # to g/cm^3  (for ne_rt_table)
-        ut = self.params['u_t'][self.snapInd]   # to seconds
-        uv = ul / ut / 1e5        # to km/s
-        ue = self.params['u_ee'][self.snapInd]  # to erg/g
-        nh = None
-        if self.verbose:
-            print('Slicing and unit conversion...', whsp*4, end="\r",
-                  flush=True)
-        temp = self.tg[sx, sy, sz]
-        rho = self.r[sx, sy, sz]
-        # Change sign of vz (because of height scale) and vy (to make
-        # right-handed system)
-        vx = do_stagger(self.px, 'xup', obj=self)[sx, sy, sz] / rho
-        vx *= uv
-        vy = do_stagger(self.py, 'yup', obj=self)[sx, sy, sz] / rho
-        vy *= -uv
-        vz = do_stagger(self.pz, 'zup', obj=self)[sx, sy, sz] / rho
-        vz *= -uv
-        rho = rho * ur  # to cgs
         x = self.x[sx] * ul
         y = self.y[sy] * ul
         z = self.z[sz] * (-ul)
-        ne = self.get_electron_density(sx, sy, sz).to_value('1/cm3')
-        # write to file
+        nx, ny, nz = len(x), len(y), len(z)
         if self.verbose:
             print('Write to file...', whsp*8, end="\r", flush=True)
-        nx, ny, nz = temp.shape
         fout = Multi3dAtmos(outfile, nx, ny, nz, mode="w+", read_nh=self.hion)
-        fout.ne[:] = ne
-        fout.temp[:] = temp
-        fout.vx[:] = vx
-        fout.vy[:] = vy
-        fout.vz[:] = vz
-        fout.rho[:] = rho
-        if self.hion:
-            nh = self.get_hydrogen_pops(sx, sy, sz).to_value('1/cm3')
-            fout.nh[:] = np.transpose(nh, axes=(1, 2, 3, 0))
+        for xs, ys, tile in self._iter_atmos_tiles(sx, sy, sz, tile_size=tile_size,
+                                                   nthreads=nthreads):
+            # Change sign of vz (because of height scale) and vy (to make
+            # right-handed system)
+            fout.ne[xs, ys] = tile['ne']
+            fout.temp[xs, ys] = tile['temp']
+            fout.vx[xs, ys] = tile['vx'] / 1e5
+            fout.vy[xs, ys] = -tile['vy'] / 1e5
+            fout.vz[xs, ys] = -tile['vz'] / 1e5
+            fout.rho[xs, ys] = tile['rho']
+            if self.hion:
+                fout.nh[xs, ys] = np.transpose(tile['nh'], axes=(1, 2, 3, 0))
+        for var in ('ne', 'temp', 'vx', 'vy', 'vz', 'rho', 'nh'):
+            if hasattr(fout, var):
+                getattr(fout, var).flush()
         # write mesh?
         if mesh:
             fout2 = open(mesh, "w")
@@ -2000,7 +2234,7 @@ class BifrostData(Plottable3D):
         indexing = kw__meshgrid.pop('indexing', 'ij')  # default 'ij' indexing
         return np.meshgrid(*coords, sparse=sparse, indexing=indexing, **kw__meshgrid)
 
-    def get_kcoords(self, units='si', axes=None):
+    def get_kcoords(self, units='si', axes=None, rfft_axis=None):
         '''returns dict of k-space coords, with keys ['kx', 'ky', 'kz']
         coords units are based on mode.
             'si' (default) -> [ 1 / m]
@@ -2011,6 +2245,9 @@ class BifrostData(Plottable3D):
             axes can be provided in either of these formats:
                 strings: 'x', 'y', 'z'
                 ints:     0 ,  1 ,  2
+        rfft_axis: None (default), or axis ('x', 'y', 'z', 0, 1, or 2)
+            if provided, coords for this axis will be for the half spectrum from rfft,
+            i.e. only k >= 0, and not shifted. (E.g. rfft_axis='y' for get_var('rfftxy_r').)
         '''
         # units
         units = units.lower()
@@ -2025,6 +2262,10 @@ class BifrostData(Plottable3D):
             axes = [AXES_LOOKUP[x] for x in axes]
             return_dict = False
         result = {f'k{x}': getattr(self, f'k{x}') for x in axes}   # get k
+        if rfft_axis is not None:
+            x = {'x': 'x', 0: 'x', 'y': 'y', 1: 'y', 'z': 'z', 2: 'z'}[rfft_axis]
+            if f'k{x}' in result:
+                result[f'k{x}'] = 2*np.pi*np.fft.rfftfreq(getattr(self, f'{x}Length'), getattr(self, f'd{x}'))
         result = {key: val / u_l for key, val in result.items()}  # convert units
         # return
         if return_dict:
@@ -2046,7 +2287,7 @@ class BifrostData(Plottable3D):
         x, y = self.get_coords(units=units, axes=axes)
         return tools.extent(x, y)
 
-    def get_kextent(self, axes=None, units='si'):
+    def get_kextent(self, axes=None, units='si', rfft_axis=None):
         '''use plt.imshow(extent=get_kextent()) to make a plot in k-space.
         units: 'si' (default), 'cgs', or 'simu'
             unit system for result
@@ -2055,6 +2296,9 @@ class BifrostData(Plottable3D):
             if None, use obj._latest_fft_axes (see helita.sim.load_arithmetic_quantities.get_fft_quant)
             first axis will be the plot's x axis; second will be the plot's y axis.
             E.g. axes='yz' means 'y' as the horizontal axis, 'z' as the vertical axis.
+        rfft_axis: None or axis
+            axis with half spectrum from rfft (see get_kcoords).
+            if axes is None, use obj._latest_rfft_axis instead.
         '''
         if axes is None:
             try:
@@ -2063,8 +2307,9 @@ class BifrostData(Plottable3D):
                 errmsg = "self._latest_fft_axes not set; maybe you meant to get a quant from " +\
                          "FFT_QUANT first? Use self.vardoc('FFT_QUANT') to see list of options."
                 raise AttributeError(errmsg) from None
+            rfft_axis = getattr(self, '_latest_rfft_axis', None)
         assert len(axes) == 2, f"require exactly 2 axes for get_kextent, but got {len(axes)}"
-        kx, ky = self.get_kcoords(units=units, axes=axes)
+        kx, ky = self.get_kcoords(units=units, axes=axes, rfft_axis=rfft_axis)
         return tools.extent(kx, ky)
 
     def unmasked_to_full(self, arr):
@@ -2245,6 +2490,42 @@ BifrostData.snaps_info = snaps_info
 #  WRITING SNAPS   #
 ####################
 
+def trans2comm_varname(varname):
+    '''returns (name to pass to get_var, sign) for trans2comm(varname).
+    Vector components are centered (varname + 'c'); y & z components flip sign,
+    so that vectors obey the right-hand rule and point away from the Sun.
+    '''
+    sign = 1.0
+    if varname[-1] in ['x', 'y', 'z']:
+        varname = varname+'c'
+        if varname[-2] in ['y', 'z']:
+            sign = -1.0
+    return varname, sign
+
+
+def trans2comm_into(var, sign=1.0, out=None, add=False):
+    '''returns sign * var[..., ::-1], computed in a single pass without intermediate copies.
+
+    out: None or array
+        None --> allocate result (C-contiguous, never a reversed view).
+        array --> write result into out.
+    add: bool, default False
+        if True, add result to out (which must be provided) instead of overwriting it.
+    '''
+    src = np.asanyarray(var)[..., ::-1]
+    if out is None:
+        out = np.empty(src.shape, dtype=src.dtype)
+    if not add:
+        np.multiply(src, sign, out=out)
+    elif sign == 1:
+        np.add(out, src, out=out)
+    elif sign == -1:
+        np.subtract(out, src, out=out)
+    else:
+        out += sign * src
+    return out
+
+
 def write_br_snap(rootname, r, px, py, pz, e, bx, by, bz):
     nx, ny, nz = r.shape
     data = np.memmap(rootname, dtype='float32', mode='w+', order='f', shape=(nx, ny, nz, 8))
@@ -0,0 +1,210 @@
+"""
+File purpose:
+    Export many variables at many snapshots, in the "common" format (see BifrostData.trans2comm),
+    to an on-disk dataset suitable for training machine learning models.
+
+    Snapshots are streamed through trans2comm directly into the output storage, one shard at a time,
+    so memory usage is at most one shard of one variable, regardless of the number of snapshots.
+    Shards are processed in parallel (one process per shard, since processes never share a shard).
+
+    Per-variable normalisation statistics (count, mean, std, min, max) are computed on the fly,
+    and stored alongside the data.
+
+Formats:
+    'zarr': one zarr group. For each var, an array with shape (nsnaps, nx, ny, nz),
+        chunked as (1, *crop) so that training crops read whole chunks,
+        and (for zarr >= 3) sharded as (shard_size, ...) along the snapshot axis.
+        (zarr 2 has no sharding, so there each chunk is a separate file.)
+        Metadata (snaps, shard_size, stats) is in the group attrs.
+    'npy-shards': one folder. For each var & shard, a file '{var}_{ishard:05d}.npy'
+        with shape (shard_size, nx, ny, nz) (the last shard may be smaller).
+        Files can be opened with np.load(..., mmap_mode='r').
+        Metadata (snaps, shard_size, files, stats) is in 'metadata.json'.
+"""
+
+# import built-ins
+import os
+import json
+import multiprocessing
+
+# import external public modules
+import numpy as np
+
+# import internal modules
+from . import tools
+
+try:
+    import zarr
+except ImportError as err:
+    zarr = tools.ImportFailed('zarr', err=err)
+
+FORMATS = ('zarr', 'npy-shards')
+SHARD_BYTES = 2**28  # default target size of a single shard (of a single variable) [bytes]
+METADATA_FILE = 'metadata.json'
+_EXPORT_OBJ = None   # object being exported; set before forking so worker processes inherit it.
+_EXPORT_FIRST = None   # value of the first var at the first snap (computed to get the shape); reused for shard 0.
+
+
+''' ---- normalisation stats ---- '''
+
+
+def array_stats(arr):
+    '''returns dict of stats of arr: count, mean, m2 (sum of squared deviations from mean), min, max.'''
+    count = np.size(arr)
+    mean = np.mean(arr, dtype='f8')
+    return dict(count=count, mean=mean, m2=np.sum(np.square(arr - mean, dtype='f8')),
+                min=float(np.min(arr)), max=float(np.max(arr)))
+
+
+def merge_stats(a, b):
+    '''returns stats of the union of the data described by stats a and b (dicts from array_stats).
+    Uses the pairwise update of Chan et al. for mean and m2. a or b can be None.
+    '''
+    if a is None:
+        return b
+    if b is None:
+        return a
+    count = a['count'] + b['count']
+    delta = b['mean'] - a['mean']
+    return dict(count=count,
+                mean=a['mean'] + delta * b['count'] / count,
+                m2=a['m2'] + b['m2'] + delta**2 * a['count'] * b['count'] / count,
+                min=min(a['min'], b['min']), max=max(a['max'], b['max']))
+
+
+def _finalize_stats(stats):
+    '''returns json-friendly dict of count, mean, std, min, max, from stats (dict from array_stats).'''
+    return dict(count=int(stats['count']), mean=float(stats['mean']),
+                std=float(np.sqrt(stats['m2'] / stats['count'])),
+                min=float(stats['min']), max=float(stats['max']))
+
+
+''' ---- export ---- '''
+
+
+def export_dataset(obj, varnames, snaps=None, out='dataset', format='zarr', *,
+                   method='trans2comm', dtype='f4', crop=None, shard_size=None,
+                   nproc=1, **kw__method):
+    '''export varnames at snaps, in the "common" format, to a dataset at out.
+
+    obj: BifrostData (or subclass) object.
+    varnames: list of strings
+        variables to export, passed to obj.trans2comm (or method, if provided).
+    snaps: None or list of ints
+        snapshots to export. None --> obj.snap.
+    out: string
+        path of the dataset (zarr group, or folder for npy-shards). Contents are overwritten.
+    format: 'zarr' or 'npy-shards'
+        output format. See helita.sim.dataset_export module docstring for details.
+    method: string, default 'trans2comm'
+        name of obj method to use for getting values. Must accept (varname, snap, out=array).
+        E.g., for EbysusData, use 'total_trans2comm' to get totals across all fluids.
+    dtype: string or dtype, default 'f4'
+        data type of stored values.
+    crop: None or tuple of 3 ints
+        spatial chunk shape (for zarr). Set it to the size of training crops.
+        None --> one chunk per snapshot.
+    shard_size: None or int
+        number of snapshots per shard. None --> as many as fit in SHARD_BYTES.
+    nproc: int, default 1
+        number of processes; each process writes whole shards. Requires 'fork' start method
+        (the default on linux), since each process uses its own copy of obj.
+    additional kwargs are passed to method.
+
+    returns dict of normalisation stats: {var: dict(count=, mean=, std=, min=, max=)}.
+    '''
+    global _EXPORT_OBJ, _EXPORT_FIRST
+    if format not in FORMATS:
+        raise ValueError(f'format={format!r} not recognized; expected one of {FORMATS}')
+    snaps = np.atleast_1d(obj.snap if snaps is None else snaps).astype(int)
+    dtype = np.dtype(dtype)
+    # always use the same (cgs) units. (trans2comm sets these, but only after the first get_var.)
+    obj.trans2commaxes()
+    obj.sel_units = 'cgs'
+    # get output shape from the first var at the first snap. (the value is reused in the first shard.)
+    first = getattr(obj, method)(varnames[0], int(snaps[0]), **kw__method)
+    shape = np.shape(first)
+    if shard_size is None:
+        shard_size = max(1, SHARD_BYTES // (int(np.prod(shape)) * dtype.itemsize))
+    shard_size = int(min(shard_size, len(snaps)))
+    shards = [snaps[i:i+shard_size] for i in range(0, len(snaps), shard_size)]
+    # create storage
+    if format == 'zarr':
+        crop = tuple(shape) if crop is None else tuple(crop)
+        group = zarr.open_group(out, mode='w')
+        if int(zarr.__version__.split('.')[0]) >= 3:
+            padded = tuple(-(-n // c) * c for n, c in zip(shape, crop))   # shards must be a multiple of chunks.
+            for var in varnames:
+                group.create_array(var, shape=(len(snaps), *shape), chunks=(1, *crop), dtype=dtype,
+                                   shards=(shard_size, *padded))
+        else:   # zarr 2: no sharding.
+            for var in varnames:
+                group.create_dataset(var, shape=(len(snaps), *shape), chunks=(1, *crop), dtype=dtype)
+    else:
+        os.makedirs(out, exist_ok=True)
+    # export shards
+    tasks = [(out, format, varnames, ishard, [int(s) for s in shard], shard_size, shape, dtype.str, method, kw__method)
+             for ishard, shard in enumerate(shards)]
+    _EXPORT_OBJ, _EXPORT_FIRST = obj, first
+    del first
+    try:
+        if nproc == 1:
+            results = [_export_shard(*task) for task in tasks]
+        else:
+            with multiprocessing.get_context('fork').Pool(nproc) as pool:
+                results = pool.starmap(_export_shard, tasks)
+    finally:
+        _EXPORT_OBJ, _EXPORT_FIRST = None, None
+    # merge & save stats
+    stats = {var: None for var in varnames}
+    for shard_stats in results:
+        for var in varnames:
+            stats[var] = merge_stats(stats[var], shard_stats[var])
+    stats = {var: _finalize_stats(s) for var, s in stats.items()}
+    metadata = dict(snaps=snaps.tolist(), shard_size=shard_size, shape=list(shape),
+                    dtype=dtype.str, stats=stats)
+    if format == 'zarr':
+        group.attrs.update(metadata)
+    else:
+        metadata['files'] = {var: [_shard_filename(var, i) for i in range(len(shards))] for var in varnames}
+        with open(os.path.join(out, METADATA_FILE), 'w') as f:
+            json.dump(metadata, f, indent=1)
+    return stats
+
+
+def _shard_filename(var, ishard):
+    '''returns name of file for var & ishard, for npy-shards format.'''
+    return f'{var}_{ishard:05d}.npy'
+
+
+def _export_shard(out, format, varnames, ishard, snaps, shard_size, shape, dtype, method, kw__method):
+    '''export one shard (snaps) of all varnames. returns dict of stats {var: stats}.
+    Uses _EXPORT_OBJ (set by export_dataset), so that it works in forked processes.
+    '''
+    obj = _EXPORT_OBJ
+    getter = getattr(obj, method)
+    i0 = ishard * shard_size
+    if format == 'zarr':
+        group = zarr.open_group(out, mode='r+')
+    result = dict()
+    for var in varnames:
+        if format == 'zarr':
+            arr = group[var]
+            buffer = np.empty((len(snaps), *shape), dtype=dtype)
+        else:
+            buffer = np.lib.format.open_memmap(os.path.join(out, _shard_filename(var, ishard)),
+                                               mode='w+', dtype=dtype, shape=(len(snaps), *shape))
+        stats = None
+        for i, snap in enumerate(snaps):
+            if ishard == 0 and i == 0 and var == varnames[0]:
+                buffer[i] = _EXPORT_FIRST   # already computed by export_dataset.
+            else:
+                getter(var, snap, out=buffer[i], **kw__method)   # written directly into the shard.
+            stats = merge_stats(stats, array_stats(buffer[i]))
+        if format == 'zarr':
+            arr[i0:i0+len(snaps)] = buffer
+        else:
+            buffer.flush()
+        del buffer
+        result[var] = stats
+    return result
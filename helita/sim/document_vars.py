@@ -43,12 +43,20 @@ vardict = {
 
 import copy  # for deepcopy for QuantTree
 # import built-ins
+import json  # for saving profiling results
 import math  # for pretty strings
+import time  # for profiling
+import weakref  # for refering to parent in QuantProfiler without making circular reference.
 import functools
+import tracemalloc  # for profiling memory
 import collections
 
+# import external public modules
+import numpy as np
+
 # import internal modules
 from . import units  # not used heavily; just here for setting defaults, and setting obj.get_units
+from . import stagger  # for counting stagger operations while profiling
 from . import tools
 
 VARDICT = 'vardict'  # name of attribute (of obj) which should store documentation about vars.
@@ -571,6 +579,7 @@ class QuantTree:
         self.children = []
         self._level = level
         self.hide_level = None
+        self.stats = dict()  # optional info about this node, e.g. from dry runs (see QuantPlan).
 
     def add_child(self, child, adjusted_level=False):
         '''add child to self.
@@ -794,8 +803,9 @@ def restore_quant_tracking_state(obj, state):
             q = child_to_add.data._asdict()
             q['level'] = str(q['level']) + ' (FROM CACHE)'
             child_to_add.data = QuantInfo(**q)
-    # add child to obj_tree.
-    obj_tree.add_child(child_to_add, adjusted_level=True)
+    # add child to obj_tree. Mark it, so that we know it came from cache.
+    added = obj_tree.add_child(child_to_add, adjusted_level=True)
+    added.stats = dict(added.stats, from_cache=True)
     setattr(obj, QUANTS_TREE, obj_tree)
     # set QUANT_SELECTED.
     selected = state.get('quant_selected', QuantInfo(None))
@@ -917,3 +927,246 @@ def get_quant_info(obj, lookup_in_vardict=False):
         return quant_lookup(obj, quant_info)
     else:
         return quant_info
+
+
+''' ----------------------------- quant tracking - planning ----------------------------- '''
+
+# defaults for estimating cost of getting a quant (see estimate_tree_cost)
+PLAN_READ_RATE = 500e6   # assumed rate of reading data from disk [bytes / second].
+PLAN_FLOP_RATE = 1e9     # assumed rate of doing arithmetic [floating point operations / second].
+PLAN_FLOPS_PER_CELL = {  # assumed number of floating point operations per cell, by typequant.
+    'INTERP_QUANT': 12,  # (5th order stagger operation)
+    'CENTER_QUANT': 36,  # (up to 3 stagger operations)
+}
+PLAN_FLOPS_PER_CELL_DEFAULT = 1   # per child, for typequants not in PLAN_FLOPS_PER_CELL.
+
+QuantPlan = collections.namedtuple('QuantPlan', ('tree', 'reads', 'nbytes_read', 'peak_ntemp', 'peak_nbytes',
+                                                 'nflops', 'time_estimate'),
+                                   defaults=[None, [], 0, 0, 0, 0, 0])
+#          tree: QuantTree of quants which would be gotten. tree.stats tells size, nbytes, etc of each node.
+#         reads: list of dicts with info about the simple-var data which would be read from files.
+#   nbytes_read: total number of bytes which would be read from files.
+#    peak_ntemp: peak number of arrays which would be simultaneously in memory.
+#   peak_nbytes: peak number of bytes which would be simultaneously in memory (from those arrays).
+#        nflops: estimated number of floating point operations.
+# time_estimate: estimated time [seconds] based on nbytes_read, nflops, PLAN_READ_RATE, and PLAN_FLOP_RATE.
+
+
+def estimate_tree_cost(tree):
+    '''returns (peak_ntemp, peak_nbytes, nflops) for getting the quant of tree (a QuantTree from a dry run).
+
+    Children are assumed to be gotten one at a time, with each child's result kept in memory
+    until the parent quant is computed from them. Quants from files ('simple' in stats) and quants
+    already in memory ('from_cache' in stats) cost one array each, and no arithmetic.
+    Nodes which don't know their nbytes (e.g. quants which don't return arrays) are treated as size 0.
+    '''
+    nbytes = tree.stats.get('nbytes', 0)
+    if tree.stats.get('simple', False) or tree.stats.get('from_cache', False) or len(tree.children) == 0:
+        return (1, nbytes, 0)
+    peak_ntemp = peak_nbytes = 0
+    held_ntemp = held_nbytes = 0
+    nflops = 0
+    for child in tree.children:
+        child_ntemp, child_nbytes, child_nflops = estimate_tree_cost(child)
+        peak_ntemp = max(peak_ntemp, held_ntemp + child_ntemp)
+        peak_nbytes = max(peak_nbytes, held_nbytes + child_nbytes)
+        held_ntemp += 1
+        held_nbytes += child.stats.get('nbytes', 0)
+        nflops += child_nflops
+    peak_ntemp = max(peak_ntemp, held_ntemp + 1)
+    peak_nbytes = max(peak_nbytes, held_nbytes + nbytes)
+    typequant = getattr(tree.data, 'typequant', None)
+    flops_per_cell = PLAN_FLOPS_PER_CELL.get(typequant, PLAN_FLOPS_PER_CELL_DEFAULT * len(tree.children))
+    nflops += flops_per_cell * tree.stats.get('size', 0)
+    return (peak_ntemp, peak_nbytes, nflops)
+
+
+def quant_plan(tree, reads=[], read_rate=None, flop_rate=None):
+    '''returns QuantPlan for tree (a QuantTree from a dry run) and reads (list of dicts with key 'nbytes').
+    read_rate, flop_rate: None or number
+        rates to assume when estimating time. None --> use PLAN_READ_RATE, PLAN_FLOP_RATE.
+    '''
+    read_rate = PLAN_READ_RATE if read_rate is None else read_rate
+    flop_rate = PLAN_FLOP_RATE if flop_rate is None else flop_rate
+    peak_ntemp, peak_nbytes, nflops = estimate_tree_cost(tree)
+    nbytes_read = sum(read['nbytes'] for read in reads)
+    time_estimate = nbytes_read / read_rate + nflops / flop_rate
+    return QuantPlan(tree=tree, reads=reads, nbytes_read=nbytes_read,
+                     peak_ntemp=peak_ntemp, peak_nbytes=peak_nbytes,
+                     nflops=nflops, time_estimate=time_estimate)
+
+
+''' ----------------------------- quant tracking - profiling ----------------------------- '''
+
+PROFILER = 'profiler'   # attr of obj which stores the active QuantProfiler, if any.
+SIMPLE_TYPEQUANTS = ('SIMPLE_VARS', 'SIMPLE_XY_VAR')   # typequants for quants which are read directly from files.
+
+
+class QuantProfiler():
+    '''profiles calls to get_var, recording info in the nodes of the quant tree.
+    Use as a context manager, or set as obj.profiler; e.g.:
+        with dd.profiling() as prof:
+            dd('b2')
+        print(prof.trees[-1].str())   # the quant tree, as from got_vars_tree.
+        prof.save('b2.json')          # trace for chrome://tracing or https://ui.perfetto.dev
+        prof.save('b2.folded')        # input for flamegraph.pl or https://www.speedscope.app
+
+    For each quant gotten (i.e. each call to _load_quantity), node.stats will contain:
+        start       - time [s] (since profiler was created) when getting the quant started.
+        wall_time   - total time [s] spent getting this quant, including getting its dependencies.
+        self_time   - wall_time minus wall_time of its dependencies.
+        bytes_read  - bytes which will be read from files (memmaps or zarr) for this quant.
+                      (nonzero only for quants which are stored directly in files.)
+        bytes_allocated - if trace_memory, net bytes allocated (via tracemalloc) while getting quant.
+                      Else, nbytes of the result, unless the result is a memmap or from cache.
+        peak_bytes  - (only if trace_memory) peak bytes allocated while getting quant.
+        from_cache  - whether the result came from a cache (obj.cache, or get_vars shared intermediates).
+        stagger_ops - number of stagger operations done while getting quant (excluding dependencies).
+    '''
+
+    def __init__(self, obj, trace_memory=False):
+        self.parent = weakref.ref(obj)
+        self.trace_memory = trace_memory
+        self.trees = []   # QuantTree from each top-level call to _load_quantity, oldest first.
+        self._stack = []
+        self._t0 = time.perf_counter()
+
+    def __enter__(self):
+        obj = self.parent()
+        self._prev_profiler = getattr(obj, PROFILER, None)
+        setattr(obj, PROFILER, self)
+        if self.trace_memory:
+            self._was_tracing = tracemalloc.is_tracing()
+            if not self._was_tracing:
+                tracemalloc.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        setattr(self.parent(), PROFILER, self._prev_profiler)
+        if self.trace_memory and not self._was_tracing:
+            tracemalloc.stop()
+
+    def _begin(self):
+        '''start tracking a call to _load_quantity.'''
+        frame = dict(start=time.perf_counter(), children_time=0, children_stagger_ops=0,
+                     stagger_ops=sum(stagger.OPS_COUNTER.values()))
+        if self.trace_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if len(self._stack) > 0:   # remember peak so far in the parent, before resetting peak.
+                self._stack[-1]['peak'] = max(self._stack[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+            frame.update(current=current, peak=current)
+        self._stack.append(frame)
+
+    def _end(self, node, val):
+        '''finish tracking a call to _load_quantity. Put results in node.stats.'''
+        end = time.perf_counter()
+        frame = self._stack.pop()
+        wall_time = end - frame['start']
+        stagger_ops = sum(stagger.OPS_COUNTER.values()) - frame['stagger_ops']
+        from_cache = node.stats.get('from_cache', False)
+        typequant = getattr(node.data, 'typequant', None)
+        if isinstance(val, np.memmap) or (typequant in SIMPLE_TYPEQUANTS and not from_cache):
+            bytes_read = getattr(val, 'nbytes', 0)
+        else:
+            bytes_read = 0
+        stats = dict(start=frame['start'] - self._t0, wall_time=wall_time,
+                     self_time=wall_time - frame['children_time'],
+                     bytes_read=bytes_read, from_cache=from_cache,
+                     stagger_ops=stagger_ops - frame['children_stagger_ops'])
+        if 'current' in frame:
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(frame['peak'], peak)
+            stats.update(bytes_allocated=current - frame['current'], peak_bytes=peak - frame['current'])
+            tracemalloc.reset_peak()
+        else:
+            fresh = isinstance(val, np.ndarray) and not (isinstance(val, np.memmap) or from_cache)
+            stats.update(bytes_allocated=val.nbytes if fresh else 0)
+        node.stats = dict(node.stats, **stats)
+        if len(self._stack) > 0:
+            parent_frame = self._stack[-1]
+            parent_frame['children_time'] += wall_time
+            parent_frame['children_stagger_ops'] += stagger_ops
+            if 'current' in frame:
+                parent_frame['peak'] = max(parent_frame['peak'], peak)
+        else:
+            self.trees.append(node)
+
+    def clear(self):
+        '''forget all profiling results.'''
+        self.trees = []
+
+    def to_folded(self, time_units=1e-6):
+        '''returns "folded" (collapsed) stacks of self time, as used by flamegraph.pl and speedscope.
+        Each line looks like 'var0;var1;var2 N', where N is the self time of var2 in time_units [s].
+        '''
+        lines = []
+
+        def _fold(node, prefix):
+            name = _profile_node_name(node)
+            stack = name if prefix == '' else (prefix + ';' + name)
+            lines.append('{} {}'.format(stack, int(round(node.stats.get('self_time', 0) / time_units))))
+            if not node.stats.get('from_cache', False):
+                for child in node.children:
+                    _fold(child, stack)
+        for tree in self.trees:
+            _fold(tree, '')
+        return '\n'.join(lines)
+
+    def to_trace_events(self):
+        '''returns list of trace events (dicts), in the Chrome trace event format ('X' = complete events).'''
+        events = []
+
+        def _trace(node):
+            stats = node.stats
+            args = {key: stats[key] for key in ('self_time', 'bytes_read', 'bytes_allocated', 'peak_bytes',
+                                                 'from_cache', 'stagger_ops') if key in stats}
+            if isinstance(node.data, QuantInfo):
+                args.update(quant=node.data.quant, typequant=node.data.typequant, metaquant=node.data.metaquant)
+            events.append(dict(name=_profile_node_name(node), ph='X', pid=0, tid=0,
+                               ts=stats.get('start', 0) * 1e6, dur=stats.get('wall_time', 0) * 1e6,
+                               args=args))
+            if not stats.get('from_cache', False):
+                for child in node.children:
+                    _trace(child)
+        for tree in self.trees:
+            _trace(tree)
+        return events
+
+    def save(self, filename):
+        '''save results to filename. '.json' --> trace events (see to_trace_events). Else --> folded stacks.'''
+        if filename.endswith('.json'):
+            with open(filename, 'w') as f:
+                json.dump(dict(traceEvents=self.to_trace_events()), f, default=str)
+        else:
+            with open(filename, 'w') as f:
+                f.write(self.to_folded() + '\n')
+
+    def __repr__(self):
+        return '<QuantProfiler with {} top-level quant trees>'.format(len(self.trees))
+
+
+def _profile_node_name(node):
+    '''name of node in profiling results. (';' and ' ' are removed, for folded stacks format.)'''
+    varname = getattr(node.data, 'varname', None)
+    return str(varname).replace(';', '_').replace(' ', '_')
+
+
+def quant_profiling(f):
+    '''decorator which profiles f (e.g. _load_quantity) if obj has an active QuantProfiler (see QuantProfiler).'''
+    @functools.wraps(f)
+    def f_but_profiling(obj, varname, *args, **kwargs):
+        __tracebackhide__ = HIDE_DECORATOR_TRACEBACKS
+        profiler = getattr(obj, PROFILER, None)
+        if (profiler is None) or (varname == '') or creating_vardict(obj):
+            return f(obj, varname, *args, **kwargs)
+        profiler._begin()
+        try:
+            result = f(obj, varname, *args, **kwargs)
+        except BaseException:
+            profiler._stack.pop()
+            raise
+        node = getattr(obj, QUANTS_TREE).get_child(-1)
+        profiler._end(node, result)
+        return result
+    return f_but_profiling
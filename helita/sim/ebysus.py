@@ -55,6 +55,8 @@ from .bifrost import (  # for historical reasons / convenience, also import dire
     snaps_info,
     snapstuff,
     subs2grph,
+    trans2comm_into,
+    trans2comm_varname,
 )
 from .load_arithmetic_quantities import load_arithmetic_quantities
 from .load_fromfile_quantities import load_fromfile_quantities
@@ -632,6 +634,8 @@ class EbysusData(fluid_tools.Multifluid, BifrostData):
         return val
 
     @tools.maintain_attrs('match_type', 'ifluid', 'jfluid')
+    @document_vars.quant_profiling
+    @file_memory.with_shared_intermediates
     @file_memory.with_caching(cache=False, check_cache=True, cache_with_nfluid=None)
     @document_vars.quant_tracking_top_level
     def _load_quantity(self, var, panic=False):
@@ -785,115 +789,147 @@ class EbysusData(fluid_tools.Multifluid, BifrostData):
         self.varn['by'] = 'by'
         self.varn['bz'] = 'bz'
 
-    def simple_trans2comm(self, varname, snap=None, mf_ispecies=None, mf_ilevel=None, *args, **kwargs):
-        ''' Simple form of trans2com, can select species and ionized level'''
+    def simple_trans2comm(self, varname, snap=None, mf_ispecies=None, mf_ilevel=None, *args, out=None, add=False, **kwargs):
+        ''' Simple form of trans2com, can select species and ionized level.
+            out: None or array. If provided, write result into out instead of allocating a new array.
+            add: bool. If True, add result to out (which must be provided) instead of overwriting it.
+        '''
 
         self.trans2commaxes()
 
         self.sel_units = 'cgs'
 
-        # Trying cgs
-
-        sign = 1.0
-        if varname[-1] in ['x', 'y', 'z']:
-
-            varname = varname+'c'
-            if varname[-2] in ['y', 'z']:
-                sign = -1.0
-
+        varname, sign = trans2comm_varname(varname)
         var = self.get_var(varname, snap=snap, mf_ispecies=mf_ispecies, mf_ilevel=mf_ilevel, *args, **kwargs)
-        var = sign * var
-
-        var = var[..., ::-1].copy()
 
-        return var
+        return trans2comm_into(var, sign, out=out, add=add)
 
-    def total_trans2comm(self, varname, snap=None, *args, **kwargs):
+    def total_trans2comm(self, varname, snap=None, *args, out=None, **kwargs):
         ''' Trans2comm that sums the selected variable over all species and levels.
             For variables that do not change through species simple_trans2comm is used
-            with the default specie. '''
-
-        if varname in self.varn.keys():
-            varname = self.varn[varname]
-
-        # # # # # Helping dictionaries # # # # #
-
-        # Electron variables
-        e_variables = {'r': 're', 'ux': 'uex', 'uy': 'uey', 'uz': 'uez', 'tg': 'etg', 'px': 'pex', 'py': 'pey', 'pz': 'pez'}
-
-        # Instead of using ux or similar, uix with the specific fluid is used
-        i_variables = {'ux': 'uix', 'uy': 'uiy', 'uz': 'uiz', 'px': 'pix', 'py': 'piy', 'pz': 'piz'}
-
-        # Different variables add in different ways
-
-        # # # # # Density # # # # #
-        # Since it is the same volume, density just adds
-        if varname == 'r':
-            var = self.simple_trans2comm(e_variables[varname], snap, *args, **kwargs)
-
-            for fluid in self.fluids.SL:
-                var += self.simple_trans2comm(varname, snap, mf_ispecies=fluid[0], mf_ilevel=fluid[1], *args, **kwargs)
-
-            return var
-
-        # # # # # Momentum # # # # #
-        # Momentum just adds.
-        if varname in ['px', 'py', 'pz', 'pix', 'piy', 'piz']:
-            # e variables are giving problems for some reason, the next line could be removed if necesary
-            var = self.simple_trans2comm(e_variables[varname], snap, *args, **kwargs)
-
-            for fluid in self.fluids.SL:
-                var += self.simple_trans2comm(i_variables[varname], snap, mf_ispecies=fluid[0], mf_ilevel=fluid[1], *args, **kwargs)
-
-            return var
-
-        # # # # # Velocity # # # # #
-        # Velocity depends on the density and the momentum of each fluid
-        # Ux = Px/rho
-        # trying recursivity for rho
-        if varname in ['ux', 'uy', 'uz', 'uix', 'uiy', 'uiz']:
-            axis = varname[-1]
-
-            # px = sum_j rho_j*ux_j
-
-            # e contribution to velocity, could be removed
-            var1 = self.simple_trans2comm(e_variables['r'], snap, *args, **kwargs) * self.simple_trans2comm(e_variables['p'+axis], snap, *args, **kwargs)
-
-            for fluid in self.fluids.SL:
-                specie_rho = self.simple_trans2comm('r', snap, mf_ispecies=fluid[0], mf_ilevel=fluid[1], *args, **kwargs)
-                specie_pi = self.simple_trans2comm(i_variables['p'+axis], snap, mf_ispecies=fluid[0], mf_ilevel=fluid[1], *args, **kwargs)
-                var1 += specie_rho*specie_pi
-
-            # rho, recursive
-            var2 = self.total_trans2comm('r', snap=None, *args, **kwargs)
-
-            return var1/var2
-
-        # # # # # Temperature # # # # #
-        # Temperature depends on density, mass and temperature of each fluid
-        # T_total = [ sum_j (rho_j/m_j)*tg_j ]/[ sum_j (rho_j/m_j) ]
-        #         = alpha/beta
-
-        if varname in ['tg', 'temperature']:
-
-            n_e = self.simple_trans2comm('er', snap, *args, **kwargs)*self.uni.u_r/self.get_mass(-1, units='cgs')
-            tgi_e = self.simple_trans2comm('etg', snap, *args, **kwargs)
+            with the default specie.
+            out: None or array. If provided, write result into out instead of allocating a new array.
+            See total_trans2comm_many for details; use it directly to get multiple variables at once.
+        '''
+        outs = None if out is None else {varname: out}
+        return self.total_trans2comm_many([varname], snap, *args, out=outs, **kwargs)[varname]
 
-            alpha = n_e * tgi_e
-            beta = n_e
+    def total_trans2comm_many(self, varnames, snap=None, *args, out=None, **kwargs):
+        ''' total_trans2comm for multiple variables at once. Returns dict of {varname: array}.
 
-            for fluid in self.fluids.SL:
-                n = self.simple_trans2comm('r', snap, mf_ispecies=fluid[0], mf_ilevel=fluid[1], *args, **kwargs)*self.uni.u_r/self.get_mass((fluid[0], fluid[1]), units='cgs')
-                tgi = self.simple_trans2comm('tg', snap, mf_ispecies=fluid[0], mf_ilevel=fluid[1], *args, **kwargs)
+            All totals are accumulated in place (in the output arrays), one fluid at a time,
+            and each fluid's density is read once, then shared by density, velocity, and
+            temperature totals.
 
-                alpha += n*tgi
-                beta += n
+            out: None or dict of {varname: array}.
+                write result for varname into out[varname] (if provided) instead of a new array.
 
-            return alpha/beta
+            How variables add:
+                density ('r'): sum_j r_j
+                momentum ('px', 'pix', ...): sum_j p_j
+                velocity ('ux', 'uix', ...): [sum_j r_j * p_j] / [sum_j r_j]
+                temperature ('tg'): [sum_j (r_j/m_j) * tg_j] / [sum_j (r_j/m_j)]
+            where sums include electrons and all fluids in self.fluids.SL.
+        '''
+        self.trans2commaxes()
+        self.sel_units = 'cgs'
+        out = dict() if out is None else dict(out)
+        result = dict()
+        # # # # # sort varnames by how they add # # # # #
+        densities, momenta, velocities, temperatures = [], [], [], []
+        for name in varnames:
+            var = self.varn.get(name, name)
+            if var == 'r':
+                densities.append(name)
+            elif var in ['px', 'py', 'pz', 'pix', 'piy', 'piz']:
+                momenta.append(name)
+            elif var in ['ux', 'uy', 'uz', 'uix', 'uiy', 'uiz']:
+                velocities.append(name)
+            elif var in ['tg', 'temperature']:
+                temperatures.append(name)
+            else:  # For variables that do not deppend on the specie
+                result[name] = self.simple_trans2comm(var, snap, *args, out=out.get(name), **kwargs)
+        if not (densities or momenta or velocities or temperatures):
+            return result
 
-        # # # # # All other variables # # # # #
-        # For variables that do not deppend on the specie
-        return self.simple_trans2comm(varname, snap, *args, **kwargs)
+        # # # # # helper functions # # # # #
+        def get_raw(var, fluid):
+            '''returns (var, sign), where simple_trans2comm(var) == sign * var[..., ::-1].'''
+            var, sign = trans2comm_varname(var)
+            mf_ispecies, mf_ilevel = fluid
+            return self.get_var(var, snap=snap, mf_ispecies=mf_ispecies, mf_ilevel=mf_ilevel, *args, **kwargs), sign
+
+        buffers = dict()   # {key: running sum}, in trans2comm orientation.
+        # density & momentum sums are results, so accumulate those directly into out, if provided.
+        buffers_out = dict()
+        for name in densities[:1] + momenta:
+            buffers_out.setdefault(('r' if name in densities else 'p'+self.varn.get(name, name)[-1]), out.get(name))
+
+        def accumulate(key, val, sign=1.0):
+            '''buffers[key] += sign * val[..., ::-1], creating buffers[key] if needed.'''
+            if key not in buffers:
+                buffers[key] = trans2comm_into(val, sign, out=buffers_out.get(key))
+            else:
+                trans2comm_into(val, sign, out=buffers[key], add=True)
+
+        scratch = dict()
+
+        def product(key, a, b):
+            '''returns a * b, in scratch[key] (reused across fluids).'''
+            if key not in scratch:
+                scratch[key] = np.empty(np.broadcast(a, b).shape, dtype=np.result_type(a, b))
+            return np.multiply(a, b, out=scratch[key])
+
+        # # # # # loop through fluids, electrons first # # # # #
+        p_axes = sorted(set(self.varn.get(name, name)[-1] for name in momenta + velocities))
+        for fluid in [None] + list(self.fluids.SL):
+            is_e = fluid is None
+            ifluid = (None, None) if is_e else (fluid[0], fluid[1])
+            rho = None
+            if densities or velocities or temperatures:
+                rho, _ = get_raw('re' if is_e else 'r', ifluid)
+                if densities or velocities:
+                    accumulate('r', rho)
+            for axis in p_axes:
+                p, sign = get_raw(('pe' if is_e else 'pi') + axis, ifluid)
+                if any(self.varn.get(name, name)[-1] == axis for name in momenta):
+                    accumulate('p'+axis, p, sign)
+                if any(self.varn.get(name, name)[-1] == axis for name in velocities):
+                    accumulate('rp'+axis, product('rp', rho, p), sign)
+            if temperatures:
+                mass = self.get_mass(-1 if is_e else ifluid, units='cgs')
+                n = product('n', rho, 1.0 / mass)   # number density (up to a constant factor)
+                accumulate('n', n)
+                tg, _ = get_raw('etg' if is_e else 'tg', ifluid)
+                accumulate('ntg', np.multiply(n, tg, out=n))
+
+        # # # # # combine sums into results # # # # #
+        # names which share a sum (e.g. 'ux' and 'uix') get the result computed for the first one;
+        # later aliases get a copy of it (into out[name], if provided).
+        computed = dict()   # {key: result}
+
+        def combine(name, key, compute):
+            if key not in computed:
+                computed[key] = compute()
+                return computed[key]
+            if out.get(name) is None:
+                return computed[key].copy()
+            np.copyto(out[name], computed[key])
+            return out[name]
+
+        for name in densities:
+            result[name] = combine(name, 'r', lambda: buffers['r'])
+        for name in momenta:
+            key = 'p'+self.varn.get(name, name)[-1]
+            result[name] = combine(name, key, lambda: buffers[key])
+        for name in velocities:
+            key = 'rp'+self.varn.get(name, name)[-1]
+            result[name] = combine(name, key, lambda: np.divide(buffers[key], buffers['r'],
+                                                                out=out.get(name, buffers[key])))
+        for name in temperatures:
+            result[name] = combine(name, 'ntg', lambda: np.divide(buffers['ntg'], buffers['n'],
+                                                                  out=out.get(name, buffers['ntg'])))
+        return result
 
     @document_vars.quant_tracking_simple('SIMPLE_VARS')
     def _get_simple_var(self, var, order='F', mode='r', panic=False, *args, **kwargs):
@@ -971,6 +1007,10 @@ class EbysusData(fluid_tools.Multifluid, BifrostData):
         elif self.read_mode == 'zc':
             # << note that 'zc' read_mode ignores order, mode, and **kwargs
             filename, array_n = self._get_simple_var_file_meta(var, panic=panic, _meta_as_index=True)
+            if file_memory.is_planning(self):   # dry run; don't read the data.
+                z = zarr.open(filename, mode='r')
+                shape = z.shape if array_n is None else z.shape[:-1]
+                return file_memory.planning_placeholder(self, z, filename=filename, shape=shape)
             result = load_zarr(filename, array_n)
         else:
             raise NotImplementedError(f'EbysusData.read_mode = {read_mode}')
@@ -28,6 +28,7 @@ import sys  # for debugging 'too many files' crash; will be removed in the futur
 import time  # for time profiling for caching
 import weakref  # for refering to parent in cache without making circular reference.
 # import builtins
+import copy  # for deepcopy of quant trees in SharedIntermediates
 import resource
 import warnings
 import functools
@@ -675,6 +676,239 @@ class Caching():
         pass
 
 
+''' --------------------- shared intermediates --------------------- '''
+
+SHARED_INTERMEDIATES = '_shared_intermediates'   # attr of obj which stores the active SharedIntermediates, if any.
+
+
+class SharedIntermediates():
+    '''share the intermediate results of get_var across many calls to get_var.
+    (Used by BifrostData.get_vars. Decorate _load_quantity with with_shared_intermediates to enable.)
+
+    An intermediate is identified by its var name and obj._metadata(); values with different
+    metadata (e.g. different snap or ifluid) are never shared. Requires obj._metadata_matches().
+
+    There are two modes:
+        dry_run=True  --> plan. Count how many times each intermediate is requested.
+                          Simple vars are replaced by tiny placeholder arrays (see planning_placeholder),
+                          so no data is read. Caching is disabled while planning.
+                          Also, record self.reads (info about the data which would be read), and
+                          node.stats for each node in the quant tree (see document_vars.QuantPlan).
+                          if share=False, repeated intermediates are re-evaluated during the dry run,
+                          as they would be by get_var outside of SharedIntermediates.
+        dry_run=False --> evaluate. Each intermediate which the plan says is requested more than once
+                          is computed once, then remembered until its last requester gets it.
+                          Intermediates which are not in the plan are never remembered.
+
+    Example:
+        with SharedIntermediates(dd, dry_run=True) as plan:
+            for var in vars:
+                dd(var)
+        with SharedIntermediates(dd, plan=plan):
+            result = {var: dd(var) for var in vars}
+    '''
+
+    def __init__(self, obj, plan=None, dry_run=False, share=True):
+        self.parent = weakref.ref(obj)
+        self.plan = plan
+        self.dry_run = dry_run
+        self.share = share
+        self.reads = []   # (only used if dry_run) list of dicts with info about data which would be read.
+        self.performance = dict(N_shared=0, N_computed=0, peak_Nremembered=0)
+        self._content = dict()   # {var: list of entries}; each entry is a dict with keys:
+        #   metadata: obj._metadata() when the entry was computed.
+        #   value: the value of var.
+        #   uses: number of times var has been requested (if dry_run), else number of uses remaining.
+        #   qtracking_state: document_vars quant tracking state; restored whenever entry is used.
+        self._Nremembered = 0
+
+    def __enter__(self):
+        obj = self.parent()
+        self._prev_shared = getattr(obj, SHARED_INTERMEDIATES, None)
+        setattr(obj, SHARED_INTERMEDIATES, self)
+        if self.dry_run:   # never cache placeholder values, and don't profile them either.
+            self._prev_do_caching = getattr(obj, 'do_caching', None)
+            obj.do_caching = False
+            self._prev_profiler = getattr(obj, document_vars.PROFILER, None)
+            setattr(obj, document_vars.PROFILER, None)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        obj = self.parent()
+        setattr(obj, SHARED_INTERMEDIATES, self._prev_shared)
+        if self.dry_run:
+            if self._prev_do_caching is None:
+                del obj.do_caching
+            else:
+                obj.do_caching = self._prev_do_caching
+            setattr(obj, document_vars.PROFILER, self._prev_profiler)
+        else:
+            self.clear()   # forget leftovers (e.g. if the plan disagreed with what actually happened).
+
+    def find(self, var):
+        '''return entry for var which matches the current metadata of self.parent(), or None.'''
+        obj = self.parent()
+        for entry in self._content.get(var, []):
+            if obj._metadata_matches(entry['metadata']):
+                return entry
+        return None
+
+    def planned_uses(self, var):
+        '''return number of times var (with current metadata) is requested, according to self.plan.'''
+        if self.plan is None:
+            return 0
+        entry = self.plan.find(var)
+        return 0 if entry is None else entry['uses']
+
+    def get(self, var):
+        '''return (True, value) if var is remembered; else (False, None).
+        Forgets the value if this was its last planned use.
+        '''
+        entry = self.find(var)
+        if entry is None:
+            return (False, None)
+        if self.dry_run:
+            entry['uses'] += 1
+            if not self.share:
+                return (False, None)
+        else:
+            entry['uses'] -= 1
+            if entry['uses'] <= 0:
+                self._forget(var, entry)
+            self.performance['N_shared'] += 1
+        document_vars.restore_quant_tracking_state(self.parent(), entry['qtracking_state'])
+        value = entry['value']
+        if (not self.dry_run) and (entry['uses'] > 0):
+            # copy ensures remembered value isn't altered even if the requester edits it in-place.
+            # (no copy needed for the last use; nothing else will see the remembered value.)
+            value = _copy_value(value)
+        return (True, value)
+
+    def remember(self, var, val, reads=[]):
+        '''remember val as the value of var, if var will be requested again.
+        returns the value to use from now on (memmaps are read into memory, so they are read only once).
+
+        reads: list (only used if dry_run)
+            info about the data which would be read while getting var. (A subset of self.reads.)
+        '''
+        obj = self.parent()
+        if self.dry_run:
+            self._record_stats(val, reads)
+            if self.find(var) is not None:   # (only possible if not self.share)
+                return val
+            uses = 1
+            remembered = val
+        else:
+            self.performance['N_computed'] += 1
+            uses = self.planned_uses(var) - 1
+            if uses <= 0:
+                return val
+            if isinstance(val, np.memmap):
+                val = np.array(val)
+            # remember a copy, so that the value is unaffected if the requester edits val in-place.
+            remembered = _copy_value(val)
+        qtracking_state = document_vars.get_quant_tracking_state(obj)
+        # copy the tree; restoring state edits it, but the original tree should stay unchanged.
+        qtracking_state['quants_tree'] = copy.deepcopy(qtracking_state['quants_tree'])
+        entry = dict(metadata=obj._metadata(), value=remembered, uses=uses, qtracking_state=qtracking_state)
+        self._content.setdefault(var, []).append(entry)
+        self._Nremembered += 1
+        self.performance['peak_Nremembered'] = max(self.performance['peak_Nremembered'], self._Nremembered)
+        return val
+
+    def _record_stats(self, val, reads=[]):
+        '''record info about val (just gotten by _load_quantity, during a dry run) in the newest node of the quant tree.
+        reads: info about the data which would be read while getting val.
+        '''
+        obj = self.parent()
+        node = getattr(obj, document_vars.QUANTS_TREE).get_child(-1)
+        simple = (len(node.children) == 0) and (len(reads) > 0)   # val comes directly from a file.
+        ndim = np.ndim(val)
+        if simple:
+            size = int(np.prod(reads[-1]['shape']))
+        elif ndim >= 2:
+            size = int(np.prod(obj.shape[:ndim]))
+        else:
+            size = int(np.size(val))
+        dtype = np.asarray(val).dtype
+        node.stats.update(size=size, nbytes=size * dtype.itemsize, dtype=dtype, simple=simple,
+                          nbytes_read=sum(read['nbytes'] for read in reads))
+
+    def _forget(self, var, entry):
+        self._content[var].remove(entry)
+        self._Nremembered -= 1
+
+    def clear(self):
+        '''forget all remembered values.'''
+        self._content = dict()
+        self._Nremembered = 0
+
+    def __repr__(self):
+        mode = 'planning' if self.dry_run else 'sharing'
+        vars = [var for var, entries in self._content.items() if len(entries) > 0]
+        return '<{} ({}) remembering {} values from vars: {}>'.format(
+            object.__repr__(self), mode, self._Nremembered, vars)
+
+
+def _copy_value(val):
+    '''return copy of val if it is an array (which could be edited in-place), else val.'''
+    if isinstance(val, np.ndarray):
+        return np.array(val, copy=True, subok=True)
+    return val
+
+
+def with_shared_intermediates(f):
+    '''decorate f(obj, var, ...) (e.g. _load_quantity) so that it uses obj's active SharedIntermediates, if any.'''
+    @functools.wraps(f)
+    def f_but_sharing_intermediates(obj, var, *args_f, **kwargs_f):
+        __tracebackhide__ = HIDE_DECORATOR_TRACEBACKS
+        shared = getattr(obj, SHARED_INTERMEDIATES, None)
+        if (shared is None) or (var == '') or document_vars.creating_vardict(obj):
+            return f(obj, var, *args_f, **kwargs_f)
+        found, val = shared.get(var)
+        if not found:
+            nreads = len(shared.reads)
+            val = f(obj, var, *args_f, **kwargs_f)
+            if val is not None:
+                val = planning_placeholder(obj, val)
+                val = shared.remember(var, val, reads=shared.reads[nreads:])
+        return val
+    return f_but_sharing_intermediates
+
+
+def planning_placeholder(obj, val, filename=None, shape=None):
+    '''if obj is planning (see is_planning) and val is a memmap,
+    return a tiny placeholder array (all ones) with the same ndim and dtype as val,
+    and record info about the data which would have been read in obj's SharedIntermediates.reads.
+    Otherwise, return val, unchanged.
+
+    filename, shape: None or values
+        if provided, val can be any lazily-loaded array with dtype and shape (e.g. a zarr array).
+        shape (if provided) overrides val.shape; use if only part of val would be read.
+    '''
+    if not is_planning(obj):
+        return val
+    if isinstance(val, np.memmap):
+        filename = val.filename if filename is None else filename
+        offset = val.offset
+    elif filename is None:
+        return val
+    else:
+        offset = None
+    shape = val.shape if shape is None else shape
+    dtype = np.dtype(val.dtype)
+    read = dict(filename=filename, offset=offset, shape=tuple(shape), dtype=dtype,
+                nbytes=int(np.prod(shape)) * dtype.itemsize)
+    getattr(obj, SHARED_INTERMEDIATES).reads.append(read)
+    return np.ones((1,) * len(shape), dtype=dtype)
+
+
+def is_planning(obj):
+    '''return whether obj is planning, i.e. inside SharedIntermediates(obj, dry_run=True).'''
+    shared = getattr(obj, SHARED_INTERMEDIATES, None)
+    return (shared is not None) and shared.dry_run
+
+
 def _dict_matches(A, B, subset_ok=True, ignore_keys=[]):
     '''returns whether A matches B for dicts A, B.
 
@@ -42,6 +42,7 @@ except ImportError as err:
 
 # import external public modules
 import numpy as np
+import scipy.fft
 
 # import the relevant things from the internal module "units"
 from .units import DIMENSIONLESS, UNI, UNITS_FACTOR_1, UNI_length, Usym
@@ -415,6 +416,8 @@ _HORVAR_QUANT = ('HORVAR_QUANT', ['horvar'])
 def get_horizontal_average(obj, quant):
     '''
     Computes horizontal average
+
+    Computed one z-slab at a time (see iter_z_slabs), to limit memory usage.
     '''
 
     if quant == '':
@@ -431,12 +434,14 @@ def get_horizontal_average(obj, quant):
 
     # Compares the variable with the horizontal mean
     if getq == 'horvar':
-        result = np.zeros_like(obj.r)
-        result += obj.get_var(quant[6:])  # base variable
-        horv = np.mean(np.mean(result, 0), 0)
-        for iix in range(0, getattr(obj, 'nx')):
-            for iiy in range(0, getattr(obj, 'ny')):
-                result[iix, iiy, :] = result[iix, iiy, :] / horv[:]
+        # fill result one z-slab at a time, so that only the result and one slab are in memory at once.
+        result = None
+        shape = obj.shape   # (shape of the full domain. Inside the loop, obj.shape is the shape of the slab.)
+        for zslice, val in iter_z_slabs(obj, quant[6:]):  # base variable
+            if result is None:
+                shape = shape if zslice != slice(None) else np.shape(val)
+                result = np.empty(shape, dtype=np.result_type(val, np.float32))
+            result[:, :, zslice] = val / np.mean(val, axis=(0, 1), dtype=np.float64)
         return result
     else:
         # quant is a horizontal_average quant but we did not handle it.
@@ -1146,14 +1151,17 @@ def get_angle(obj, quant):
 
 
 # default
-_STAT_QUANT = ('STAT_QUANT', ['mean_', 'variance_', 'std_', 'max_', 'min_', 'abs_'])
+_STAT_QUANT = ('STAT_QUANT', ['mean_', 'variance_', 'std_', 'max_', 'min_', 'abs_', 'hmean_'])
 # get value
 
 
 def get_stat_quant(obj, quant):
     '''statistics such as mean, std.
 
-    The result will be a single value (not a 3D array).
+    The result will be a single value (not a 3D array). (Except for abs_, and hmean_ which gives a 1D array.)
+
+    Statistics are computed one z-slab at a time (see iter_z_slabs),
+    so they work even if the full array of values would not fit in memory.
     '''
     if quant == '':
         docvar = document_vars.vars_documenter(obj, *_STAT_QUANT, get_stat_quant.__doc__)
@@ -1163,6 +1171,7 @@ def get_stat_quant(obj, quant):
         docvar('max_', 'max_v --> np.max(v)', uni=UNI.qc(0))
         docvar('min_', 'min_v --> np.min(v)', uni=UNI.qc(0))
         docvar('abs_', 'abs_v --> np.abs(v)', uni=UNI.qc(0))
+        docvar('hmean_', 'hmean_v --> np.mean(v, axis=(0,1)), i.e. horizontal mean at each z.', uni=UNI.qc(0))
         return None
 
     # interpret quant string
@@ -1176,37 +1185,58 @@ def get_stat_quant(obj, quant):
     document_vars.setattr_quant_selected(obj, command, _STAT_QUANT[0], delay=True)
 
     # do calculations and return result
-    val = obj.get_var(var)
+    if command == 'abs_':
+        return np.abs(obj.get_var(var))
+    elif command == 'hmean_':
+        return chunked_horizontal_mean(obj, var)
+    moments = chunked_moments(obj, var)
     if command == 'mean_':
-        return np.mean(val)
+        return moments['mean']
     elif command == 'variance_':
-        return np.var(val)
+        return moments['variance']
     elif command == 'std_':
-        return np.std(val)
+        return np.sqrt(moments['variance'])
     elif command == 'max_':
-        return np.max(val)
+        return moments['max']
     elif command == 'min_':
-        return np.min(val)
-    elif command == 'abs_':
-        return np.abs(val)
+        return moments['min']
     else:
         raise NotImplementedError(f'command={repr(command)} in get_stat_quant')
 
 
 # default
-_FFT_QUANT = ('FFT_QUANT', ['fft2_', 'fftxy_', 'fftyz_', 'fftxz_'])
+_FFT_QUANT = ('FFT_QUANT', ['fft2_', 'fftxy_', 'fftyz_', 'fftxz_',
+                            'rfftxy_', 'rfftyz_', 'rfftxz_',
+                            'pspec_xy_', 'pspec_yz_', 'pspec_xz_'])
+FFT_WORKERS = -1   # default number of threads for scipy.fft. -1 --> use all cores. Override via obj.fft_workers.
+FFT_CHUNK_BYTES = 2**26   # max size of real-valued input for each batch of planes when computing pspec.
 # get value
 
 
 def get_fft_quant(obj, quant):
-    '''Fourier transform, using np.fft.fft2, and shifting using np.fft.fftshift.
+    '''Fourier transform, using scipy.fft.fft2, and shifting using np.fft.fftshift.
 
     result will be complex-valued. (consider get_var('abs_fft2_quant') to convert to magnitude.)
+    float32 input gives complex64 output (unlike np.fft which always gives complex128).
+    FFTs use obj.fft_workers threads (default: FFT_WORKERS, i.e. all cores).
+
+    rfft.._ quants give only the non-redundant half of the spectrum (via scipy.fft.rfft2);
+    the half-spectrum axis is the second one in the name (e.g. 'y' for rfftxy_), and is not shifted.
+
+    pspec_.._ quants give the azimuthally averaged power spectrum in the plane, at each point along
+    the other axis; result has shape (number of |k| bins, length of other axis).
+    Bin i contains modes with round(|k| / dk) == i, where dk = min(dkx, dky). The power of each mode
+    is |FFT(v)|**2 / N**2 (so that the sum over all modes equals mean(v**2) in the plane);
+    the result is the mean power over the modes in each bin.
+    Planes are transformed in batches, so the complex-valued cube is never in memory all at once.
+    Also sets obj._latest_pspec_k = the k at the center of each bin [simulation units].
 
     See obj.kx, ky, kz for the corresponding coordinates in k-space.
+    (For rfft, use obj.get_kcoords(rfft_axis=...); for pspec, use obj._latest_pspec_k.)
     See obj.get_kextent for the extent to use if plotting k-space via imshow.
 
-    Also sets obj._latest_fft_axes = ('x', 'y'), ('x', 'z') or ('y', 'z') as appropriate.
+    Also sets obj._latest_fft_axes = ('x', 'y'), ('x', 'z') or ('y', 'z') as appropriate,
+    and obj._latest_rfft_axis = the half-spectrum axis (or None if not using rfft).
 
     Note that for plotting with imshow, you will likely want to transpose and use origin='lower'.
     Example, making a correctly labeled and aligned plot of FFT(r[:, 0, :]):
@@ -1217,6 +1247,8 @@ def get_fft_quant(obj, quant):
       plt.xlabel('kx [1/m]'); plt.ylabel('kz [1/m]')
       plt.xlim([0, None])   # <-- not necessary, however numpy's FFT of real-valued input
           # will be symmetric under rotation by 180 degrees, so half the spectrum is redundant.
+          # (to avoid computing the redundant half in the first place, use 'abs_rfftxz_r' instead,
+          #  which keeps only kz >= 0; then use dd.get_kextent('xz', rfft_axis='z').)
     '''
     if quant == '':
         docvar = document_vars.vars_documenter(obj, *_FFT_QUANT, get_fft_quant.__doc__, uni=UNI.qc(0))
@@ -1225,11 +1257,21 @@ def get_fft_quant(obj, quant):
         docvar('fftxy_', '2D fft in (x, y) plane, at each z. result will be 3D.' + shifted)
         docvar('fftyz_', '2D fft in (y, z) plane, at each x. result will be 3D.' + shifted)
         docvar('fftxz_', '2D fft in (x, z) plane, at each y. result will be 3D.' + shifted)
+        for x, y in ('xy', 'yz', 'xz'):
+            z = [a for a in AXES if a not in (x, y)][0]
+            docvar(f'rfft{x}{y}_', f'2D real-input fft in ({x}, {y}) plane, at each {z}. result will be 3D, '
+                                   f'with only the k{y} >= 0 half of the spectrum. Shifted along {x} only.')
+            docvar(f'pspec_{x}{y}_', f'azimuthally averaged power spectrum in ({x}, {y}) plane, at each {z}. '
+                                     f'result will be 2D: (|k| bin, {z}). See obj._latest_pspec_k for |k|.',
+                   uni=UNI.qc(0)**2)
         return None
 
     # interpret quant string
-    command, _, var = quant.partition('_')
-    command = command + '_'
+    if quant.startswith('pspec_'):
+        command, var = quant[:len('pspec_xy_')], quant[len('pspec_xy_'):]
+    else:
+        command, _, var = quant.partition('_')
+        command = command + '_'
 
     if command not in _FFT_QUANT[1]:
         return None
@@ -1239,6 +1281,8 @@ def get_fft_quant(obj, quant):
 
     # do calculations and return result
     val = obj(var)
+    workers = getattr(obj, 'fft_workers', FFT_WORKERS)
+    AX_STR_TO_I = {'x': 0, 'y': 1, 'z': 2}
     if command == 'fft2_':
         if np.shape(val) != obj.shape:
             raise NotImplementedError(f'fft2_ for {repr(var)} with shape {np.shape(val)} not equal to obj.shape {obj.shape}')
@@ -1255,15 +1299,66 @@ def get_fft_quant(obj, quant):
     elif command in ('fftxy_', 'fftyz_', 'fftxz_'):
         x, y = command[3:5]
         obj._latest_fft_axes = (x, y)    # <-- bookkeeping
-        AX_STR_TO_I = {'x': 0, 'y': 1, 'z': 2}
+        obj._latest_rfft_axis = None
+        xi = AX_STR_TO_I[x]
+        yi = AX_STR_TO_I[y]
+        fft_unshifted = scipy.fft.fft2(val, axes=(xi, yi), workers=workers)
+        return np.fft.fftshift(fft_unshifted, axes=(xi, yi))
+    elif command in ('rfftxy_', 'rfftyz_', 'rfftxz_'):
+        x, y = command[4:6]
+        obj._latest_fft_axes = (x, y)    # <-- bookkeeping
+        obj._latest_rfft_axis = y
         xi = AX_STR_TO_I[x]
         yi = AX_STR_TO_I[y]
-        fft_unshifted = np.fft.fft2(val, axes=(xi, yi))
-        return np.fft.fftshift(fft_unshifted)
+        fft_unshifted = scipy.fft.rfft2(val, axes=(xi, yi), workers=workers)
+        return np.fft.fftshift(fft_unshifted, axes=xi)
+    elif command in ('pspec_xy_', 'pspec_yz_', 'pspec_xz_'):
+        x, y = command[6:8]
+        return _power_spectrum(obj, val, x, y, workers=workers)
     else:
         raise NotImplementedError(f'command={repr(command)} in get_fft_quant')
 
 
+def _power_spectrum(obj, val, x, y, workers=FFT_WORKERS):
+    '''azimuthally averaged power spectrum of val in the (x, y) plane, at each point along the other axis.
+    see get_fft_quant for details. Sets obj._latest_pspec_k.
+    '''
+    xi, yi = AXES.index(x), AXES.index(y)
+    zi = 3 - xi - yi
+    val = np.moveaxis(np.asarray(val), (xi, yi, zi), (0, 1, 2))   # (x, y, z) order; no copy.
+    nx, ny, nz = val.shape
+    # |k| bin for each mode of the half spectrum.
+    dx, dy = getattr(obj, f'd{x}'), getattr(obj, f'd{y}')
+    kx = 2 * np.pi * np.fft.fftfreq(nx, dx)
+    ky = 2 * np.pi * np.fft.rfftfreq(ny, dy)
+    dk = min(kx[1] if nx > 1 else np.inf, ky[1] if ny > 1 else np.inf)
+    if not np.isfinite(dk):
+        raise ValueError(f'pspec_{x}{y}_ requires length > 1 along {x} or {y}, but got shape {(nx, ny)}')
+    kbin = np.rint(np.sqrt(kx[:, None]**2 + ky[None, :]**2) / dk).astype(int).ravel()
+    # each mode with 0 < ky < ky_nyquist also represents its (redundant, not computed) mirror image.
+    mult = np.full(ky.shape, 2.0)
+    mult[0] = 1.0
+    if ny % 2 == 0:
+        mult[-1] = 1.0
+    mult = np.broadcast_to(mult, (nx, len(ky))).ravel()
+    nbins = kbin.max() + 1
+    counts = np.bincount(kbin, weights=mult, minlength=nbins)
+    # loop through batches of planes, so that the full complex cube is never in memory at once.
+    result = np.zeros((nbins, nz), dtype=np.result_type(val.dtype, np.float32))
+    chunk = max(1, FFT_CHUNK_BYTES // max(1, nx * ny * val.dtype.itemsize))
+    norm = (nx * ny)**2
+    for start in range(0, nz, chunk):
+        planes = val[:, :, start: start + chunk]
+        fplanes = scipy.fft.rfft2(planes, axes=(0, 1), workers=workers)
+        power = (fplanes.real**2 + fplanes.imag**2).reshape(-1, fplanes.shape[-1]) * mult[:, None]
+        for iz in range(power.shape[-1]):
+            result[:, start + iz] = np.bincount(kbin, weights=power[:, iz], minlength=nbins)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result = result / (norm * counts[:, None])   # mean over modes in each bin. (nan for empty bins.)
+    obj._latest_pspec_k = np.arange(nbins) * dk
+    return result
+
+
 # default
 _MULTI_QUANT = ('MULTI_QUANT',
                 [fullcommand + c
@@ -1375,3 +1470,113 @@ def threadQuantity_z(task, numThreads, *args):
     pool = ThreadPool(processes=numThreads)
     result = np.concatenate(pool.starmap(task, zip(*args)), axis=2)
     return result
+
+
+''' --------------------- chunked reductions --------------------- '''
+
+STAT_SLAB_BYTES = 2**28   # max bytes (as float64) for each z-slab, halo included. Override via obj.stat_slab_bytes.
+STAT_SLAB_HALO = 12       # extra cells on each side of each slab. Override via obj.stat_slab_halo.
+# ^ stagger operations reach 3 cells in each direction; a halo of 12 allows 4 nested z operations.
+STAT_SLAB_MIN_HALOS = 8   # slabs are always at least this many halos thick (excluding the halo itself),
+# ^ so that the halo is a small overhead even when stat_slab_bytes is tiny. (May exceed stat_slab_bytes.)
+SLAB_MODE = '_slab_mode'  # attr of obj; True while getting values for a z-slab. (see set_domain_iiaxes.)
+
+
+def iter_z_slabs(obj, var):
+    '''iterate through z-slabs of obj.get_var(var), so only one slab is in memory at a time.
+    yields (slice of z for this slab (relative to current domain), value of var in this slab).
+
+    The slab size is determined by obj.stat_slab_bytes (default STAT_SLAB_BYTES), which includes the halo;
+        slabs are never thinner than STAT_SLAB_MIN_HALOS halos, though.
+    Each slab is computed with a halo of obj.stat_slab_halo cells (default STAT_SLAB_HALO) along z
+        on each side, which is removed before yielding. (So that z-derivatives & interpolations are
+        correct at the edges of each slab.) Quantities requiring more nested z operations than the
+        halo allows may be inaccurate within a few cells of slab edges.
+    If getting var for the first slab doesn't do any z stagger operations (counted by obj.stagger),
+        the remaining slabs are computed without a halo.
+
+    yields (slice(None), obj.get_var(var)) (i.e. no chunking) if obj doesn't support slabs,
+    or if the current z domain is not a slice, or if the result for a slab doesn't look like a slab.
+    '''
+    iiz = getattr(obj, 'iiz', None)
+    if not (hasattr(obj, 'set_domain_iiaxes') and isinstance(iiz, slice) and iiz.step in (None, 1)):
+        yield slice(None), obj.get_var(var)
+        return
+    # bookkeeping - slab size
+    zstart, zstop, _ = iiz.indices(obj.nzb)
+    nbytes_per_z = obj.xLength * obj.yLength * 8
+    nz_budget = max(1, getattr(obj, 'stat_slab_bytes', STAT_SLAB_BYTES) // nbytes_per_z)  # includes halo
+    if nz_budget >= zstop - zstart:   # only 1 slab --> don't bother with chunking.
+        yield slice(None), obj.get_var(var)
+        return
+    halo = getattr(obj, 'stat_slab_halo', STAT_SLAB_HALO)
+    # z stagger operations are counted by obj.stagger. Without stagger (np.gradient instead), always keep the halo.
+    zops_counter = getattr(obj, 'stagger', None) if getattr(obj, 'do_stagger', False) else None
+    original_slices = (obj.iix, obj.iiy, obj.iiz)
+    try:
+        z0 = zstart
+        first = True
+        while z0 < zstop:
+            nslab = max(1, nz_budget - 2 * halo, STAT_SLAB_MIN_HALOS * halo)
+            z1 = min(z0 + nslab, zstop)
+            if zstop - z1 < halo:   # don't leave a sliver thinner than the halo for the last slab.
+                z1 = zstop
+            h0 = min(halo, z0)             # halo below; don't go past edge of the full domain.
+            h1 = min(halo, obj.nzb - z1)   # halo above
+            obj.set_domain_iiaxes(iiz=slice(z0 - h0, z1 + h1), internal=False)
+            nzops = getattr(zops_counter, 'n_zops', None)
+            slab_mode_orig = getattr(obj, SLAB_MODE, False)
+            caching_orig = getattr(obj, 'do_caching', None)
+            setattr(obj, SLAB_MODE, True)
+            if first and caching_orig is not None:
+                obj.do_caching = False   # a cached value would hide the z operations needed to compute it.
+            try:
+                val = obj.get_var(var)
+            finally:
+                setattr(obj, SLAB_MODE, slab_mode_orig)
+                if caching_orig is not None:
+                    obj.do_caching = caching_orig
+            if np.shape(val)[2:3] != (z1 - z0 + h0 + h1,):
+                # result is not a slab of a 3D array; can't do chunking.
+                obj.set_domain_iiaxes(*original_slices, internal=False)
+                yield slice(None), obj.get_var(var)
+                return
+            if first and nzops is not None and zops_counter.n_zops == nzops:
+                halo = 0   # var doesn't need any z stagger operations, so the other slabs don't need a halo.
+            first = False
+            yield slice(z0 - zstart, z1 - zstart), val[:, :, h0: h0 + z1 - z0]
+            z0 = z1
+    finally:
+        obj.set_domain_iiaxes(*original_slices, internal=False)
+
+
+def chunked_moments(obj, var):
+    '''returns dict of (n, mean, variance, min, max) of obj.get_var(var), computed via iter_z_slabs.
+    Moments are accumulated in float64, merging slabs with the (numerically stable) parallel Welford algorithm.
+    '''
+    n, mean, m2 = 0, 0., 0.
+    vmin, vmax = np.inf, -np.inf
+    for _, val in iter_z_slabs(obj, var):
+        val = np.asarray(val)
+        nb = val.size
+        if nb == 0:
+            continue
+        mean_b = np.mean(val, dtype=np.float64)
+        m2_b = np.sum(np.square(val - mean_b, dtype=np.float64))
+        delta = mean_b - mean
+        ntot = n + nb
+        mean = mean + delta * nb / ntot
+        m2 = m2 + m2_b + delta**2 * n * nb / ntot
+        n = ntot
+        vmin = min(vmin, np.min(val))
+        vmax = max(vmax, np.max(val))
+    variance = m2 / n if n > 0 else np.nan
+    return dict(n=n, mean=mean, variance=variance, min=vmin, max=vmax)
+
+
+def chunked_horizontal_mean(obj, var):
+    '''returns mean of obj.get_var(var) across x and y, at each z (1D array). Computed via iter_z_slabs.'''
+    result = []
+    for _, val in iter_z_slabs(obj, var):
+        result.append(np.mean(val, axis=(0, 1), dtype=np.float64))
+    return np.concatenate(result)
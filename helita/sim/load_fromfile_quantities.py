@@ -4,7 +4,7 @@
 # import external public modules
 import numpy as np
 
-from . import document_vars
+from . import document_vars, file_memory
 # import the relevant things from the internal module "units"
 from .units import DIMENSIONLESS, UNI, UNI_speed, Usym
 
@@ -31,6 +31,7 @@ def load_fromfile_quantities(obj, quant, order='F', mode='r', panic=False, save_
                                  )
 
     val = obj._get_simple_var(quant, order=order, mode=mode, panic=panic, **kwargs)  # method of obj.
+    val = file_memory.planning_placeholder(obj, val)  # (during a dry run, don't read the data.)
     if ((cgsunits is not None) and (val is not None)):
         val = val*cgsunits
     if val is None:
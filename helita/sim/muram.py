@@ -7,6 +7,7 @@ import warnings
 import functools
 import collections
 from glob import glob
+from multiprocessing.dummy import Pool as ThreadPool
 
 # import external public modules
 import numpy as np
@@ -21,6 +22,209 @@ from .tools import *
 from . import document_vars, file_memory, load_fromfile_quantities, stagger, tools, units
 
 
+# {attr: (file name prefix, factor)} for MuramAtmos attributes which are read directly from files.
+ATMOS_FILES = dict(tg=('eosT', 1.0), pressure=('eosP', 1.0), ne=('eosne', 1.0),
+                   rho=('result_prim_0', 1.0), vx=('result_prim_1', 1.0), vz=('result_prim_2', 1.0),
+                   vy=('result_prim_3', 1.0), ei=('result_prim_4', 1.0),
+                   bx=('result_prim_5', np.sqrt(4 * np.pi)), bz=('result_prim_6', np.sqrt(4 * np.pi)),
+                   by=('result_prim_7', np.sqrt(4 * np.pi)),
+                   tau=('tau', 1.0), qtot=('Qtot', 1.0))
+
+# hydrogen mass fraction, and factor to convert corona_emission_adj_dem files to DEM (see read_dem).
+X_H = 0.7
+DEM_FACTOR = X_H * 0.5 * (1 + X_H) * 3.6e19
+
+
+''' ---- reading parts of files ---- '''
+
+
+def _normalize_index(key, shape):
+    '''returns list of (1D index array, is_int) for each axis, given key (as for ndarray.__getitem__).
+    returns None if key is not supported (e.g. np.newaxis, or multidimensional index arrays).
+    '''
+    if not isinstance(key, tuple):
+        key = (key,)
+    if any(k is Ellipsis for k in key):
+        i = [k is Ellipsis for k in key].index(True)
+        key = key[:i] + (slice(None),) * (len(shape) - len(key) + 1) + key[i+1:]
+    key = key + (slice(None),) * (len(shape) - len(key))
+    if len(key) != len(shape):
+        return None
+    result = []
+    for axis, (k, n) in enumerate(zip(key, shape)):
+        if k is None:
+            return None
+        elif isinstance(k, slice):
+            result.append((np.arange(n)[k], False))
+        elif np.ndim(k) == 0:
+            if not -n <= int(k) < n:
+                raise IndexError(f'index {int(k)} is out of bounds for axis {axis} with size {n}')
+            result.append((np.array([int(k) % n]), True))
+        else:
+            k = np.asarray(k)
+            if k.ndim != 1:
+                return None
+            if k.dtype == bool:
+                if k.size != n:
+                    raise IndexError(f'boolean index did not match axis {axis} with size {n}; '
+                                     f'size of boolean index is {k.size}')
+                k = np.nonzero(k)[0]
+            k = k.astype(int)
+            bad = (k < -n) | (k >= n)
+            if np.any(bad):
+                raise IndexError(f'index {k[bad][0]} is out of bounds for axis {axis} with size {n}')
+            result.append((k % n, False))
+    return result
+
+
+def read_subarray(filename, shape, dtype, index, offset=0):
+    '''read the part of a Fortran-ordered binary file selected by index, reading as few bytes as possible.
+
+    The read is planned in the on-disk axis order. Axis 0 (fastest) is read as one span, from the
+    smallest to the largest requested index. Axis 1 (then axis 2) is merged into the same run while
+    all faster axes are fully selected and its own selection is contiguous. Each combination of the
+    remaining (slower) indices is then one contiguous run, read via readinto into a compact buffer.
+    E.g. a plane at fixed index along the slowest axis is one run; a column along the fastest is one run.
+
+    filename: str. name of file.
+    shape: tuple. shape of the data in the file.
+    dtype: dtype of the data in the file.
+    index: list of (1D index array, is_int) for each axis (see _normalize_index).
+    offset: int. offset (in bytes) of the data in the file.
+
+    returns array (Fortran-ordered, in file axis order) with one axis for each index with is_int=False.
+    '''
+    dtype = np.dtype(dtype)
+    sel = [idx for idx, _ in index]
+    if any(idx.size == 0 for idx in sel):
+        return np.empty([idx.size for idx, is_int in index if not is_int], dtype=dtype)
+    strides = np.cumprod((1,) + tuple(shape[:-1]))   # F-order strides, in elements
+    # axes in the run: [0, nrun). spans[a] = (start, stop) of what is read along axis a.
+    spans = [(int(sel[0].min()), int(sel[0].max()) + 1)]
+    nrun = 1
+    while nrun < len(shape):
+        prev_full = all(np.array_equal(sel[a], np.arange(shape[a])) for a in range(nrun))
+        this = sel[nrun]
+        contiguous = np.all(np.diff(this) == 1)
+        if not (prev_full and contiguous):
+            break
+        spans.append((int(this[0]), int(this[-1]) + 1))
+        nrun += 1
+    runlen = int(np.prod([stop - start for start, stop in spans]))
+    run_offset = sum(start * strides[a] for a, (start, stop) in enumerate(spans))
+    # start of each run, ordered with the first outer axis fastest (i.e. F order).
+    outer = sel[nrun:]
+    starts = np.zeros([idx.size for idx in outer], dtype=np.int64)
+    for j, idx in enumerate(outer):
+        starts = starts + (idx * strides[nrun + j]).reshape((1,) * j + (-1,) + (1,) * (len(outer) - j - 1))
+    starts = starts.ravel(order='F') + run_offset
+    # read runs into compact buffer.
+    buf = np.empty(runlen * starts.size, dtype=dtype)
+    mv = memoryview(buf).cast('B')
+    nbytes = runlen * dtype.itemsize
+    with open(filename, 'rb') as f:
+        for i, start in enumerate(starts):
+            f.seek(offset + int(start) * dtype.itemsize)
+            if f.readinto(mv[i * nbytes: (i + 1) * nbytes]) != nbytes:
+                raise EOFError(f'{filename} is smaller than expected for shape={tuple(shape)}, dtype={dtype}')
+    result = buf.reshape([stop - start for start, stop in spans] + [idx.size for idx in outer], order='F')
+    # select from axis 0 span (only copies if axis 0 was not contiguous), then remove int axes.
+    sub0 = sel[0] - spans[0][0]
+    if not np.array_equal(sub0, np.arange(result.shape[0])):
+        result = result[sub0]
+    return result[tuple(0 if is_int else slice(None) for _, is_int in index)]
+
+
+class LazyMemmap(np.lib.mixins.NDArrayOperatorsMixin):
+    '''array-like view of a binary file, which is only memmapped upon first use.
+
+    Indexing reads only the selected part of the file; transpose & factor are applied to that part only.
+    Arithmetic, numpy functions, and other ndarray attributes & methods (e.g. .T, .mean(), .astype())
+    work too, but act on the entire file (so, index first when possible).
+
+    filename: str. name of file.
+    shape: tuple. shape of data in file.
+    dtype: dtype of data in file.
+    order: 'F' or 'C'. memory order of data in file.
+    transpose: None or tuple. if provided, transpose axes of data, before indexing.
+    factor: number. multiply data by this value, after indexing.
+    offset: int. offset (in bytes) of the data in the file.
+    '''
+    def __init__(self, filename, shape, dtype, order='F', transpose=None, factor=1.0, offset=0):
+        self.filename = filename
+        self.offset = offset
+        self.file_shape = tuple(int(n) for n in shape)
+        self.dtype = np.dtype(dtype)
+        self.order = order
+        self.transpose = transpose
+        self.factor = factor
+        self._memmap = None
+
+    shape = property(lambda self: self.file_shape if self.transpose is None else
+                     tuple(self.file_shape[i] for i in self.transpose))
+    ndim = property(lambda self: len(self.file_shape))
+    size = property(lambda self: int(np.prod(self.file_shape)))
+
+    @property
+    def memmap(self):
+        '''memmap of file, in the orientation of self (i.e., after transpose). Created upon first access.'''
+        if self._memmap is None:
+            self._memmap = np.memmap(self.filename, mode="r", shape=self.file_shape,
+                                     dtype=self.dtype, order=self.order, offset=self.offset)
+        return self._memmap if self.transpose is None else self._memmap.transpose(self.transpose)
+
+    def __getitem__(self, key):
+        return self.read(key)
+
+    def read(self, key=Ellipsis, factor=None):
+        '''returns self[key] * factor (default self.factor).
+        Reads as few bytes as possible (see read_subarray), and applies factor in place.
+        Falls back to memmap indexing for keys which read_subarray does not support.
+        '''
+        factor = self.factor if factor is None else factor
+        index = _normalize_index(key, self.shape)
+        if index is None:
+            val = self.memmap[key]
+            return val if factor == 1 else val * factor
+        # map index from self orientation to file axis order (which read_subarray expects)
+        file_axes = list(range(self.ndim)) if self.transpose is None else list(self.transpose)
+        file_index = [None] * self.ndim
+        for i, a in enumerate(file_axes):
+            file_index[a] = index[i]
+        file_shape = self.file_shape
+        if self.order == 'C':   # C order is F order with axes reversed
+            file_index, file_shape, file_axes = file_index[::-1], file_shape[::-1], [self.ndim - 1 - a for a in file_axes]
+        val = read_subarray(self.filename, file_shape, self.dtype, file_index, offset=self.offset)
+        if factor != 1:
+            val *= factor
+        # transpose result to self orientation (only axes which were not removed by int indexing)
+        kept = [a for a in file_axes if not file_index[a][1]]
+        return val.transpose(np.argsort(np.argsort(kept)))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _full(self):
+        '''returns entire array: the memmap itself if factor is 1, else the data read into memory.'''
+        return self.memmap if self.factor == 1 else self[...]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self._full(), dtype=dtype)
+
+    def __getattr__(self, attr):
+        '''other ndarray attributes & methods (e.g. .T, .mean(), .astype()) act on the entire array.'''
+        if attr.startswith('_') or not hasattr(np.ndarray, attr):
+            raise AttributeError(f"{type(self).__name__!r} object has no attribute {attr!r}")
+        return getattr(self._full(), attr)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = tuple(np.asarray(x) if isinstance(x, LazyMemmap) else x for x in inputs)
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def __repr__(self):
+        return f'<LazyMemmap of {self.filename!r} with shape={self.shape}, factor={self.factor}>'
+
+
 class MuramAtmos:
     """
     Class to read MURaM atmosphere
@@ -135,80 +339,17 @@ class MuramAtmos:
             self.dz1d = np.zeros(self.nz)
 
     def read_atmos(self, fdir, template):
-        ashape = (self.nx, self.nz, self.ny)
-        file_T = "%s/eosT%s" % (fdir, template)
-        # When 0-th dimension is vertical, 1st is x, 2nd is y
-        # when 1st dimension is vertical, 0th is x.
-        # remember to swap names
+        '''set attributes (tg, pressure, ne, rho, vx, vy, vz, ei, bx, by, bz, tau, qtot) for files
+        in fdir with the given template. Nothing is read here: each attribute is a LazyMemmap, which
+        only memmaps the file upon first use, and only reads (and scales) the parts that get indexed.
 
-        bfact = np.sqrt(4 * np.pi)
-        if os.path.isfile(file_T):
-            self.tg = np.memmap(file_T, mode="r", shape=ashape,
-                                dtype=self.dtype,
-                                order="F")
-        file_press = "%s/eosP%s" % (fdir, template)
-        if os.path.isfile(file_press):
-            self.pressure = np.memmap(file_press, mode="r", shape=ashape,
-                                      dtype=self.dtype,
-                                      order="F")
-        file_ne = "%s/eosne%s" % (fdir, template)
-        if os.path.isfile(file_ne):
-            self.ne = np.memmap(file_ne, mode="r", shape=ashape,
-                                      dtype=self.dtype,
-                                      order="F")
-        file_rho = "%s/result_prim_0%s" % (fdir, template)
-        if os.path.isfile(file_rho):
-            self.rho = np.memmap(file_rho, mode="r", shape=ashape,
-                                 dtype=self.dtype,
-                                 order="F")
-        file_vx = "%s/result_prim_1%s" % (fdir, template)
-        if os.path.isfile(file_vx):
-            self.vx = np.memmap(file_vx, mode="r", shape=ashape,
-                                dtype=self.dtype,
-                                order="F")
-        file_vz = "%s/result_prim_2%s" % (fdir, template)
-        if os.path.isfile(file_vz):
-            self.vz = np.memmap(file_vz, mode="r", shape=ashape,
-                                dtype=self.dtype,
-                                order="F")
-        file_vy = "%s/result_prim_3%s" % (fdir, template)
-        if os.path.isfile(file_vy):
-            self.vy = np.memmap(file_vy, mode="r", shape=ashape,
-                                dtype=self.dtype,
-                                order="F")
-        file_ei = "%s/result_prim_4%s" % (fdir, template)
-        if os.path.isfile(file_ei):
-            self.ei = np.memmap(file_ei, mode="r", shape=ashape,
-                                dtype=self.dtype,
-                                order="F")
-        file_Bx = "%s/result_prim_5%s" % (fdir, template)
-        if os.path.isfile(file_Bx):
-            self.bx = np.memmap(file_Bx, mode="r", shape=ashape,
-                                dtype=self.dtype,
-                                order="F")
-            self.bx = self.bx * bfact
-        file_Bz = "%s/result_prim_6%s" % (fdir, template)
-        if os.path.isfile(file_Bz):
-            self.bz = np.memmap(file_Bz, mode="r", shape=ashape,
-                                dtype=self.dtype,
-                                order="F")
-            self.bz = self.bz * bfact
-        file_By = "%s/result_prim_7%s" % (fdir, template)
-        if os.path.isfile(file_By):
-            self.by = np.memmap(file_By, mode="r", shape=ashape,
-                                dtype=self.dtype,
-                                order="F")
-            self.by = self.by * bfact
-        file_tau = "%s/tau%s" % (fdir, template)
-        if os.path.isfile(file_tau):
-            self.tau = np.memmap(file_tau, mode="r", shape=ashape,
-                                 dtype=self.dtype,
-                                 order="F")
-        file_Qtot = "%s/Qtot%s" % (fdir, template)
-        if os.path.isfile(file_Qtot):
-            self.qtot = np.memmap(file_Qtot, mode="r", shape=ashape,
-                                  dtype=self.dtype,
-                                  order="F")
+        Note: these attributes are also created automatically (for self.fdir and self.siter)
+        upon first access, so calling read_atmos is only necessary to use a different fdir or template.
+        '''
+        for attr in ATMOS_FILES:
+            lazy = self._lazy_atmos(attr, fdir, template)
+            if lazy is not None:
+                setattr(self, attr, lazy)
 
         # from moments to velocities
         # if self.prim:
@@ -220,6 +361,41 @@ class MuramAtmos:
         #        if hasattr(self,'vz'):
         #            self.vz /= self.rho
 
+    def _lazy_atmos(self, attr, fdir, template):
+        '''returns LazyMemmap for atmos attr (see ATMOS_FILES), or None if the file does not exist.'''
+        # When 0-th dimension is vertical, 1st is x, 2nd is y
+        # when 1st dimension is vertical, 0th is x.
+        # remember to swap names
+        ashape = (self.nx, self.nz, self.ny)
+        fname, factor = ATMOS_FILES[attr]
+        filename = "%s/%s%s" % (fdir, fname, template)
+        if not os.path.isfile(filename):
+            return None
+        return LazyMemmap(filename, shape=ashape, dtype=self.dtype, order="F", factor=factor)
+
+    def __getattr__(self, attr):
+        '''create atmos attrs (see ATMOS_FILES) upon first access. Nothing is read until indexed.'''
+        if attr in ATMOS_FILES and 'siter' in self.__dict__:
+            lazy = self._lazy_atmos(attr, self.fdir, self.siter)
+            if lazy is not None:
+                setattr(self, attr, lazy)
+                return lazy
+        raise AttributeError(f"{type(self).__name__!r} object has no attribute {attr!r}")
+
+    def _forget_atmos(self):
+        '''forget atmos attrs, e.g. after changing snapshot. They will be recreated upon next access.'''
+        for attr in ATMOS_FILES:
+            self.__dict__.pop(attr, None)
+        self.__dict__.pop('_memmaps', None)
+
+    def series(self, filebase, **kw__series):
+        '''returns MuramSeries of all iterations of filebase in self.fdir. Nothing is read until indexed.
+        filebase: str. name of files without the '.{iteration}' suffix.
+            e.g. 'I_out', 'tau_slice_1.000', or 'corona_emission_adj_dem_xy'.
+        Example: self.series('I_out')[:, 100, :] is the time series of row 100 of I_out.
+        '''
+        return MuramSeries(filebase, fdir=self.fdir, **kw__series)
+
     def read_Iout(self):
 
         tmp = np.fromfile(self.fdir+'I_out.'+self.siter)
@@ -253,8 +429,7 @@ class MuramAtmos:
 
         taxis = lgTmin+dellgT*np.arange(0, bins+1)
 
-        X_H = 0.7
-        dem = dem*X_H*0.5*(1+X_H)*3.6e19
+        dem = dem*DEM_FACTOR
 
         if max_bins != None:
             if bins > max_bins:
@@ -333,6 +508,7 @@ class MuramAtmos:
             self.snap = snap
             self.siter = '.'+self.inttostring(snap)
             self.read_header("%s/Header%s" % (self.fdir, self.siter))
+            self._forget_atmos()
 
         if var in self.varn.keys():
             varname = self.varn[var]
@@ -357,19 +533,11 @@ class MuramAtmos:
             #orderfiles = [self.order[2],self.order[0],self.order[1]]
 
             # self.order = [2,0,1]
-            data = np.memmap(self.fdir+'/'+varname + self.siter, mode="r",
-                             shape=tuple(ashape[self.order[self.order]]),
-                             dtype=self.dtype, order="F")
-            data = data.transpose(transpose_order)
-
-            if iix != None:
-                data = data[iix, :, :]
-            if iiy != None:
-                data = data[:, iiy, :]
-            if iiz != None:
-                data = data[:, :, iiz]
-
-            self.data = data * cgsunits
+            data = self._lazy_file(self.fdir+'/'+varname + self.siter,
+                                   shape=tuple(ashape[self.order[self.order]]), transpose=transpose_order)
+            # read only the requested slice (planned in on-disk axis order), & convert units in place.
+            key = tuple(slice(None) if ii is None else ii for ii in (iix, iiy, iiz))
+            self.data = data.read(key, factor=cgsunits)
 
         else:
             # Loading quantities
@@ -382,6 +550,14 @@ class MuramAtmos:
 
         return self.data
 
+    def _lazy_file(self, filename, shape, transpose=None):
+        '''returns LazyMemmap of filename, creating it upon first use (then remembering it until snap changes).'''
+        memmaps = self.__dict__.setdefault('_memmaps', dict())
+        key = (filename, shape, None if transpose is None else tuple(transpose))
+        if key not in memmaps:
+            memmaps[key] = LazyMemmap(filename, shape=shape, dtype=self.dtype, order="F", transpose=transpose)
+        return memmaps[key]
+
     ## GET VARIABLE ##
     def __call__(self, var, *args, **kwargs):
         '''equivalent to self.get_var(var, *args, **kwargs)'''
@@ -829,6 +1005,100 @@ class MuramAtmos:
     write_meshfile = write_mesh_file  # alias
 
 
+class MuramSeries:
+    '''time series of MURaM 2D output files (I_out, slices, DEM, ...), for all iterations at once.
+
+    Behaves like a lazily-loaded array with shape (nt, ...). Indexing reads (in parallel) only the
+    requested iterations, and only the requested part of each file (see read_subarray). No file is
+    kept open between reads, so series of thousands of iterations do not run out of file descriptors.
+    Files are indexed, and their headers read, only once (in __init__).
+
+    filebase: str. name of files without the '.{iteration}' suffix.
+        'I_out...'                 --> header: (?, size0, size1, time); values have shape (size0, size1).
+        '{var}_slice_{depth}'      --> header: (nslices, size0, size1, time); shape (nslices, size0, size1).
+        'corona_emission_adj_...'  --> header: (bins, size0, size1, time, lgTmin, dellgT); shape (size0, size1, bins).
+            'corona_emission_adj_dem...' values are multiplied by DEM_FACTOR, as in MuramAtmos.read_dem.
+    fdir: str. directory with the files.
+    dtype: dtype of the files.
+    nthreads: int. number of threads for reading. None --> os.cpu_count().
+    '''
+    def __init__(self, filebase, fdir='.', dtype='f8', nthreads=None):
+        self.filebase = filebase
+        self.fdir = fdir
+        self.dtype = np.dtype(dtype)
+        self.nthreads = nthreads
+        self.factor = 1.0
+        if filebase.startswith('corona_emission_adj_'):
+            self.kind, self.header_size = 'emission', 6
+            if filebase.startswith('corona_emission_adj_dem'):
+                self.factor = DEM_FACTOR
+        elif '_slice_' in filebase:
+            self.kind, self.header_size = 'slice', 4
+        else:
+            self.kind, self.header_size = 'I_out', 4
+        # index files
+        prefix = os.path.join(fdir, filebase + '.')
+        files = [f for f in glob(prefix + '*') if f[len(prefix):].isdigit()]
+        if len(files) == 0:
+            raise FileNotFoundError(f'no files matching {prefix}[iteration] found.')
+        self.iters = np.array(sorted(int(f[len(prefix):]) for f in files))
+        self.files = [prefix + f[len(prefix):] for f in sorted(files, key=lambda f: int(f[len(prefix):]))]
+        # read (and cache) headers
+        self.headers = np.array(self._map(self._read_header, self.files))
+        self.times = self.headers[:, 3]
+        sizes = np.unique(self.headers[:, 1:3] if self.kind == 'I_out' else self.headers[:, :3], axis=0)
+        if len(sizes) > 1:
+            raise ValueError(f'files for {filebase!r} do not all have the same shape.')
+        head = [int(h) for h in self.headers[0][:3]]
+        if self.kind == 'I_out':
+            self.file_shape = (head[2], head[1])
+        else:
+            self.file_shape = (head[0], head[2], head[1])
+
+    # axes of data (as stored in file) in the orientation used by MuramAtmos.read_slice & co.
+    transpose = property(lambda self: {'I_out': (1, 0), 'slice': (0, 2, 1), 'emission': (2, 1, 0)}[self.kind])
+    shape = property(lambda self: (len(self.files),) + tuple(self.file_shape[i] for i in self.transpose))
+    ndim = property(lambda self: 1 + len(self.file_shape))
+    nt = property(lambda self: len(self.files))
+
+    def __len__(self):
+        return self.nt
+
+    def __repr__(self):
+        return f'<MuramSeries of {self.filebase!r} in {self.fdir!r} with shape={self.shape}>'
+
+    def _map(self, f, args):
+        '''returns list(map(f, args)), using threads.'''
+        if len(args) <= 1 or self.nthreads == 1:
+            return [f(arg) for arg in args]
+        with ThreadPool(self.nthreads) as pool:
+            return pool.map(f, args)
+
+    def _read_header(self, filename):
+        '''return header of filename.'''
+        return np.fromfile(filename, dtype=self.dtype, count=self.header_size)
+
+    def lazy(self, it):
+        '''returns LazyMemmap of values in file at index it (in self orientation, with factor applied).
+        Nothing is read (and no file is opened) until it is indexed.
+        '''
+        return LazyMemmap(self.files[it], shape=self.file_shape, dtype=self.dtype, order='C',
+                          transpose=self.transpose, factor=self.factor,
+                          offset=self.header_size * self.dtype.itemsize)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        tkey, key = key[0], key[1:]
+        its = np.arange(self.nt)[tkey]
+        if np.ndim(its) == 0:
+            return np.array(self.lazy(int(its))[key])
+        return np.stack(self._map(lambda it: np.array(self.lazy(it)[key]), list(its)))
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[:], dtype=dtype)
+
+
 def cross_sect_for_obj(obj=None):
     '''return function which returns Cross_sect with self.obj=obj.
     obj: None (default) or an object
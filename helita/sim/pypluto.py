@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 import os
 import sys
-import array
 
 import numpy as np
 import scipy.constants as const
@@ -94,6 +93,35 @@ def nlast_info(w_dir=None, datatype=None):
     return {'nlast': nlast, 'time': SimTime, 'dt': Dt, 'Nstep': Nstep}
 
 
+class MappedFile(object):
+    """ Memory map of a binary PLUTO data file, read sequentially like a file pointer, but without copying.
+
+    **Inputs**:
+
+      fp -- file name, or file pointer (in which case the map starts at its current position,
+      and the file pointer is advanced by each read)\n
+      dtype -- numpy dtype, including byte order, e.g. '<d'
+
+    """
+
+    def __init__(self, fp, dtype):
+        self.dtype = np.dtype(dtype)
+        self.fp = None if isinstance(fp, str) else fp
+        self.offset = 0 if self.fp is None else self.fp.tell()
+        # copy-on-write: arrays are writable, but changes never reach the file.
+        self.data = np.memmap(fp, dtype=self.dtype, mode='c', offset=self.offset)
+        self.pos = 0
+
+    def read(self, count, skip=0):
+        """ Returns a view of the next *count* values, after skipping *skip* values.
+        """
+        start = self.pos + skip
+        self.pos = start + count
+        if self.fp is not None:
+            self.fp.seek(self.offset + self.pos * self.dtype.itemsize)
+        return self.data[start:self.pos]
+
+
 class pload(object):
     def __init__(self, ns, w_dir=None, datatype=None, level=0, x1range=None, x2range=None, x3range=None):
         """Loads the data.
@@ -318,21 +346,10 @@ class pload(object):
                 if l.split()[0] == 'SCALARS':
                     ks.append(l.split()[1])
                 elif l.split()[0] == 'LOOKUP_TABLE':
-                    A = array.array(dtype)
-                    fmt = endian+str(n1*n2*n3)+dtype
-                    nb = np.dtype(fmt).itemsize
-                    A.fromstring(fp.read(nb))
-                    if (self.Slice):
-                        darr = np.zeros((n1*n2*n3))
-                        indxx = np.sort([n3_tot*n2_tot*k + j*n2_tot + i for i in self.irange for j in self.jrange for k in self.krange])
-                        if (sys.byteorder != self.endianess):
-                            A.byteswap()
-                        for ii, iii in enumerate(indxx):
-                            darr[ii] = A[iii]
-                        vtkvar_buf = [darr]
-                    else:
-                        vtkvar_buf = np.frombuffer(A, dtype=np.dtype(fmt))
-                    vtkvar.append(np.reshape(vtkvar_buf, self.nshp).transpose())
+                    itemtype = np.dtype(endian+dtype)
+                    count = self.n1_tot*self.n2_tot*self.n3_tot
+                    flat = np.frombuffer(fp.read(count*itemtype.itemsize), dtype=itemtype)
+                    vtkvar.append(self.SubDomain(flat))
                 else:
                     pass
             if l == '':
@@ -613,7 +630,7 @@ class pload(object):
 
         **Inputs**:
 
-          fp -- Data file pointer\n
+          fp -- Data file pointer, or MappedFile (to map a file only once for all variables)\n
           n1 -- No. of points in X1 direction\n
           n2 -- No. of points in X2 direction\n
           n3 -- No. of points in X3 direction\n
@@ -626,32 +643,30 @@ class pload(object):
           Dictionary consisting of variable names as keys and its values.
 
         """
-        if off is not None:
-            off_fmt = endian+str(off)+dtype
-            nboff = np.dtype(off_fmt).itemsize
-            fp.read(nboff)
+        if not isinstance(fp, MappedFile):
+            fp = MappedFile(fp, endian+dtype)
+        flat = fp.read(self.n1_tot*self.n2_tot*self.n3_tot, skip=0 if off is None else off)
+        return self.SubDomain(flat)
 
-        n1_tot = self.n1_tot
-        n2_tot = self.n2_tot
-        n3_tot = self.n3_tot
+    def SubDomain(self, flat):
+        """ Reshapes the values of the full domain and extracts the requested sub-domain.
 
-        A = array.array(dtype)
-        fmt = endian+str(n1_tot*n2_tot*n3_tot)+dtype
-        nb = np.dtype(fmt).itemsize
-        A.fromstring(fp.read(nb))
+        **Inputs**:
 
-        if (self.Slice):
-            darr = np.zeros((n1*n2*n3))
-            indxx = np.sort([n3_tot*n2_tot*k + j*n2_tot + i for i in self.irange for j in self.jrange for k in self.krange])
-            if (sys.byteorder != self.endianess):
-                A.byteswap()
-            for ii, iii in enumerate(indxx):
-                darr[ii] = A[iii]
-            darr = [darr]
-        else:
-            darr = np.frombuffer(A, dtype=np.dtype(fmt))
+          flat -- 1D array with the values of a variable in the full domain (x1 fastest)
 
-        return np.reshape(darr[0], self.nshp).transpose()
+        **Output**:
+
+          Array with shape (n1, n2, n3) (dropping unused dimensions). A view of flat (no copy)
+          unless a sub-domain of a 2D or 3D run is requested.
+
+        """
+        data = flat.reshape(self.n3_tot, self.n2_tot, self.n1_tot)
+        if (self.Slice):
+            data = data[self.krange[0]:self.krange[-1]+1,
+                        self.jrange[0]:self.jrange[-1]+1,
+                        self.irange[0]:self.irange[-1]+1]
+        return np.reshape(data, self.nshp).transpose()
 
     def ReadSingleFile(self, datafilename, myvars, n1, n2, n3, endian,
                        dtype, ddict):
@@ -688,6 +703,7 @@ class pload(object):
             h5d = self.DataScanHDF5(fp, myvars, self.level)
             ddict.update(h5d)
         else:
+            fp = MappedFile(fp, endian+dtype)
             for i in range(len(myvars)):
                 if myvars[i] == 'bx1s':
                     ddict.update({myvars[i]: self.DataScan(fp, n1, n2, n3, endian,
@@ -701,6 +717,7 @@ class pload(object):
                 else:
                     ddict.update({myvars[i]: self.DataScan(fp, n1, n2, n3, endian,
                                                            dtype)})
+            fp = fp.fp
 
         fp.close()
 
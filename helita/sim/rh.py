@@ -1,9 +1,7 @@
 """
 Set of programs and tools to read the outputs from RH (Han's version)
 """
-import io
 import os
-import xdrlib
 
 import numpy as np
 
@@ -533,26 +531,12 @@ class RhAtmos:
         assert vturb.shape == nh.shape[:-1]
         assert dx.shape[0] == nx
         assert z.shape[0] == nz
-        # Pack as double
-        p = xdrlib.Packer()
-        p.pack_int(nx)
-        p.pack_int(nz)
-        p.pack_int(nhydr)
-        p.pack_int(hboundary)
-        p.pack_int(bvalue[0])
-        p.pack_int(bvalue[1])
-        p.pack_farray(nx, dx.ravel().astype('d'), p.pack_double)
-        p.pack_farray(nz, z.ravel().astype('d'), p.pack_double)
-        p.pack_farray(nx * nz, T.ravel().astype('d'), p.pack_double)
-        p.pack_farray(nx * nz, ne.ravel().astype('d'), p.pack_double)
-        p.pack_farray(nx * nz, vturb.ravel().astype('d'), p.pack_double)
-        p.pack_farray(nx * nz, vx.ravel().astype('d'), p.pack_double)
-        p.pack_farray(nx * nz, vz.ravel().astype('d'), p.pack_double)
-        p.pack_farray(nx * nz * nhydr, nh.T.ravel().astype('d'), p.pack_double)
-        # Write to file
-        f = open(filename, 'wb')
-        f.write(p.get_buffer())
-        f.close()
+        # XDR: big-endian ints and doubles, arrays without length
+        with open(filename, 'wb') as f:
+            np.array([nx, nz, nhydr, hboundary, bvalue[0], bvalue[1]],
+                     dtype='>i4').tofile(f)
+            for arr in (dx, z, T, ne, vturb, vx, vz, nh.T):
+                np.asarray(arr, dtype='>f8').ravel().tofile(f)
 
 
 #############################################################################
@@ -563,12 +547,88 @@ class EmptyData:
         pass
 
 
+XDR_DTYPES = {'f': '>f4', 'd': '>f8', 'i': '>i4', 'ui': '>u4'}
+
+
+class XDRFile:
+    """
+    Zero-copy reader for XDR files, with the same interface as xdrlib.Unpacker.
+
+    The file is memory-mapped (copy-on-write) once. Scalars are decoded as
+    they are unpacked, but arrays (from unpack_array, or read_xdr_var) are
+    big-endian views of the map, so only the records that are actually used
+    get read from disk.
+
+    Parameters
+    ----------
+    filename : string
+        File to read.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        if os.path.getsize(filename) == 0:
+            self.data = np.zeros(0, dtype='u1')
+        else:
+            self.data = np.memmap(filename, dtype='u1', mode='c')
+        self.position = 0
+
+    def get_position(self):
+        return self.position
+
+    def set_position(self, position):
+        self.position = int(position)
+
+    def get_buffer(self):
+        return self.data
+
+    def done(self):
+        if self.position < self.data.size:
+            raise ValueError('XDRFile: unextracted data remains in {0}'.format(self.filename))
+
+    def unpack_array(self, dtype, count):
+        """Returns view of the next count items (of numpy dtype), and advances position."""
+        dtype = np.dtype(dtype)
+        end = self.position + count * dtype.itemsize
+        if end > self.data.size:
+            raise EOFError('XDRFile: reading past end of {0}'.format(self.filename))
+        out = self.data[self.position:end].view(dtype)
+        self.position = end
+        return out
+
+    def unpack_int(self):
+        return int(self.unpack_array(XDR_DTYPES['i'], 1)[0])
+
+    def unpack_uint(self):
+        return int(self.unpack_array(XDR_DTYPES['ui'], 1)[0])
+
+    def unpack_float(self):
+        return float(self.unpack_array(XDR_DTYPES['f'], 1)[0])
+
+    def unpack_double(self):
+        return float(self.unpack_array(XDR_DTYPES['d'], 1)[0])
+
+    def unpack_string(self):
+        n = self.unpack_uint()
+        out = self.unpack_array('u1', n).tobytes()
+        self.position += (4 - n % 4) % 4   # strings are padded to multiples of 4 bytes
+        return out
+
+    unpack_bytes = unpack_string
+
+    def unpack_farray(self, n, unpack_item):
+        dtypes = {self.unpack_float: XDR_DTYPES['f'], self.unpack_double: XDR_DTYPES['d'],
+                  self.unpack_int: XDR_DTYPES['i'], self.unpack_uint: XDR_DTYPES['ui']}
+        if unpack_item in dtypes:
+            return self.unpack_array(dtypes[unpack_item], n)
+        return [unpack_item() for i in range(n)]
+
+
 def read_xdr_file(filename):  # ,var,cl=None,verbose=False):
     """
-    Reads data from XDR file.
+    Opens XDR file for reading.
 
-    Because of the way xdrlib works, this reads the whole file to
-    memory at once. Avoid with very large files.
+    The file is memory-mapped, not read into memory; see XDRFile.
 
     Parameters
     ----------
@@ -577,26 +637,22 @@ def read_xdr_file(filename):  # ,var,cl=None,verbose=False):
 
     Returns
     -------
-    result   : xdrlib.Unpacker object
+    result   : XDRFile object (same interface as xdrlib.Unpacker)
     """
     try:
-        f = io.open(filename, 'rb')
-        data = f.read()
-        f.close()
+        return XDRFile(filename)
     except IOError as e:
         raise IOError(
             'read_xdr_file: problem reading {0}: {1}'.format(filename, e))
-    # return XDR data
-    return xdrlib.Unpacker(data)
 
 
 def close_xdr(buf, ofile='', verbose=False):
     """
-    Closes the xdrlib.Unpacker object, gives warning if not all data read.
+    Closes the XDRFile (or xdrlib.Unpacker) object, gives warning if not all data read.
 
     Parameters
     ----------
-    buf : xdrlib.Unpacker object
+    buf : XDRFile or xdrlib.Unpacker object
         data object.
     ofile : string, optional
         Original file from which data was read.
@@ -612,12 +668,12 @@ def close_xdr(buf, ofile='', verbose=False):
 
 def read_xdr_var(buf, var):
     """
-    Reads a single variable/array from a xdrlib.Unpack buffer.
+    Reads a single variable/array from a XDRFile (or xdrlib.Unpacker) buffer.
 
     Parameters
     ----------
 
-    buf:  xdrlib.Unpack object
+    buf:  XDRFile or xdrlib.Unpacker object
         Data buffer.
     var: tuple with (type[,shape]), where type is 'f', 'd', 'i', 'ui',
              or 's'. Shape is optional, and if true is shape of array.
@@ -626,7 +682,8 @@ def read_xdr_var(buf, var):
     Returns
     -------
     out :  int/float or array
-        Resulting variable.
+        Resulting variable. For XDRFile buffers, arrays are (big-endian)
+        views of the file, which are only read when used.
     """
     assert len(var) > 0
     if var[0] not in ['f', 'd', 'i', 'ui', 's']:
@@ -645,8 +702,12 @@ def read_xdr_var(buf, var):
             buf.unpack_int()
         out = func()
     else:
-        nitems = np.prod(var[1])
-        out = np.array(buf.unpack_farray(nitems, func)).reshape(var[1][::-1])
+        nitems = int(np.prod(var[1]))
+        if isinstance(buf, XDRFile) and var[0] != 's':
+            out = buf.unpack_array(XDR_DTYPES[var[0]], nitems)
+        else:
+            out = np.array(buf.unpack_farray(nitems, func))
+        out = out.reshape(var[1][::-1])
         # invert order of indices, to match IDL's
         out = np.transpose(out, list(range(len(var[1])))[::-1])
     return out
@@ -723,18 +784,12 @@ def write_B(outfile, Bx, By, Bz):
         they will be flattened before write. Bx, By, Bz units should be T.'''
     if (Bx.shape != By.shape) or (By.shape != Bz.shape):
         raise TypeError('writeB: B arrays have different shapes!')
-    n = np.prod(Bx.shape)
     # Convert into spherical coordinates
     B = np.sqrt(Bx**2 + By**2 + Bz**2)
     gamma_B = np.arccos(Bz / B)
     chi_B = np.arctan(By / Bx)
-    # Pack as double
-    p = xdrlib.Packer()
-    p.pack_farray(n, B.ravel().astype('d'), p.pack_double)
-    p.pack_farray(n, gamma_B.ravel().astype('d'), p.pack_double)
-    p.pack_farray(n, chi_B.ravel().astype('d'), p.pack_double)
-    # Write to file
-    f = open(outfile, 'wb')
-    f.write(p.get_buffer())
-    f.close()
+    # XDR: big-endian doubles, arrays without length
+    with open(outfile, 'wb') as f:
+        for arr in (B, gamma_B, chi_B):
+            np.asarray(arr, dtype='>f8').ravel().tofile(f)
     return
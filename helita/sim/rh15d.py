@@ -10,19 +10,43 @@ import h5py
 import netCDF4
 import numpy as np
 import xarray as xr
-from astropy import units
+from astropy import constants, units
+
+from . import tools
+
+try:
+    from numba import njit, prange
+except ImportError as err:
+    prange = tools.ImportFailed('numba', "This is used by depth_optim_columns.", err=err)
+    njit = tools.boring_decorator
 
 
 class Rh15dout:
     """
     Class to load and manipulate output from RH 1.5D.
+
+    Parameters
+    ----------
+    fdir : str, optional
+        Directory with output files.
+    verbose : bool, optional
+        If True, will print names of files read.
+    autoread : bool, optional
+        If True (default), will read output_aux, output_indata and
+        output_ray from fdir.
+    lazy : bool, optional
+        If True, groups are read with h5py instead of xarray, into
+        LazyGroup objects. Their variables are LazyVariable proxies,
+        which read from the file only the hyperslab that is indexed,
+        e.g. ray.intensity[100, 200] reads a single spectrum.
     """
 
-    def __init__(self, fdir='.', verbose=True, autoread=True):
+    def __init__(self, fdir='.', verbose=True, autoread=True, lazy=False):
         self.files = []
         self.params = {}
         self.verbose = verbose
         self.fdir = fdir
+        self.lazy = lazy
         if autoread:
             for outfile in ["output_aux", "output_indata"]:
                 OUTFILE = os.path.join(self.fdir, "%s.hdf5" % (outfile))
@@ -36,10 +60,17 @@ class Rh15dout:
             infile = os.path.splitext(infile)[0] + '.ncdf'
         if not os.path.isfile(infile):
             return
-        GROUPS = netCDF4.Dataset(infile).groups.keys()
-        for g in GROUPS:
-            setattr(self, g, xr.open_dataset(infile, group=g, lock=None))
-            self.files.append(getattr(self, g))
+        if self.lazy:
+            f = h5py.File(infile, mode='r')
+            self.files.append(f)
+            for g in f:
+                if isinstance(f[g], h5py.Group):
+                    setattr(self, g, LazyGroup(f[g]))
+        else:
+            GROUPS = netCDF4.Dataset(infile).groups.keys()
+            for g in GROUPS:
+                setattr(self, g, xr.open_dataset(infile, group=g, lock=None))
+                self.files.append(getattr(self, g))
         if self.verbose:
             print(('--- Read %s file.' % infile))
 
@@ -51,11 +82,29 @@ class Rh15dout:
                 infile = os.path.splitext(infile)[0] + '.ncdf'
         if not os.path.isfile(infile):
             return
-        self.ray = xr.open_dataset(infile, lock=None)
-        self.files.append(self.ray)
+        if self.lazy:
+            f = h5py.File(infile, mode='r')
+            self.ray = LazyGroup(f)
+            self.files.append(f)
+        else:
+            self.ray = xr.open_dataset(infile, lock=None)
+            self.files.append(self.ray)
         if self.verbose:
             print(('--- Read %s file.' % infile))
 
+    def chunk_layout(self):
+        '''
+        Returns dictionary with the HDF5 chunk shape (None if contiguous)
+        of each variable of the groups read in lazy mode, with keys
+        'group.variable'. Reading whole chunks is most efficient.
+        '''
+        layout = {}
+        for name, group in vars(self).items():
+            if isinstance(group, LazyGroup):
+                for var in group.variables.values():
+                    layout['%s.%s' % (name, var.name)] = var.chunks
+        return layout
+
     def close(self):
         ''' Closes the open files '''
         for f in self.files:
@@ -65,6 +114,192 @@ class Rh15dout:
         self.close()
 
 
+class LazyGroup:
+    """
+    Group of an RH 1.5D (netCDF4/HDF5) output file, opened with h5py.
+    Mimics the parts of xarray.Dataset used with Rh15dout: variables are
+    available as attributes or items (as LazyVariable objects), and
+    attributes in attrs (also as params).
+    """
+
+    def __init__(self, group):
+        self.group = group
+        self.attrs = {}
+        for att in group.attrs:
+            if att == '_NCProperties':
+                continue
+            try:
+                self.attrs[att] = group.attrs[att]
+            except OSError:  # catch errors where h5py cannot read UTF-8 strings
+                pass
+        self.params = self.attrs
+        self.variables = {}
+        for element in group:
+            dset = group[element]
+            if not isinstance(dset, h5py.Dataset):
+                continue
+            # skip netCDF dimensions that are not variables
+            if dset.attrs.get('NAME', b'')[:20] == b'This is a netCDF dim':
+                continue
+            self.variables[element] = LazyVariable(dset)
+
+    def __getattr__(self, name):
+        variables = self.__dict__.get('variables', {})
+        if name in variables:
+            return variables[name]
+        raise AttributeError("'LazyGroup' object has no attribute '%s'" % name)
+
+    def __getitem__(self, name):
+        return self.variables[name]
+
+    def __contains__(self, name):
+        return name in self.variables
+
+    def keys(self):
+        return self.variables.keys()
+
+    def __repr__(self):
+        lines = ['<LazyGroup %s>' % self.group.name]
+        lines += ['    %s' % repr(v) for v in self.variables.values()]
+        return '\n'.join(lines)
+
+    def close(self):
+        self.group.file.close()
+
+
+class LazyVariable:
+    """
+    Array proxy over an h5py dataset. Indexing reads only the bounding
+    hyperslab of the index from the file. Indexing is orthogonal (as in
+    xarray): integer arrays index each axis independently. As in xarray,
+    fill values are replaced by NaN.
+    """
+    HIDDEN_ATTRS = ('DIMENSION_LIST', 'REFERENCE_LIST', 'CLASS', 'NAME',
+                    '_FillValue', '_Netcdf4Dimid', '_Netcdf4Coordinates')
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.name = dataset.name.split('/')[-1]
+        self.dims = tuple(dataset.dims[i][0].name.split('/')[-1]
+                          if len(dataset.dims[i]) else 'dim_%i' % i
+                          for i in range(dataset.ndim))
+        if dataset.attrs.get('CLASS', b'') == b'DIMENSION_SCALE':
+            self.dims = (self.name,)   # coordinate variable
+        self.attrs = {}
+        for att in dataset.attrs:
+            if att not in self.HIDDEN_ATTRS:
+                try:
+                    self.attrs[att] = dataset.attrs[att]
+                except OSError:
+                    pass
+        self.fill_value = dataset.attrs.get('_FillValue', None)
+        if self.fill_value is not None:
+            self.fill_value = np.ravel(self.fill_value)[0]
+
+    shape = property(lambda self: self.dataset.shape)
+    dtype = property(lambda self: self.dataset.dtype)
+    ndim = property(lambda self: self.dataset.ndim)
+    size = property(lambda self: self.dataset.size)
+    chunks = property(lambda self: self.dataset.chunks,
+                      doc='HDF5 chunk shape, or None if contiguous.')
+    values = property(lambda self: self[()], doc='Reads the whole variable.')
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.values, dtype=dtype)
+
+    def __repr__(self):
+        return '<LazyVariable %s (%s) %s, chunks=%s>' % (
+            self.name, ', '.join(self.dims), self.dtype, self.chunks)
+
+    def isel(self, **indexers):
+        ''' Indexes by dimension names, e.g. isel(x=10, wavelength=slice(0, 100)). '''
+        key = [slice(None)] * self.ndim
+        for dim, index in indexers.items():
+            key[self.dims.index(dim)] = index
+        return self[tuple(key)]
+
+    def __getitem__(self, key):
+        h5key, post = _hyperslab(key, self.shape)
+        if self.size == 0:
+            data = np.empty([len(range(*k.indices(n))) for k, n in zip(h5key, self.shape)
+                             if isinstance(k, slice)], dtype=self.dtype)
+        else:
+            data = self.dataset[h5key]
+        if any(p is not None for p in post):
+            data = np.asarray(data)
+            axis = 0
+            for p in post:
+                if p is Ellipsis:   # marks an integer (dropped) axis
+                    continue
+                if isinstance(p, slice):
+                    data = data[(slice(None),) * axis + (p,)]
+                elif p is not None:
+                    data = np.take(data, p, axis=axis)
+                axis += 1
+        if (self.fill_value is not None) and (self.dtype.kind == 'f'):
+            data = np.asarray(data)
+            mask = data == self.fill_value
+            if np.any(mask):
+                data = np.where(mask, np.nan, data)
+        return data
+
+
+def _hyperslab(key, shape):
+    """
+    Converts a numpy-style index (with orthogonal indexing of arrays) into
+    a key for h5py with only integers and increasing slices (a hyperslab),
+    and a list of indices (one per axis) to apply to the hyperslab
+    afterwards: None if nothing, Ellipsis for axes indexed by integers.
+    """
+    if not isinstance(key, tuple):
+        key = (key,)
+    if any(k is Ellipsis for k in key):
+        i = [k is Ellipsis for k in key].index(True)
+        key = key[:i] + (slice(None),) * (len(shape) - len(key) + 1) + key[i + 1:]
+    if len(key) > len(shape):
+        raise IndexError('too many indices: %i for %i dimensions' % (len(key), len(shape)))
+    key = key + (slice(None),) * (len(shape) - len(key))
+    h5key = []
+    post = []
+    for k, n in zip(key, shape):
+        if isinstance(k, slice):
+            start, stop, step = k.indices(n)
+            if step > 0:
+                h5key.append(slice(start, max(start, stop), step))
+                post.append(None)
+            else:
+                idx = range(start, stop, step)
+                if len(idx) == 0:
+                    h5key.append(slice(0, 0))
+                    post.append(None)
+                else:
+                    h5key.append(slice(idx[-1], idx[0] + 1, -step))
+                    post.append(slice(None, None, -1))
+        elif np.ndim(k) == 0:
+            k = int(k)
+            if not -n <= k < n:
+                raise IndexError('index %i is out of bounds for axis with size %i' % (k, n))
+            h5key.append(k % n)
+            post.append(Ellipsis)
+        else:
+            k = np.asarray(k)
+            if k.dtype == bool:
+                k = np.flatnonzero(k)
+            k = np.where(k < 0, k + n, k)
+            if k.size == 0:
+                h5key.append(slice(0, 0))
+                post.append(None)
+            else:
+                if (k.min() < 0) or (k.max() >= n):
+                    raise IndexError('index out of bounds for axis with size %i' % n)
+                h5key.append(slice(int(k.min()), int(k.max()) + 1))
+                post.append(k - k.min())
+    return tuple(h5key), post
+
+
 class HDF5Atmos:
     """
     Class to load and manipulate RH 1.5D input atmosphere files in HDF5.
@@ -593,6 +828,108 @@ def make_xarray_atmos(outfile, T, vz, z, nH=None, x=None, y=None, Bz=None, By=No
         rootgrp.close()
 
 
+ATMOS_UNITS = {'temperature': 'K', 'velocity_x': 'm / s', 'velocity_y': 'm / s',
+               'velocity_z': 'm / s', 'electron_density': '1 / m3',
+               'hydrogen_populations': '1 / m3', 'density': 'kg / m3',
+               'B_x': 'T', 'B_y': 'T', 'B_z': 'T', 'velocity_turbulent': 'm / s',
+               'x': 'm', 'y': 'm', 'z': 'm'}
+
+
+def create_atmos_file(outfile, nx, ny, nz, variables, z, x=None, y=None,
+                      nhydr=1, desc=None, snap=None, boundary=None,
+                      append=False, chunks=None, complevel=0):
+    """
+    Creates an input file for RH 1.5D with the same layout as
+    make_xarray_atmos, but without writing the 3D variables, so that they
+    can be written in tiles of columns (e.g. by BifrostData.write_rh15d).
+
+    Parameters
+    ----------
+    outfile : string
+        Name of destination. If file exists it will be wiped, unless append.
+    nx, ny, nz : ints
+        Number of points in x, y, and depth.
+    variables : list of strings
+        Names of variables to create, e.g. 'temperature', 'B_z',
+        'hydrogen_populations' (see make_xarray_atmos).
+    z : 1-D array
+        Height in m.
+    x, y : 1-D arrays, optional
+        Grid distances in m.
+    nhydr : int, optional
+        Number of hydrogen levels in hydrogen_populations.
+    desc : string, optional
+        Description of file
+    snap : int, optional
+        Snapshot number.
+    boundary : Tuple, optional
+        Tuple with [bottom, top] boundary conditions (see make_xarray_atmos).
+    append : boolean, optional
+        If True, will append a new snapshot to existing file (if any).
+    chunks : tuple of 2 ints, optional
+        HDF5 chunk size along (x, y). Each chunk has all depth points of
+        a single snapshot. Default is (nx, ny).
+    complevel : int, optional
+        zlib compression level (0 for no compression, the default).
+
+    Returns
+    -------
+    ncfile : netCDF4.Dataset
+        File open for writing. Must be closed by caller.
+    nti : int
+        Index of the snapshot to write.
+    """
+    if (append and not os.path.isfile(outfile)):
+        append = False
+    if append:
+        ncfile = netCDF4.Dataset(outfile, mode='a')
+        nti = len(ncfile.dimensions['snapshot_number'])
+        if (nx, ny, nz) != tuple(len(ncfile.dimensions[d]) for d in ('x', 'y', 'depth')):
+            raise ValueError('(EEE) create_atmos_file: dimensions do not match '
+                             'those of existing file %s' % outfile)
+    else:
+        nti = 0
+        if boundary is None:
+            boundary = [1, 0]
+        if chunks is None:
+            chunks = (nx, ny)
+        chunks = (min(chunks[0], nx), min(chunks[1], ny))
+        ncfile = netCDF4.Dataset(outfile, mode='w', format='NETCDF4')
+        ncfile.setncatts({"comment": ("Created with create_atmos_file "
+                                      "on %s" % datetime.datetime.now()),
+                          "boundary_top": boundary[1],
+                          "boundary_bottom": boundary[0],
+                          "has_B": int('B_z' in variables),
+                          "description": str(desc),
+                          "nx": nx, "ny": ny, "nz": nz, "nt": 1})
+        ncfile.createDimension('snapshot_number', None)
+        ncfile.createDimension('x', nx)
+        ncfile.createDimension('y', ny)
+        ncfile.createDimension('depth', nz)
+        ncfile.createVariable('snapshot_number', 'i4', ('snapshot_number',))
+        for v, coord in zip(['x', 'y'], [x, y]):
+            if coord is not None:
+                var = ncfile.createVariable(v, 'f8', (v,))
+                var.units = ATMOS_UNITS[v]
+                var[:] = coord
+        var = ncfile.createVariable('z', 'f8', ('snapshot_number', 'depth'))
+        var.units = ATMOS_UNITS['z']
+        kw = dict(zlib=complevel > 0, complevel=max(complevel, 1))
+        for v in variables:
+            if v == 'hydrogen_populations':
+                ncfile.createDimension('nhydr', nhydr)
+                var = ncfile.createVariable(v, 'f4', ('snapshot_number', 'nhydr', 'x', 'y', 'depth'),
+                                            chunksizes=(1, 1) + chunks + (nz,), **kw)
+            else:
+                var = ncfile.createVariable(v, 'f4', ('snapshot_number', 'x', 'y', 'depth'),
+                                            chunksizes=(1,) + chunks + (nz,), **kw)
+            var.units = ATMOS_UNITS[v]
+            var.coordinates = 'z'
+    ncfile['snapshot_number'][nti] = nti if snap is None else snap
+    ncfile['z'][nti] = z
+    return ncfile, nti
+
+
 def depth_optim(height, temp, ne, vz, rho, nh=None, bx=None, by=None, bz=None,
                 tmax=5e4):
     """
@@ -610,7 +947,7 @@ def depth_optim(height, temp, ne, vz, rho, nh=None, bx=None, by=None, bz=None,
 
     """
     import scipy.interpolate as interp
-    from scipy.integrate import cumtrapz
+    from scipy.integrate import cumulative_trapezoid as cumtrapz
     ndep = len(height)
     # calculate optical depth from H-bf only
     taumax = 100
@@ -664,6 +1001,195 @@ def depth_optim(height, temp, ne, vz, rho, nh=None, bx=None, by=None, bz=None,
     return result
 
 
+def depth_optim_columns(height, temp, ne, vz, rho, nh=None, bx=None, by=None,
+                        bz=None, tmax=5e4, chunksize=None):
+    """
+    Performs depth optimisation of many columns at once. Same method as
+    depth_optim, but all columns are done in one compiled (numba) loop, and
+    the interpolations use monotone piecewise cubics (PCHIP) instead of
+    splines. Results agree with depth_optim to within interpolation accuracy.
+
+        IN:
+            height   [cm], shape (..., ndep), or (ndep,) if the same
+                     for all columns
+            temp     [K], shape (..., ndep); depth is the last axis
+            ne       [cm-3]
+            vz       [any]
+            rho      [g cm-3]
+            nh       [any] (optional), shape (nhydr, ..., ndep)
+            bx,by,bz [any] (optional)
+            tmax     [K] maximum temperature of the first point
+            chunksize  number of columns to process at a time (optional);
+                     limits the memory used for temporary arrays.
+
+        OUT:
+            list of new [height, temp, ne, vz, rho] (plus nh, and bx, by, bz,
+            if given), with the same shapes as the inputs. Height is
+            always returned with shape (..., ndep).
+    """
+    temp = np.asarray(temp)
+    shape = temp.shape
+    ndep = shape[-1]
+    ncol = int(np.prod(shape[:-1]))
+    height = np.asarray(height, dtype='f8')
+    height = height.reshape(-1, ndep)
+
+    def columns(var):
+        return np.asarray(var).reshape(ncol, ndep)
+
+    # variables to interpolate, and whether to interpolate their log
+    variables = [columns(temp), columns(ne), columns(vz), columns(rho)]
+    logs = [True, True, False, True]
+    if nh is not None:
+        nh = np.asarray(nh)
+        variables += [nh[k].reshape(ncol, ndep) for k in range(nh.shape[0])]
+        logs += [True] * nh.shape[0]
+    if bx is not None:
+        variables += [columns(bx), columns(by), columns(bz)]
+        logs += [False] * 3
+    logs = np.array(logs)
+    nvar = len(variables)
+    ee = constants.e.si.value * 1e7
+    bk = constants.k_B.cgs.value
+    new_height = np.empty((ncol, ndep))
+    new_vars = np.empty((nvar, ncol, ndep))
+    if chunksize is None:
+        chunksize = ncol
+    for i0 in range(0, ncol, chunksize):
+        i1 = min(i0 + chunksize, ncol)
+        hh = height if height.shape[0] == 1 else height[i0:i1]
+        vv = np.empty((nvar, i1 - i0, ndep))
+        for k, var in enumerate(variables):
+            vv[k] = var[i0:i1]
+        _depth_optim_kernel(hh, vv, logs, tmax, ee / bk,
+                            new_height[i0:i1], new_vars[:, i0:i1])
+    result = [new_height.reshape(shape)]
+    result += [new_vars[k].reshape(shape) for k in range(4)]
+    k = 4
+    if nh is not None:
+        result += [new_vars[k:k + nh.shape[0]].reshape(nh.shape)]
+        k += nh.shape[0]
+    if bx is not None:
+        result += [new_vars[k + i].reshape(shape) for i in range(3)]
+    return result
+
+
+@njit(parallel=True)
+def _depth_optim_kernel(height, variables, logs, tmax, ee_bk, new_height,
+                        new_vars):
+    """
+    Depth optimisation of each column. variables[0], [1] and [3] must be
+    temp, ne and rho. Height has shape (ncol, ndep), or (1, ndep).
+    """
+    taumax = 100.
+    grph = 2.26e-24   # grams per hydrogen atom
+    crhmbf = 2.9256e-17
+    nvar, ncol, ndep = variables.shape
+    for c in prange(ncol):
+        hc = height[0] if height.shape[0] == 1 else height[c]
+        temp = variables[0, c]
+        ne = variables[1, c]
+        rho = variables[3, c]
+        # optical depth from H-bf only, and points to use
+        tau = 0.
+        xprev = 0.
+        npt = 0
+        sel = np.empty(ndep, dtype=np.int64)
+        taus = np.empty(ndep)
+        for k in range(ndep):
+            xhbf = 1.03526e-16 * ne[k] * crhmbf / temp[k]**1.5 * \
+                np.exp(0.754 * ee_bk / temp[k]) * rho[k] / grph
+            if k > 0:
+                tau += 0.5 * (xhbf + xprev) * (hc[k - 1] - hc[k])
+            xprev = xhbf
+            if (tau < taumax) and (temp[k] < tmax):
+                sel[npt] = k
+                taus[npt] = tau
+                npt += 1
+        if npt < 2:
+            new_height[c, :] = np.nan
+            new_vars[:, c, :] = np.nan
+            continue
+        # cumulative maximum variance of T, rho, and tau
+        aind = np.zeros(npt)
+        for j in range(1, npt):
+            tdiv = abs(np.log10(temp[sel[j]] / temp[sel[j - 1]])) / np.log10(1.1)
+            rdiv = abs(np.log10(rho[sel[j]] / rho[sel[j - 1]])) / np.log10(1.1)
+            taudiv = 0.
+            if j > 1:
+                taudiv = abs(np.log10(taus[j] / taus[j - 1])) / 0.1
+            aind[j] = aind[j - 1] + max(tdiv, rdiv, taudiv)
+        for j in range(npt):
+            aind[j] *= (ndep - 1) / aind[npt - 1]
+        hsel = np.empty(npt)
+        for j in range(npt):
+            hsel[j] = hc[sel[j]]
+        # new height, constant in aind
+        _pchip(aind, hsel, np.arange(ndep) * 1., new_height[c])
+        # interpolate quantities for new depth scale (on increasing height)
+        hrev = hc[::-1].copy()
+        yrev = np.empty(ndep)
+        for v in range(nvar):
+            for k in range(ndep):
+                yrev[k] = variables[v, c, ndep - 1 - k]
+                if logs[v]:
+                    yrev[k] = np.log(yrev[k])
+            _pchip(hrev, yrev, new_height[c], new_vars[v, c])
+            if logs[v]:
+                for k in range(ndep):
+                    new_vars[v, c, k] = np.exp(new_vars[v, c, k])
+
+
+@njit
+def _pchip(x, y, xnew, out):
+    """
+    Monotone piecewise cubic Hermite interpolation of (x, y) at xnew, into
+    out. x must be non-decreasing; values outside x are clamped.
+    Slopes are as in scipy.interpolate.PchipInterpolator.
+    """
+    n = x.size
+    h = np.empty(n - 1)
+    delta = np.empty(n - 1)
+    for k in range(n - 1):
+        h[k] = x[k + 1] - x[k]
+        delta[k] = (y[k + 1] - y[k]) / h[k] if h[k] > 0 else 0.
+    d = np.zeros(n)
+    if n == 2:
+        d[0] = d[1] = delta[0]
+    else:
+        for k in range(1, n - 1):
+            if delta[k - 1] * delta[k] > 0:
+                w1 = 2 * h[k] + h[k - 1]
+                w2 = h[k] + 2 * h[k - 1]
+                d[k] = (w1 + w2) / (w1 / delta[k - 1] + w2 / delta[k])
+        d[0] = _pchip_end_slope(h[0], h[1], delta[0], delta[1])
+        d[n - 1] = _pchip_end_slope(h[n - 2], h[n - 3], delta[n - 2], delta[n - 3])
+    for i in range(xnew.size):
+        xi = min(max(xnew[i], x[0]), x[n - 1])
+        k = min(max(np.searchsorted(x, xi, side='right') - 1, 0), n - 2)
+        if h[k] <= 0:
+            out[i] = y[k]
+            continue
+        t = (xi - x[k]) / h[k]
+        t2 = t * t
+        t3 = t2 * t
+        out[i] = (2 * t3 - 3 * t2 + 1) * y[k] + (t3 - 2 * t2 + t) * h[k] * d[k] + \
+            (-2 * t3 + 3 * t2) * y[k + 1] + (t3 - t2) * h[k] * d[k + 1]
+
+
+@njit
+def _pchip_end_slope(h0, h1, m0, m1):
+    """ Shape-preserving three-point estimate of the end slope. """
+    if h0 + h1 <= 0:
+        return 0.
+    d = ((2 * h0 + h1) * m0 - h0 * m1) / (h0 + h1)
+    if d * m0 <= 0:
+        return 0.
+    if (m0 * m1 <= 0) and (abs(d) > abs(3 * m0)):
+        return 3 * m0
+    return d
+
+
 def make_wave_file(outfile, start=None, end=None, step=None, new_wave=None,
                    ewave=None, air=True):
     """
@@ -735,13 +1261,8 @@ def read_wave_file(infile):
     wave : array
         Wavelength from file.
     """
-    import io
-    import xdrlib
-
-    from .rh import read_xdr_var
-    f = io.open(infile, 'rb')
-    buf = xdrlib.Unpacker(f.read())
-    f.close()
+    from .rh import read_xdr_file, read_xdr_var
+    buf = read_xdr_file(infile)
     nw = read_xdr_var(buf, 'i')
     return read_xdr_var(buf, ('d', (nw,)))
 
@@ -79,6 +79,7 @@ PAD_DEFAULTS = {'x': PAD_PERIODIC, 'y': PAD_PERIODIC, 'z': PAD_NONPERIODIC}   #
 DEFAULT_STAGGER_KIND = 'numpy_improved'  # which stagger kind to use by default.
 VALID_STAGGER_KINDS = tuple(('fifth', 'fifth_improved', 'first', 'numpy_improved'))  # list of valid stagger kinds.
 DEFAULT_MESH_LOCATION_TRACKING = False   # whether mesh location tracking should be enabled, by default.
+OPS_COUNTER = collections.Counter()   # number of times each operation has been done by 'do'. (used for profiling)
 
 
 def STAGGER_KIND_PROPERTY(internal_name='_stagger_kind', default=DEFAULT_STAGGER_KIND):
@@ -206,6 +207,7 @@ def do(var, operation='xup', diff=None, pad_mode=None, stagger_kind=DEFAULT_STAG
         derivative = False
         if diff is not None:
             raise ValueError(f"diff must not be provided for non-derivative operation: {operation}")
+    OPS_COUNTER[operation_orig] += 1
     # make sure var is 3D. make warning then handle appropriately if not.
     if np.ndim(var) != 3:
         warnmsg = f'can only stagger 3D array but got {np.ndim(var)}D.'
@@ -1260,6 +1262,7 @@ class StaggerInterface():
 
     def __init__(self, obj):
         self._obj_ref = weakref.ref(obj)  # weakref to avoid circular reference.
+        self.n_zops = 0   # number of z operations done so far. (see load_arithmetic_quantities.iter_z_slabs)
         prop_func_pairs = [(_trim_leading_underscore(prop), func) for prop, func in _STAGGER_ALIASES.items()]
         self._make_bound_chain(*prop_func_pairs, name='BoundInterpolationChain')
 
@@ -1316,6 +1319,8 @@ class StaggerInterface():
         __tracebackhide__ = True
         kw_to_use = {**self._pad_modes(), **self._diffs(), **self._stagger_kind()}  # defaults based on obj.
         kw_to_use.update(kw)   # exisitng kwargs override defaults.
+        if getattr(func, 'x', None) == 'z':
+            self.n_zops += 1
         if isinstance(arr, str):
             arr = self.obj(arr, *args__get_var, **kw)
         return func(arr, **kw_to_use)
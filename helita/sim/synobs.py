@@ -4,11 +4,293 @@ conditions
 """
 import os
 import math
+import weakref
+import multiprocessing
+from multiprocessing import shared_memory
+from multiprocessing.dummy import Pool as ThreadPool
 
 import numpy as np
+import scipy.fft
 import scipy.interpolate as interp
 from scipy import ndimage, signal
 
+# boundary modes of PSFConvolver (as in scipy.ndimage), and matching np.pad modes
+PAD_MODES = {'wrap': 'wrap', 'reflect': 'symmetric', 'mirror': 'reflect',
+             'nearest': 'edge', 'constant': 'constant'}
+
+
+class PSFConvolver:
+    '''
+    Convolves images with a PSF, using real FFTs. The PSF transform is
+    computed once for the image shape, and then applied to any number of
+    images (e.g. all wavelengths and times) in batches, with one rfft2
+    per batch.
+
+    IN:
+      psf:        2D array with PSF, in image pixels (normalised to unit sum).
+      shape:      2-element tuple, shape of the images (first two axes).
+      mode:       boundary mode, as in scipy.ndimage: 'wrap' (periodic, default),
+                  'reflect', 'mirror', 'nearest', or 'constant' (zero).
+                  For 'wrap' the convolution is circular over the image, with
+                  no padding. Otherwise images are padded by the PSF size.
+      nthreads:   number of threads for the FFTs.
+      dtype:      floating point type of the computations. Default is 'f4',
+                  which is about twice as fast as 'f8'.
+      batch:      maximum number of images per FFT. Default is as many as fit
+                  in about 256 MB of transforms.
+
+    USAGE:
+      conv = PSFConvolver(psf, spec.shape[:2])
+      nspec = conv(spec)   # spec has shape (nx, ny, ...), convolves spec[:, :, ...]
+    '''
+
+    def __init__(self, psf, shape, mode='wrap', nthreads=1, dtype='f4', batch=None):
+        if mode not in PAD_MODES:
+            raise ValueError('Invalid mode %s. Supported values are %s' %
+                             (mode, list(PAD_MODES.keys())))
+        self.shape = tuple(shape)
+        self.mode = mode
+        self.nthreads = nthreads
+        self.dtype = np.dtype(dtype)
+        psf = np.asarray(psf, dtype='f8')
+        # offset of PSF centre, as in signal.fftconvolve(..., mode='same')
+        offset = [(k - 1) // 2 for k in psf.shape]
+        if mode == 'wrap':
+            self.pad = [(0, 0), (0, 0)]
+            self.fshape = self.shape
+        else:
+            self.pad = [(k - 1 - o, o) for k, o in zip(psf.shape, offset)]
+            self.fshape = tuple(scipy.fft.next_fast_len(n + sum(p), real=True)
+                                for n, p in zip(self.shape, self.pad))
+        # PSF wrapped around origin of FFT grid (summing any overlaps)
+        kernel = np.zeros(self.fshape)
+        ix = (np.arange(psf.shape[0]) - offset[0]) % self.fshape[0]
+        iy = (np.arange(psf.shape[1]) - offset[1]) % self.fshape[1]
+        np.add.at(kernel, (ix[:, None], iy[None, :]), psf)
+        self.kernel_ft = scipy.fft.rfft2(kernel).astype(np.result_type(self.dtype, np.complex64))
+        if batch is None:
+            batch = max(1, 2**28 // (self.kernel_ft.size * self.kernel_ft.itemsize))
+        self.batch = batch
+
+    def __call__(self, images, out=None):
+        '''
+        Convolves images (shape (nx, ny) or (nx, ny, ...)) with the PSF.
+        Returns array with same shape, of type dtype (or writes into out,
+        which can be images itself).
+        '''
+        images = np.asarray(images)
+        if images.shape[:2] != self.shape:
+            raise ValueError('Images shape %s does not match PSFConvolver shape %s' %
+                             (images.shape[:2], self.shape))
+        if out is None:
+            out = np.empty(images.shape, dtype=self.dtype)
+        nx, ny = self.shape
+        stack = images.reshape(nx, ny, -1)
+        result = out.reshape(nx, ny, -1)
+        kernel_ft = self.kernel_ft[:, :, None]
+        (bx, _), (by, _) = self.pad
+        for i in range(0, stack.shape[-1], self.batch):
+            block = stack[:, :, i:i + self.batch].astype(self.dtype, copy=False)
+            if self.mode != 'wrap':
+                pad = [(b, f - n - b) for (b, _), f, n in zip(self.pad, self.fshape, self.shape)]
+                block = np.pad(block, pad + [(0, 0)], mode=PAD_MODES[self.mode])
+            block_ft = scipy.fft.rfft2(block, axes=(0, 1), workers=self.nthreads)
+            block_ft *= kernel_ft
+            block = scipy.fft.irfft2(block_ft, s=self.fshape, axes=(0, 1),
+                                     workers=self.nthreads)
+            result[:, :, i:i + self.batch] = block[bx:bx + nx, by:by + ny]
+        return out
+
+
+class SharedArrayExecutor:
+    '''
+    Runs a function over ranges of rows (first axis) of arrays, serially, in
+    threads, or in processes. In 'process' mode, the input and output arrays
+    are placed in shared memory (multiprocessing.shared_memory), so that
+    workers only receive the names of the memory blocks and their index
+    ranges; nothing large is pickled, and it also works with the 'spawn'
+    start method. The pool of workers is kept between calls to map.
+
+    IN:
+      nproc:      number of workers. Default is the number of CPUs.
+      mode:       'serial', 'thread', or 'process'.
+      nchunks:    number of row ranges per worker (for load balancing).
+      context:    multiprocessing start method (e.g. 'spawn') for 'process'
+                  mode. Default is the platform default.
+
+    The shared memory of the inputs is released when map returns. That of
+    the outputs is unlinked too, and freed once the returned arrays are no
+    longer referenced, so reusing an executor does not accumulate memory.
+
+    USAGE:
+      with SharedArrayExecutor(nproc=8, mode='process') as ex:
+          out = ex.map(func, {'spec': spec}, {'result': (shape, 'f4')}, args)
+      # func(i0, i1, inputs, outputs, *args) must be a module-level function
+      # which writes outputs['result'][i0:i1]. out is a dict of arrays.
+    '''
+    MODES = ('serial', 'thread', 'process')
+
+    def __init__(self, nproc=None, mode='process', nchunks=4, context=None):
+        if mode not in self.MODES:
+            raise ValueError('Invalid mode %s. Supported values are %s' %
+                             (mode, self.MODES))
+        self.nproc = nproc or os.cpu_count()
+        self.mode = mode
+        self.nchunks = nchunks
+        self.context = context
+        self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _get_pool(self):
+        if self.pool is None:
+            if self.mode == 'thread':
+                self.pool = ThreadPool(self.nproc)
+            else:
+                ctx = multiprocessing.get_context(self.context)
+                self.pool = ctx.Pool(self.nproc)
+        return self.pool
+
+    @staticmethod
+    def _shared(shape, dtype, blocks):
+        ''' Returns (spec, array) for a new array in shared memory, appending its block to blocks. '''
+        dtype = np.dtype(dtype)
+        nbytes = max(1, int(np.prod(shape)) * dtype.itemsize)
+        block = shared_memory.SharedMemory(create=True, size=nbytes)
+        blocks.append(block)
+        arr = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        return (block.name, tuple(shape), dtype.str), arr
+
+    def map(self, func, inputs, outputs, args=(), nitems=None):
+        '''
+        Calls func(i0, i1, inputs, outputs, *args) for ranges of rows i0:i1
+        covering nitems (default: length of first output), and returns
+        the dict of outputs.
+
+        IN:
+          func:       function, must be picklable for 'process' mode.
+          inputs:     dict of input arrays.
+          outputs:    dict of (shape, dtype) of output arrays.
+          args:       tuple of extra (small) arguments for func.
+        '''
+        if nitems is None:
+            nitems = list(outputs.values())[0][0][0]
+        nranges = 1 if self.mode == 'serial' else min(nitems, self.nproc * self.nchunks)
+        edges = np.linspace(0, nitems, nranges + 1).astype(int)
+        ranges = [(int(i0), int(i1)) for i0, i1 in zip(edges[:-1], edges[1:]) if i1 > i0]
+        if self.mode != 'process':
+            out = {k: np.empty(shape, dtype=dtype) for k, (shape, dtype) in outputs.items()}
+            if self.mode == 'serial':
+                for i0, i1 in ranges:
+                    func(i0, i1, inputs, out, *args)
+            else:
+                self._get_pool().starmap(func, [(i0, i1, inputs, out) + tuple(args)
+                                                for i0, i1 in ranges])
+            return out
+        in_blocks, out_blocks = [], []
+        try:
+            in_specs = {}
+            for key, arr in inputs.items():
+                arr = np.asarray(arr)
+                in_specs[key], shared = self._shared(arr.shape, arr.dtype, in_blocks)
+                shared[...] = arr
+                del shared
+            out_specs = {}
+            out = {}
+            for key, (shape, dtype) in outputs.items():
+                out_specs[key], out[key] = self._shared(shape, dtype, out_blocks)
+                # the mapping is closed once the returned array is no longer referenced
+                weakref.finalize(out[key], _close_block, out_blocks[-1])
+            tasks = [(func, i0, i1, in_specs, out_specs, tuple(args)) for i0, i1 in ranges]
+            self._get_pool().map(_shared_task, tasks, chunksize=1)
+        finally:
+            # workers are done with all blocks; remove their names so nothing outlives
+            # the returned arrays, and release the inputs now.
+            for block in in_blocks + out_blocks:
+                block.unlink()
+            for block in in_blocks:
+                _close_block(block)
+        return out
+
+    def close(self):
+        '''
+        Stops the workers. Arrays returned by map remain valid while they
+        are referenced.
+        '''
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+def _close_block(block):
+    ''' Closes a shared memory block, unless arrays still use it. '''
+    try:
+        block.close()
+    except BufferError:
+        pass
+
+
+def _attach(specs):
+    ''' Returns (blocks, arrays) for shared memory specs from SharedArrayExecutor. '''
+    blocks = {}
+    arrays = {}
+    for key, (name, shape, dtype) in specs.items():
+        blocks[key] = shared_memory.SharedMemory(name=name)
+        arrays[key] = np.ndarray(shape, dtype=dtype, buffer=blocks[key].buf)
+    return blocks, arrays
+
+
+def _shared_task(task):
+    ''' Runs one task of SharedArrayExecutor.map in a worker process. '''
+    func, i0, i1, in_specs, out_specs, args = task
+    in_blocks, inputs = _attach(in_specs)
+    out_blocks, outputs = _attach(out_specs)
+    try:
+        func(i0, i1, inputs, outputs, *args)
+    finally:
+        del inputs, outputs
+        for block in list(in_blocks.values()) + list(out_blocks.values()):
+            block.close()
+
+
+def gaussian_psf(sigma, truncate=4.0):
+    '''
+    Returns 2D Gaussian PSF with standard deviation sigma (in pixels),
+    sampled as in ndimage.gaussian_filter (radius of truncate * sigma).
+    '''
+    radius = int(truncate * float(sigma) + 0.5)
+    x = np.arange(-radius, radius + 1)
+    g = np.exp(-0.5 * (x / sigma)**2)
+    g /= g.sum()
+    return np.outer(g, g)
+
+
+def psf_to_pixels(psf, psfx, pix2Mm):
+    '''
+    Interpolates a PSF kernel to the pixel scale of a simulation.
+
+    IN:
+      psf:        2D array with PSF
+      psfx:       1D array with PSF coordinates in arcsec
+      pix2Mm:     size of simulation's pixels in Mm
+
+    OUT:
+      npsf:       2D array with PSF in simulation pixels, normalised.
+    '''
+    asec2Mm = 696. / 959.5         # conversion between arcsec and Mm
+    psf_x = psfx * asec2Mm
+    sep = np.mean(psf_x[1:] - psf_x[:-1])
+    coords = np.mgrid[0: psf_x.shape[0]: pix2Mm / sep,
+                      0: psf_x.shape[0]: pix2Mm / sep]
+    npsf = ndimage.map_coordinates(psf, coords, order=1, mode='nearest')
+    npsf /= np.sum(npsf)
+    return npsf
+
 
 def spec_conv(spec, wave, conv_type='IRIS', ww=None, wpts=200, winterp='linear',
               xMm=16.5491, graph=False, lscale=1.):
@@ -88,7 +370,7 @@ def spec_conv(spec, wave, conv_type='IRIS', ww=None, wpts=200, winterp='linear',
 
 
 def spec3d_conv(spec, wave, conv_type='IRIS', ww=None, wpts=200,
-                winterp='linear', xMm=16.5491):
+                winterp='linear', xMm=16.5491, nthreads=1):
     ''' Convolves a 3D spectrogram to observational conditions (both on the
         spatial andspectral axes)
 
@@ -103,8 +385,7 @@ def spec3d_conv(spec, wave, conv_type='IRIS', ww=None, wpts=200,
       winterp:    string, type of wavelength interpolation for interp1d
                   ('linear', 'cubic', etc.)
       xMm:        physical size (in Mm) of spatial dimension
-      graph:      if true, will show images
-      lscale:     luminance scale for images
+      nthreads:   number of threads for the spatial convolution.
 
     OUT:
       nspec:      3D array of new spectrogram.
@@ -127,9 +408,10 @@ def spec3d_conv(spec, wave, conv_type='IRIS', ww=None, wpts=200,
     # Spatial convolution
     dstep = pix2asec
     dsigma = cp[conv_type][0] / (dstep * 2 * math.sqrt(2 * math.log(2)))
-    #nspec = ndimage.gaussian_filter(nspec,[dsigma,dsigma,wsigma])
-    for w in range(nwave):
-        spec[:, :, w] = ndimage.gaussian_filter(spec[:, :, w], dsigma)
+    # (in place, for all wavelengths at once)
+    conv = PSFConvolver(gaussian_psf(dsigma), spec.shape[:2], mode='reflect',
+                        nthreads=nthreads)
+    conv(spec, out=spec)
     # Spatial pixelisation
     coords = np.mgrid[0.: spec.shape[0]:cp[conv_type][1] / pix2asec,
                       0.: spec.shape[1]:cp[conv_type][1] / pix2asec]
@@ -224,16 +506,9 @@ def img_conv(spec, wave, psf, psfx, conv_type='IRIS_MgII_core', xMm=16.5491,
         p.title('Filter only')
         p.xlabel('arcsec')
         p.ylabel('arcsec')
-    # spatial convolution
-    psf_x = psfx * asec2Mm
-    sep = np.mean(psf_x[1:] - psf_x[:-1])
-    coords = np.mgrid[0: psf_x.shape[0]: pix2Mm / sep,
-                      0: psf_x.shape[0]: pix2Mm / sep]
-    npsf = ndimage.map_coordinates(psf, coords, order=1, mode='nearest')
-    npsf /= np.sum(npsf)
-    im = np.concatenate([nspec[-50:], nspec, nspec[:50]])
-    im = np.concatenate([im[:, -50:], im, im[:, :50]], axis=1)
-    nspec = signal.fftconvolve(im, npsf, mode='same')[50:-50, 50:-50]
+    # spatial convolution (periodic)
+    npsf = psf_to_pixels(psf, psfx, pix2Mm)
+    nspec = PSFConvolver(npsf, nspec.shape, dtype=nspec.dtype)(nspec)
     # pixelisation
     if pixelise:
         coords = np.mgrid[0.:spec.shape[0]:cp[conv_type][1] / pix2asec,
@@ -293,30 +568,16 @@ def get_hinode_psf(wave, psfdir='.'):
     return ix, psf
 
 
-def spectral_convolve(w):
-    '''
-    Spectral convolution function for imgspec_conv. Interpolates to new
-    wavelength and does a gaussian convolution in the last index of the
-    spectrum array. Input is a single tuple to make it easier to
-    parallelise with multiprocessing. Requires the existence of a global
-    array called result.
-    '''
-    i, wsigma, wave, nwave, spec = w   # get arguments from tuple
-    f = interp.interp1d(wave, spec, kind='linear')
-    spec = f(nwave)
-    result[i] = ndimage.gaussian_filter1d(spec, wsigma, axis=-1,
-                                          mode='nearest')
-
-
-def spatial_convolve(w):
+def spectral_convolve(i0, i1, inputs, outputs, wsigma, wave, nwave):
     '''
-    Spatial convolution function for imgspec_conv. Does a convolution with
-    given psf in Fourier space. Input is a single tuple to make it easier to
-    parallelise with multiprocessing. Requires the existence of a global
-    array called result.
+    Spectral convolution function for imgspec_conv, for rows i0:i1 (in the
+    format of SharedArrayExecutor.map). Interpolates inputs['spec'] to new
+    wavelength and does a gaussian convolution in the last index, into
+    outputs['result'].
     '''
-    i, im, psf = w
-    result[:, :, i] = signal.fftconvolve(im, psf, mode='same')[50:-50, 50:-50]
+    f = interp.interp1d(wave, inputs['spec'][i0:i1], kind='linear')
+    outputs['result'][i0:i1] = ndimage.gaussian_filter1d(f(nwave), wsigma, axis=-1,
+                                                         mode='nearest')
 
 
 def var_conv(var, xMm, psf, psfx, obs='iris_nuv', parallel=False,
@@ -324,10 +585,6 @@ def var_conv(var, xMm, psf, psfx, obs='iris_nuv', parallel=False,
     """
     Spatially convolves a single atmos variable.
     """
-    import ctypes
-    import multiprocessing
-    global result
-
     # some definitions
     asec2Mm = 696. / 959.5         # conversion between arcsec and Mm
     pix2Mm = xMm / var.shape[0]    # size of simulation's pixels in Mm
@@ -337,30 +594,10 @@ def var_conv(var, xMm, psf, psfx, obs='iris_nuv', parallel=False,
         obs_pix2Mm = 0.166 * asec2Mm   # size of instrument spatial pixels in Mm
     nwave = var.shape[-1]   # This is really depth, not wavelength...
     # convert PSF kernel to the spectrogram's pixel scale
-    psf_x = psfx * asec2Mm
-    sep = np.mean(psf_x[1:] - psf_x[:-1])
-    coords = np.mgrid[0: psf_x.shape[0]: pix2Mm / sep,
-                      0: psf_x.shape[0]: pix2Mm / sep]
-    npsf = ndimage.map_coordinates(psf, coords, order=1, mode='nearest')
-    npsf /= np.sum(npsf)
-    im = np.concatenate([var[-50:], var, var[:50]])
-    im = np.concatenate([im[:, -50:], im, im[:, :50]], axis=1)
-    itr = ((i, im[:, :, i], npsf) for i in range(nwave))
-
-    # Spatial convolution
-    if parallel:
-        # multiprocessing shared object to collect output
-        result_base = multiprocessing.Array(ctypes.c_float, np.prod(var.shape))
-        result = np.ctypeslib.as_array(result_base.get_obj())
-        result = result.reshape(var.shape)
-        pool = multiprocessing.Pool()       # by default use all CPUs
-        pool.map(spatial_convolve, itr)
-        pool.close()
-        pool.join()
-    else:
-        result = np.empty_like(var)
-        for w in itr:
-            spatial_convolve(w)
+    npsf = psf_to_pixels(psf, psfx, pix2Mm)
+    # Spatial convolution (periodic), all depths at once
+    nthreads = (os.cpu_count() if parallel is True else int(parallel)) or 1
+    result = PSFConvolver(npsf, var.shape[:2], nthreads=nthreads)(var)
 
     # Spatial pixelisation
     if pixelise:
@@ -380,7 +617,7 @@ def var_conv(var, xMm, psf, psfx, obs='iris_nuv', parallel=False,
 
 
 def imgspec_conv(spec, wave, xMm, psf, psfx, obs='hinode_sp', verbose=False,
-                 pixelise=True, parallel=False, mean2=False):
+                 pixelise=True, parallel=False, mean2=False, executor=None):
     '''
     Convolves a 3D spectrogram to observational conditions (does spatial
     convolution, spectral convolution and pixelisation, in that order)
@@ -393,9 +630,13 @@ def imgspec_conv(spec, wave, xMm, psf, psfx, obs='hinode_sp', verbose=False,
       psf_x:      1D array with PSF radial coordinates in arcsec
       obs:        type of observations. Options: 'hinode_sp', 'iris_nuv'.
       parallel:   if True, will run in parallel using all available CPUs
+                  (or this number of CPUs, if an integer)
       pixelise:   if True, will pixelise into the observational conditions
       mean2:      if True and pixelise is True, will average every 2 pixels on
                   second dimension (to mimick the size of IRIS's slit width)
+      executor:   SharedArrayExecutor for the spectral convolution, e.g. to
+                  reuse the same workers for many calls. If not given,
+                  a process executor is created if parallel.
 
     OUT:
       nspec:      3D array of spectrogram.
@@ -403,10 +644,6 @@ def imgspec_conv(spec, wave, xMm, psf, psfx, obs='hinode_sp', verbose=False,
 
     --Tiago, 20120105
     '''
-    import ctypes
-    import multiprocessing
-    global result
-
     # some definitions
     asec2Mm = 696. / 959.5         # conversion between arcsec and Mm
     pix2Mm = xMm / spec.shape[0]   # size of simulation's pixels in Mm
@@ -437,30 +674,10 @@ def imgspec_conv(spec, wave, xMm, psf, psfx, obs='hinode_sp', verbose=False,
     if verbose:
         print('Spatial convolution...')
     # convert PSF kernel to the spectrogram's pixel scale
-    psf_x = psfx * asec2Mm
-    sep = np.mean(psf_x[1:] - psf_x[:-1])
-    coords = np.mgrid[0: psf_x.shape[0]: pix2Mm / sep,
-                      0: psf_x.shape[0]: pix2Mm / sep]
-    npsf = ndimage.map_coordinates(psf, coords, order=1, mode='nearest')
-    npsf /= np.sum(npsf)
-    im = np.concatenate([spec[-50:], spec, spec[:50]])
-    im = np.concatenate([im[:, -50:], im, im[:, :50]], axis=1)
-    itr = ((i, im[:, :, i], npsf) for i in range(nwave))
-
-    if parallel:
-        # multiprocessing shared object to collect output
-        result_base = multiprocessing.Array(
-            ctypes.c_float, np.prod(spec.shape))
-        result = np.ctypeslib.as_array(result_base.get_obj())
-        result = result.reshape(spec.shape)
-        pool = multiprocessing.Pool(parallel)       # by default use all CPUs
-        pool.map(spatial_convolve, itr)
-        pool.close()
-        pool.join()
-    else:
-        result = np.empty_like(spec)
-        for w in itr:
-            spatial_convolve(w)
+    npsf = psf_to_pixels(psf, psfx, pix2Mm)
+    # periodic convolution of all wavelengths at once
+    nthreads = (os.cpu_count() if parallel is True else int(parallel)) or 1
+    result = PSFConvolver(npsf, spec.shape[:2], nthreads=nthreads)(spec)
 
     # Spatial pixelisation
     if pixelise:
@@ -488,23 +705,18 @@ def imgspec_conv(spec, wave, xMm, psf, psfx, obs='hinode_sp', verbose=False,
     wstep = nwave[1] - nwave[0]
     wsigma = obs_spect_res / \
         (wstep * 2 * math.sqrt(2 * math.log(2)))  # fwhm to sigma
-    itr = ((i, wsigma, wave, nwave, nspec[i]) for i in range(nspec.shape[0]))
-
-    if parallel:
-        result_base = multiprocessing.Array(ctypes.c_float,
-                                            np.prod(nspec.shape[:-1]) *
-                                            len(nwave))
-        result = np.ctypeslib.as_array(result_base.get_obj())
-        result = result.reshape(nspec.shape[:-1] + nwave.shape)
-        pool = multiprocessing.Pool()        # by default use all CPUs
-        pool.map(spectral_convolve, itr)
-        pool.close()
-        pool.join()
+    if executor is None:
+        mode = 'process' if parallel else 'serial'
+        ex = SharedArrayExecutor(nproc=nthreads, mode=mode)
     else:
-        result = np.empty(nspec.shape[:-1] + nwave.shape, dtype='f')
-        for w in itr:
-            spectral_convolve(w)
-
-    # Spectral pixelisation
-    nspec = result[:, :, ::3]
+        ex = executor
+    try:
+        result = ex.map(spectral_convolve, {'spec': nspec},
+                        {'result': (nspec.shape[:-1] + nwave.shape, 'f')},
+                        args=(wsigma, wave, nwave))['result']
+        # Spectral pixelisation
+        nspec = result[:, :, ::3].copy()
+    finally:
+        if executor is None:
+            ex.close()
     return nspec
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the bifrost module
+"""
+import os
+
+import numpy as np
+import pytest
+
+from helita.sim import bifrost
+
+NX, NY, NZ = 16, 12, 20
+SNAPNAME = 'test'
+TEST_IDL = """mx = {nx}
+my = {ny}
+mz = {nz}
+mb = 5
+dx = 0.1
+dy = 0.1
+dz = 0.05
+do_mhd = 1
+aux = ''
+t = 0.0
+isnap = 1
+gamma = 1.667
+meshfile = '{snapname}.mesh'
+snapname = '{snapname}'
+u_l = 1e8
+u_t = 1e2
+u_r = 1e-7
+u_b = 1.121e3
+u_ee = 1e12
+"""
+
+# BifrostData needs the CHIANTI database to initialise.
+requires_chianti = pytest.mark.skipif('XUVTOP' not in os.environ,
+                                      reason='CHIANTI database (XUVTOP) not available')
+
+
+@pytest.fixture
+def bifrost_snap(tmp_path):
+    """Writes a small random Bifrost snapshot, returns BifrostData for it."""
+    rng = np.random.default_rng(0)
+    shape = (NX, NY, NZ)
+    r = 1 + 0.1 * rng.random(shape)
+    p = [0.1 * rng.standard_normal(shape) for _ in range(3)]
+    e = 2 + 0.1 * rng.random(shape)
+    b = [rng.standard_normal(shape) for _ in range(3)]
+    bifrost.write_br_snap(str(tmp_path / (SNAPNAME + '_001.snap')),
+                          r, *p, e, *b)
+    bifrost.Create_new_br_files().write_mesh(
+        nx=NX, ny=NY, nz=NZ, dx=0.1, dy=0.1, dz=0.05,
+        meshfile=str(tmp_path / (SNAPNAME + '.mesh')))
+    (tmp_path / (SNAPNAME + '_001.idl')).write_text(
+        TEST_IDL.format(nx=NX, ny=NY, nz=NZ, snapname=SNAPNAME))
+    return bifrost.BifrostData(SNAPNAME, snap=1, fdir=str(tmp_path),
+                               verbose=False)
+
+
+@requires_chianti
+def test_get_vars(bifrost_snap):
+    """get_vars must match get_var, also when intermediates are shared
+    (chbdivb edits dbxdxup in-place)."""
+    for variables in (['chbdivb', 'dbxdxup'], ['dbxdxup', 'chbdivb'],
+                      ['ux', 'uy', 'u2', 'b2', 'bx']):
+        result = bifrost_snap.get_vars(variables)
+        for var in variables:
+            assert np.array_equal(result[var], bifrost_snap.get_var(var)), var
@@ -91,3 +91,33 @@ def test_AtomFile():
     assert np.array_equal(data.collision_tables[0]['data'],
                           np.array([2.378, 2.284, 2.203, 1.92, 1.961, 1.846]))
     assert data.collision_tables[-1]['type'] == 'AR85-CEA'
+
+
+def test_depth_optim_columns():
+    height = np.linspace(2e8, -0.5e8, 100)
+    shifts = np.array([-3e6, 0., 2e6])[:, np.newaxis]
+    temp = 4500 + 5e4 * (1 + np.tanh((height - 1.8e8 + shifts) / 5e6))
+    rho = 3e-7 * np.exp(-(height + 5e7) / 1.5e7) * np.ones_like(temp)
+    ne = 1e10 + 1e16 * rho * temp / 6000
+    vz = np.sin(height / 2e7 + shifts / 1e6)
+    result = rh15d.depth_optim_columns(height, temp, ne, vz, rho)
+    for i in range(temp.shape[0]):
+        expected = rh15d.depth_optim(height, temp[i], ne[i], vz[i], rho[i])
+        for new, ref in zip(result, expected):
+            assert np.allclose(new[i], ref, rtol=0.02, atol=1e-3 * np.abs(ref).max())
+
+
+def test_LazyVariable():
+    import h5py
+    data = np.arange(4 * 5 * 6, dtype='f4').reshape(4, 5, 6)
+    data[1, 2, 3] = 9.96921e+36
+    with h5py.File('lazy.tmp', mode='w', driver='core', backing_store=False) as f:
+        dset = f.create_dataset('intensity', data=data, chunks=(1, 1, 6))
+        dset.attrs['_FillValue'] = np.array([9.96921e+36], dtype='f4')
+        var = rh15d.LazyVariable(dset)
+        assert var.chunks == (1, 1, 6)
+        assert np.isnan(var[1, 2, 3])
+        expected = np.where(data == 9.96921e+36, np.nan, data)
+        assert np.array_equal(var[:], expected, equal_nan=True)
+        assert np.array_equal(var[2, ::-2, 1:4], expected[2, ::-2, 1:4])
+        assert np.array_equal(var[[3, 0], ..., [-1, 2]], expected[[3, 0]][..., [-1, 2]])
@@ -2,6 +2,6 @@
 Various tools for math and physics calculations, and utility functions.
 """
 
-__all__ = ["congrid", "fitting", "shell", "radtrans", "utilsmath", "utilsfast"]
+__all__ = ["congrid", "fitting", "shell", "radtrans", "utilsmath", "utilsfast", "moments"]
 
 from . import fitting, utilsfast
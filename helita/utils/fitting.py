@@ -26,6 +26,36 @@ def sine(B, x):
     return B[0] * np.sin(2 * np.pi * B[1] * x + B[2]) + B[3]
 
 
+def _gauss_fjb(B, x):
+    """
+    Analytical derivatives of gaussian with respect to parameters B.
+    Broadcasts, so B can also be a batch of parameters with shape (4, npix, 1).
+    Returns array with shape (4, *x.shape) (or (4, npix, nx) for a batch).
+    """
+    gauss1 = gaussian((B[0], B[1], B[2], 0.), x)
+    return np.stack(np.broadcast_arrays((x - B[0]) / B[1]**2 * gauss1,
+                                        ((B[0] - x)**2 - B[1]**2) / B[1]**3 * gauss1,
+                                        gauss1 / B[2],
+                                        np.ones_like(gauss1)))
+
+
+def _dgauss_fjb(B, x):
+    """
+    Analytical derivatives of double_gaussian with respect to parameters B.
+    Broadcasts, so B can also be a batch of parameters with shape (7, npix, 1).
+    Returns array with shape (7, *x.shape) (or (7, npix, nx) for a batch).
+    """
+    gauss1 = gaussian((B[0], B[1], B[2], 0.), x)
+    gauss2 = gaussian((B[3], B[4], B[5], 0.), x)
+    return np.stack(np.broadcast_arrays((x - B[0]) / B[1]**2 * gauss1,
+                                        ((B[0] - x)**2 - B[1]**2) / B[1]**3 * gauss1,
+                                        gauss1 / B[2],
+                                        (x - B[3]) / B[4]**2 * gauss2,
+                                        ((B[3] - x)**2 - B[4]**2) / B[4]**3 * gauss2,
+                                        gauss2 / B[5],
+                                        np.ones_like(gauss1)))
+
+
 def gauss_lsq(x, y, weight_x=1., weight_y=1., verbose=False, itmax=200,
               iparams=[]):
     """
@@ -72,16 +102,6 @@ def gauss_lsq(x, y, weight_x=1., weight_y=1., verbose=False, itmax=200,
         # Analytical derivative of gaussian with respect to x
         return (B[0] - x) / B[1]**2 * gaussian(np.concatenate((B[:3], [0.])), x)
 
-    def _gauss_fjb(B, x):
-        gauss1 = gaussian(np.concatenate((B[:3], [0.])), x)
-        # Analytical derivatives of gaussian with respect to parameters
-        _ret = np.concatenate(((x - B[0]) / B[1]**2 * gauss1,
-                               ((B[0] - x)**2 - B[1]**2) / B[1]**3 * gauss1,
-                               gauss1 / B[2],
-                               np.ones(x.shape, float)))
-        _ret.shape = (4,) + x.shape
-        return _ret
-
     # Centre data in mean(x) (makes better conditioned matrix)
     mx = np.mean(x)
     x2 = x - mx
@@ -140,20 +160,6 @@ def double_gauss_lsq(x, y, verbose=False, itmax=200, iparams=[]):
         return (B[0] - x) / B[1]**2 * gaussian(np.concatenate((B[:3], [0.])), x) + \
                (B[3] - x) / B[4]**2 * gaussian(np.concatenate((B[3:6], [0.])), x)
 
-    def _dgauss_fjb(B, x):
-        # Analytical derivatives of gaussian with respect to parameters
-        gauss1 = gaussian(np.concatenate((B[:3], [0.])), x)
-        gauss2 = gaussian(np.concatenate((B[3:6], [0.])), x)
-        _ret = np.concatenate(((x - B[0]) / B[1]**2 * gauss1,
-                               ((B[0] - x)**2 - B[1]**2) / B[1]**3 * gauss1,
-                               gauss1 / B[2],
-                               (x - B[3]) / B[4]**2 * gauss2,
-                               ((B[3] - x)**2 - B[4]**2) / B[4]**3 * gauss2,
-                               gauss2 / B[5],
-                               np.ones(x.shape, float)))
-        _ret.shape = (7,) + x.shape
-        return _ret
-
     # Centre data in mean(x) (makes better conditioned matrix)
     mx = np.mean(x)
     x2 = x - mx
@@ -187,6 +193,277 @@ def double_gauss_lsq(x, y, verbose=False, itmax=200, iparams=[]):
     return coeff, err, itlim
 
 
+def _moment_guess(x, y):
+    """
+    Moment-based initial guess of gaussian parameters (mean, stdev, area, offset)
+    for each spectrum in y (shape (npix, nx)). Works for emission and absorption lines.
+    Returns array with shape (npix, 4).
+    """
+    med = np.median(y, axis=-1)
+    ymin, ymax = y.min(axis=-1), y.max(axis=-1)
+    absorption = (med - ymin) > (ymax - med)
+    offset = np.where(absorption, ymax, ymin)
+    line = y - offset[:, None]
+    wgt = np.abs(line)
+    norm = np.maximum(wgt.sum(axis=-1), np.finfo(float).tiny)
+    mean = (wgt * x).sum(axis=-1) / norm
+    var = (wgt * (x - mean[:, None])**2).sum(axis=-1) / norm
+    dx = np.abs(np.mean(np.diff(x)))
+    stdev = np.sqrt(np.maximum(var, dx**2))
+    area = (0.5 * (line[:, 1:] + line[:, :-1]) * np.diff(x)).sum(axis=-1)   # trapezoidal rule
+    area = np.where(area == 0, np.finfo(float).eps, area)
+    return np.stack([mean, stdev, area, offset], axis=-1)
+
+
+def _solve(A, b):
+    """
+    Solves A @ x = b for a batch of matrices A (npix, n, n) and vectors b (npix, n).
+    If a matrix is singular, falls back to least squares one pixel at a time;
+    x is NaN for pixels where that fails too.
+    """
+    try:
+        return np.linalg.solve(A, b[..., None])[..., 0]
+    except np.linalg.LinAlgError:   # at least one singular matrix; solve one at a time.
+        pass
+    x = np.full(b.shape, np.nan)
+    for i, (a, bi) in enumerate(zip(A, b)):
+        try:
+            x[i] = np.linalg.lstsq(a, bi, rcond=None)[0]
+        except np.linalg.LinAlgError:
+            pass
+    return x
+
+
+def _pinv(A):
+    """
+    Pseudo-inverse of a batch of matrices A (npix, n, n). Non-finite matrices,
+    or those for which the SVD does not converge, give NaN.
+    """
+    result = np.full(A.shape, np.nan)
+    finite = np.isfinite(A).all(axis=(-1, -2))
+    try:
+        result[finite] = np.linalg.pinv(A[finite])
+    except np.linalg.LinAlgError:   # one pixel at a time.
+        for i in np.nonzero(finite)[0]:
+            try:
+                result[i] = np.linalg.pinv(A[i])
+            except np.linalg.LinAlgError:
+                pass
+    return result
+
+
+def _batched_lm(func, fjb, x, y, p0, weights=None, itmax=100, tol=1e-8, lam0=1e-3,
+                centres=(), widths=(), areas=()):
+    """
+    Levenberg-Marquardt least squares fit of func(B, x) to every spectrum in y, simultaneously.
+
+    Parameters
+    ----------
+    func, fjb : functions
+        Model and its analytical jacobian with respect to parameters. Both must
+        broadcast over a batch of parameters B with shape (npar, npix, 1).
+    x : 1-D array, shape (nx,)
+    y : 2-D array, shape (npix, nx)
+    p0 : 2-D array, shape (npix, npar)
+        Initial guesses.
+    weights : array broadcastable to y, optional
+        Weights of each point, typically 1/err**2.
+    itmax, tol : int, float
+        Maximum number of iterations, and relative change of chi**2 for convergence.
+    centres, widths, areas : sequences of int, optional
+        Indices of the parameters which are Gaussian centres, widths and areas.
+        Centres are kept within x, and widths within (0, x range]. Widths and
+        areas are kept away from 0, where the model or its jacobian are not finite.
+
+    Returns
+    -------
+    coeff, err, itlim : arrays with shapes (npix, npar), (npix, npar), (npix,)
+        Like gauss_lsq, but for each pixel. Pixels for which the fit breaks down
+        (non-finite jacobian, or no solution for the step) have NaN coeff and err.
+    """
+    npix, npar = p0.shape
+    nx = x.size
+    w = np.ones_like(y) if weights is None else np.broadcast_to(weights, y.shape)
+    centres, widths, areas = list(centres), list(widths), list(areas)
+    xmin, xmax = x.min(), x.max()
+    wmin = 1e-3 * np.min(np.abs(np.diff(x))) if nx > 1 else np.finfo(float).tiny
+    wmax = max(xmax - xmin, wmin)
+    amin = np.maximum(1e-8 * wmin * np.abs(y).max(axis=-1), np.finfo(float).tiny)[:, None]
+
+    def clamp(p, amin):
+        p[:, centres] = np.clip(p[:, centres], xmin, xmax)
+        p[:, widths] = np.copysign(np.clip(np.abs(p[:, widths]), wmin, wmax), p[:, widths])
+        p[:, areas] = np.copysign(np.maximum(np.abs(p[:, areas]), amin), p[:, areas])
+        return p
+
+    p = clamp(p0.astype(float).copy(), amin)
+    lam = np.full(npix, lam0)
+    with np.errstate(all='ignore'):
+        chi2 = ((y - func(p.T[..., None], x))**2 * w).sum(axis=-1)
+    active = np.isfinite(chi2)   # per-pixel convergence mask. (pixels stop being active once converged.)
+    failed = ~active
+    itlim = np.zeros(npix, dtype=bool)
+    for it in range(itmax):
+        idx = np.nonzero(active)[0]
+        if idx.size == 0:
+            break
+        pa, ya, wa = p[idx], y[idx], w[idx]
+        B = pa.T[..., None]
+        with np.errstate(all='ignore'):
+            r = ya - func(B, x)
+            J = np.moveaxis(fjb(B, x), 0, -1)     # (nactive, nx, npar)
+            JTw = np.swapaxes(J * wa[..., None], -1, -2)
+            A = JTw @ J                           # (nactive, npar, npar)
+            g = (JTw @ r[..., None])[..., 0]      # (nactive, npar)
+            diag = np.einsum('pii->pi', A)
+            A_lm = A + (lam[idx, None] * np.maximum(diag, np.finfo(float).tiny))[..., None] * np.eye(npar)
+        step = np.full(g.shape, np.nan)
+        finite = np.isfinite(A_lm).all(axis=(-1, -2)) & np.isfinite(g).all(axis=-1)
+        if finite.any():
+            step[finite] = _solve(A_lm[finite], g[finite])
+        # pixels with no usable step have broken down; stop fitting them.
+        broken = ~np.isfinite(step).all(axis=-1)
+        failed[idx[broken]] = True
+        active[idx[broken]] = False
+        keep = ~broken
+        idx, pa, ya, wa, step = idx[keep], pa[keep], ya[keep], wa[keep], step[keep]
+        pnew = clamp(pa + step, amin[idx])
+        with np.errstate(all='ignore'):
+            chi2new = ((ya - func(pnew.T[..., None], x))**2 * wa).sum(axis=-1)
+        better = np.isfinite(chi2new) & (chi2new <= chi2[idx])
+        converged = better & (chi2[idx] - chi2new <= tol * np.maximum(chi2new, np.finfo(float).tiny))
+        p[idx[better]] = pnew[better]
+        chi2[idx[better]] = chi2new[better]
+        lam[idx] = np.where(better, lam[idx] / 10, lam[idx] * 10)
+        stuck = lam[idx] > 1e16   # no step improves chi2 anymore; treat as converged.
+        active[idx[converged | stuck]] = False
+    itlim[active] = True
+    p[failed] = np.nan
+    # errors, from the covariance matrix (scaled by the reduced chi2, as in odrpack).
+    B = p.T[..., None]
+    with np.errstate(all='ignore'):
+        J = np.moveaxis(fjb(B, x), 0, -1)
+        A = np.swapaxes(J * w[..., None], -1, -2) @ J
+        cov = _pinv(A) * (chi2 / max(nx - npar, 1))[:, None, None]
+        err = np.sqrt(np.abs(np.einsum('pii->pi', cov)))
+    return p, err, itlim
+
+
+def _lm_chunk(args):
+    """Helper for multiprocessing in gauss_lm and double_gauss_lm (must be at module level to be pickled)."""
+    double, kwargs = args
+    return (double_gauss_lm if double else gauss_lm)(**kwargs)
+
+
+def _lm_in_chunks(double, x, y, iparams, weights, nproc, chunksize, **kw):
+    """Split pixels into chunks and fit them using nproc processes. Returns (coeff, err, itlim)."""
+    from multiprocessing import Pool
+    npix = y.shape[0]
+    chunksize = chunksize if chunksize is not None else -(-npix // nproc)
+    tasks = []
+    for start in range(0, npix, chunksize):
+        sl = slice(start, start + chunksize)
+        w = None if weights is None else np.broadcast_to(weights, y.shape)[sl]
+        ip = None if iparams is None else iparams[sl]
+        tasks.append((double, dict(x=x, y=y[sl], iparams=ip, weights=w, nproc=1, **kw)))
+    with Pool(nproc) as pool:
+        results = pool.map(_lm_chunk, tasks)
+    return tuple(np.concatenate(r) for r in zip(*results))
+
+
+def gauss_lm(x, y, iparams=None, weights=None, itmax=100, tol=1e-8, nproc=1, chunksize=None):
+    """
+    Gaussian least squares fit of many spectra at once, using a vectorised
+    Levenberg-Marquardt method with the analytical jacobian (_gauss_fjb).
+    Much faster than calling gauss_lsq for each pixel.
+
+    Parameters
+    ----------
+    x : 1D array-like, shape (nx,)
+        Independent variable (e.g. wavelength), common to all spectra.
+    y : array-like, shape (..., nx)
+        Spectra to fit. All leading dimensions are treated as pixels.
+    iparams : array-like, shape (..., 4), optional
+        Starting guesses of Gaussian parameters for each pixel (same order as
+        in gaussian). If not given, use moments of each spectrum.
+    weights : array-like, broadcastable to y, optional
+        Weights of each point, typically 1/err**2.
+    itmax : integer, optional
+        Maximum number of iterations, default is 100.
+    tol : float, optional
+        A pixel is converged when chi**2 changes by less than tol (relative).
+    nproc : integer, optional
+        Number of processes to use. If > 1, the pixels are split into chunks
+        (of size chunksize, default npix / nproc), fitted in parallel.
+
+    Returns
+    -------
+    output: tuple
+        Tuple with containing (coeff, err, itlim), as from gauss_lsq but for each pixel.
+        coeff and err have shape (..., 4), itlim has shape (...,).
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    shape = y.shape[:-1]
+    y = y.reshape(-1, x.size)
+    if weights is not None:
+        weights = np.broadcast_to(weights, (*shape, x.size)).reshape(y.shape)
+    if iparams is not None:
+        iparams = np.asarray(iparams, dtype=float).reshape(-1, 4)
+    if nproc > 1:
+        coeff, err, itlim = _lm_in_chunks(False, x, y, iparams, weights, nproc, chunksize, itmax=itmax, tol=tol)
+    else:
+        # Centre data in mean(x) (makes better conditioned matrix)
+        mx = np.mean(x)
+        x2 = x - mx
+        if iparams is None:
+            iparams = _moment_guess(x2, y)
+        else:
+            iparams = iparams.copy()
+            iparams[:, 0] -= mx
+        coeff, err, itlim = _batched_lm(gaussian, _gauss_fjb, x2, y, iparams, weights=weights,
+                                        itmax=itmax, tol=tol, centres=[0], widths=[1], areas=[2])
+        coeff[:, 0] += mx  # Recentre in original axis
+    return coeff.reshape(*shape, 4), err.reshape(*shape, 4), itlim.reshape(shape)
+
+
+def double_gauss_lm(x, y, iparams=None, weights=None, itmax=100, tol=1e-8, nproc=1, chunksize=None):
+    """
+    Double Gaussian least squares fit of many spectra at once, using a vectorised
+    Levenberg-Marquardt method with the analytical jacobian (_dgauss_fjb).
+
+    Parameters and returns are as for gauss_lm, but with 7 parameters
+    (same order as in double_gaussian). If iparams is not given, the initial
+    guesses are two Gaussians with half the area of the moment-based guess,
+    half a standard deviation on either side of its mean.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    shape = y.shape[:-1]
+    y = y.reshape(-1, x.size)
+    if weights is not None:
+        weights = np.broadcast_to(weights, (*shape, x.size)).reshape(y.shape)
+    if iparams is not None:
+        iparams = np.asarray(iparams, dtype=float).reshape(-1, 7)
+    if nproc > 1:
+        coeff, err, itlim = _lm_in_chunks(True, x, y, iparams, weights, nproc, chunksize, itmax=itmax, tol=tol)
+    else:
+        # Centre data in mean(x) (makes better conditioned matrix)
+        mx = np.mean(x)
+        x2 = x - mx
+        if iparams is None:
+            m, s, a, c = _moment_guess(x2, y).T
+            iparams = np.stack([m - s / 2, s / 2, a / 2, m + s / 2, s / 2, a / 2, c], axis=-1)
+        else:
+            iparams = iparams.copy()
+            iparams[:, [0, 3]] -= mx
+        coeff, err, itlim = _batched_lm(double_gaussian, _dgauss_fjb, x2, y, iparams, weights=weights,
+                                        itmax=itmax, tol=tol, centres=[0, 3], widths=[1, 4],
+                                        areas=[2, 5])
+        coeff[:, [0, 3]] += mx  # Recentre in original axis
+    return coeff.reshape(*shape, 7), err.reshape(*shape, 7), itlim.reshape(shape)
+
+
 def poly_lsq(x, y, n, verbose=False, itmax=200):
     """
     Performs a polynomial least squares fit to the data,
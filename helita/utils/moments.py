@@ -0,0 +1,199 @@
+"""
+Moment analysis of spectral lines: fast, vectorised alternative to
+fitting a Gaussian to every pixel (see fitting.gauss_lm).
+
+Computes maps of integrated intensity, centroid, Doppler velocity, width,
+skewness, FWHM, and red-blue (RB) asymmetry, for spectral cubes with
+wavelength as the last axis, e.g. Rh15dout.ray.intensity or IRIS level 2 data.
+"""
+import numpy as np
+from numba import njit, prange
+
+CC_KMS = 299792.458   # speed of light [km/s]
+
+
+def line_moments(wave, spec, wave_ref=None, wave_range=None, absorption=False,
+                 continuum=None, rb_offsets=(), rb_width=None, chunksize=64):
+    """
+    Computes line parameters from the moments of each spectrum in a cube.
+
+    The line profile is spec minus the continuum (or continuum minus spec,
+    for absorption lines). Moments are integrals over wavelength (trapezoidal
+    rule) of the line profile.
+
+    Parameters
+    ----------
+    wave : 1-D array
+        Wavelengths, in increasing order.
+    spec : n-D array-like, shape (..., nwave)
+        Spectra. Can be a numpy array, a memmap, or an xarray DataArray
+        (e.g. Rh15dout.ray.intensity). It is read chunksize rows
+        (along the first axis) at a time. A single spectrum (1-D spec)
+        gives 0-d results.
+    wave_ref : float, optional
+        Rest wavelength, for velocity and RB. If not given, use the mean of
+        the centroid map.
+    wave_range : 2-element list, optional
+        (min, max) of wavelengths to use. Only this part of spec is read.
+    absorption : bool, optional
+        If True, treat the line as an absorption line.
+    continuum : float or array broadcastable to spec.shape[:-1], optional
+        Continuum level. If not given, use the minimum (maximum, for
+        absorption lines) of each spectrum.
+    rb_offsets : list of floats, optional
+        Offsets from wave_ref (same units as wave) at which to compute the
+        RB asymmetry.
+    rb_width : float, optional
+        Width of the wavelength windows used for RB. Default is 2 * the
+        wavelength spacing.
+    chunksize : int, optional
+        Number of rows (along the first axis of spec) to process at a time.
+
+    Returns
+    -------
+    result : dict of arrays, each with shape spec.shape[:-1]:
+        m0 - integrated intensity of the line profile (zeroth moment).
+        centroid - mean wavelength of the line profile (first moment).
+        velocity - Doppler velocity of centroid relative to wave_ref [km/s];
+            positive is redshift.
+        width - standard deviation of the line profile (square root of the
+            second central moment). Same units as wave.
+        skewness - third central moment, divided by width**3.
+        fwhm - full width at half maximum of the line profile, between the
+            outermost half-maximum crossings (as in utilsfast.fwhm_gen).
+        peak - maximum of the line profile.
+        rb - (only if rb_offsets is given) array with shape
+            (len(rb_offsets), *spec.shape[:-1]). RB asymmetry: mean of the
+            profile in the red window minus mean in the blue window, divided
+            by the peak.
+    """
+    wave = np.asarray(wave, dtype='f8')
+    w0, w1 = 0, wave.size
+    if wave_range is not None:
+        w0, w1 = np.searchsorted(wave, wave_range[0]), np.searchsorted(wave, wave_range[1], side='right')
+    wave = wave[w0:w1]
+    if rb_width is None:
+        rb_width = 2 * np.mean(np.diff(wave))
+    rb_offsets = np.asarray(rb_offsets, dtype='f8')
+    single = np.ndim(spec) == 1
+    if single:   # chunks are rows along the first axis, so give a single spectrum one row.
+        spec = np.asarray(spec)[None]
+    shape = tuple(np.shape(spec)[:-1])
+    if continuum is not None:
+        continuum = np.broadcast_to(np.asarray(continuum, dtype='f8'), shape)
+    keys = ('m0', 'centroid', 'width', 'skewness', 'fwhm', 'peak')
+    result = {key: np.empty(shape) for key in keys}
+    for i0, i1, line in _iter_line_chunks(spec, w0, w1, absorption, continuum, chunksize):
+        out = _moments_kernel(wave, line)
+        for key, val in zip(keys, out):
+            result[key][i0:i1] = val.reshape(i1 - i0, *shape[1:])
+    if wave_ref is None:
+        wave_ref = np.nanmean(result['centroid'])
+    result['velocity'] = CC_KMS * (result['centroid'] - wave_ref) / wave_ref
+    if len(rb_offsets) > 0:
+        # second pass, since default wave_ref depends on the full centroid map.
+        result['rb'] = np.empty((len(rb_offsets), *shape))
+        for i0, i1, line in _iter_line_chunks(spec, w0, w1, absorption, continuum, chunksize):
+            rb = _rb_kernel(wave, line, wave_ref, rb_offsets, rb_width)
+            result['rb'][:, i0:i1] = rb.reshape(len(rb_offsets), i1 - i0, *shape[1:])
+    if single:
+        result = {key: val[..., 0] for key, val in result.items()}
+    return result
+
+
+def _iter_line_chunks(spec, w0, w1, absorption, continuum, chunksize):
+    """
+    Yields (i0, i1, line) for chunks of rows i0:i1 along the first axis of spec,
+    where line is the continuum-subtracted profile, with shape (npix, w1 - w0).
+    """
+    nrows = np.shape(spec)[0]
+    for i0 in range(0, nrows, chunksize):
+        i1 = min(i0 + chunksize, nrows)
+        block = np.asarray(spec[i0:i1][..., w0:w1], dtype='f8')
+        block = block.reshape(-1, w1 - w0)
+        if continuum is None:
+            cont = block.max(axis=-1) if absorption else block.min(axis=-1)
+        else:
+            cont = continuum[i0:i1].reshape(-1)
+        line = (cont[:, None] - block) if absorption else (block - cont[:, None])
+        yield i0, i1, line
+
+
+@njit(parallel=True)
+def _moments_kernel(wave, line):
+    """
+    Moments, FWHM and peak of each line profile in line (shape (npix, nwave)).
+    Returns m0, centroid, width, skewness, fwhm, peak (each with shape (npix,)).
+    """
+    npix, nw = line.shape
+    m0 = np.empty(npix)
+    centroid = np.empty(npix)
+    width = np.empty(npix)
+    skewness = np.empty(npix)
+    fwhm = np.empty(npix)
+    peak = np.empty(npix)
+    # trapezoidal rule weights
+    dw = np.empty(nw)
+    dw[0] = 0.5 * (wave[1] - wave[0])
+    dw[-1] = 0.5 * (wave[-1] - wave[-2])
+    for k in range(1, nw - 1):
+        dw[k] = 0.5 * (wave[k + 1] - wave[k - 1])
+    for p in prange(npix):
+        s0 = 0.
+        s1 = 0.
+        for k in range(nw):
+            s0 += line[p, k] * dw[k]
+            s1 += line[p, k] * dw[k] * wave[k]
+        mean = s1 / s0
+        s2 = 0.
+        s3 = 0.
+        for k in range(nw):
+            d = wave[k] - mean
+            s2 += line[p, k] * dw[k] * d * d
+            s3 += line[p, k] * dw[k] * d * d * d
+        m0[p] = s0
+        centroid[p] = mean
+        width[p] = np.sqrt(s2 / s0) if s2 / s0 > 0 else np.nan
+        skewness[p] = (s3 / s0) / width[p]**3
+        # FWHM, from outermost crossings of half maximum.
+        pk = line[p, 0]
+        for k in range(1, nw):
+            pk = max(pk, line[p, k])
+        peak[p] = pk
+        hm = 0.5 * pk
+        blue = np.nan
+        for k in range(1, nw):
+            if line[p, k - 1] < hm <= line[p, k]:
+                blue = wave[k - 1] + (hm - line[p, k - 1]) * (wave[k] - wave[k - 1]) / (line[p, k] - line[p, k - 1])
+                break
+        red = np.nan
+        for k in range(nw - 1, 0, -1):
+            if line[p, k] < hm <= line[p, k - 1]:
+                red = wave[k - 1] + (hm - line[p, k - 1]) * (wave[k] - wave[k - 1]) / (line[p, k] - line[p, k - 1])
+                break
+        fwhm[p] = red - blue
+    return m0, centroid, width, skewness, fwhm, peak
+
+
+@njit(parallel=True)
+def _rb_kernel(wave, line, wave_ref, offsets, rb_width):
+    """
+    RB asymmetry of each line profile, at each offset from wave_ref. Returns array with shape (noffsets, npix).
+    Mean intensity in each window is from the cumulative (trapezoidal) integral of the profile.
+    """
+    npix, nw = line.shape
+    nof = offsets.size
+    rb = np.empty((nof, npix))
+    for p in prange(npix):
+        cum = np.zeros(nw)
+        pk = line[p, 0]
+        for k in range(1, nw):
+            cum[k] = cum[k - 1] + 0.5 * (line[p, k] + line[p, k - 1]) * (wave[k] - wave[k - 1])
+            pk = max(pk, line[p, k])
+        for i in range(nof):
+            red = np.interp(wave_ref + offsets[i] + 0.5 * rb_width, wave, cum) - \
+                np.interp(wave_ref + offsets[i] - 0.5 * rb_width, wave, cum)
+            blue = np.interp(wave_ref - offsets[i] + 0.5 * rb_width, wave, cum) - \
+                np.interp(wave_ref - offsets[i] - 0.5 * rb_width, wave, cum)
+            rb[i, p] = (red - blue) / (rb_width * pk)
+    return rb
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the fitting module
+"""
+
+import numpy as np
+import pytest
+
+try:
+    from helita.utils import fitting
+except ImportError:   # helita.utils needs the compiled utilsfast extension.
+    pytest.skip('helita.utils not built', allow_module_level=True)
+
+
+def _double_gauss_spectra(seed, npix=500, noise=0.01):
+    """Returns (x, y, params) for npix double-Gaussian spectra."""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(-1, 1, 60)
+    params = np.stack([rng.uniform(-0.4, -0.1, npix),   # mean1
+                       rng.uniform(0.05, 0.15, npix),   # stdev1
+                       rng.uniform(0.5, 1.5, npix),     # area1
+                       rng.uniform(0.1, 0.4, npix),     # mean2
+                       rng.uniform(0.05, 0.15, npix),   # stdev2
+                       rng.uniform(0.5, 1.5, npix),     # area2
+                       rng.uniform(0., 0.2, npix)])     # offset
+    y = fitting.double_gaussian(params[..., None], x)
+    y += noise * rng.standard_normal(y.shape)
+    return x, y, params.T
+
+
+@pytest.mark.parametrize('seed', range(6))
+def test_double_gauss_lm(seed):
+    """A single degenerate pixel must not break the fit of the whole batch."""
+    x, y, params = _double_gauss_spectra(seed)
+    coeff, err, itlim = fitting.double_gauss_lm(x, y)
+    assert coeff.shape == params.shape
+    assert err.shape == params.shape
+    assert np.isfinite(coeff).all()
+    assert np.isfinite(err).all()
+    # components can come out in either order
+    swap = coeff[:, 0] > coeff[:, 3]
+    coeff[swap] = coeff[swap][:, [3, 4, 5, 0, 1, 2, 6]]
+    good = np.all(np.abs(coeff - params) < 0.05, axis=1)
+    assert good.mean() > 0.9
+
+
+def test_gauss_lm():
+    x = np.linspace(-1, 1, 40)
+    params = np.array([[0.1, 0.2, 1.0, 0.5], [-0.3, 0.1, -0.5, 1.0]])
+    y = fitting.gaussian(params.T[..., None], x)
+    coeff, err, itlim = fitting.gauss_lm(x, y)
+    assert np.allclose(coeff, params, atol=1e-6)
+    assert not itlim.any()
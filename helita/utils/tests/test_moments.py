@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the moments module
+"""
+
+import numpy as np
+import pytest
+from scipy.special import ndtr
+
+try:
+    from helita.utils import moments
+except ImportError:   # helita.utils needs the compiled utilsfast extension.
+    pytest.skip('helita.utils not built', allow_module_level=True)
+
+WAVE_REF = 10.
+WAVE = WAVE_REF + np.linspace(-1, 1, 801)
+CONT = 2.
+
+
+def _gauss_spectra(absorption=False, shape=(5, 3)):
+    """Returns (spec, params) for Gaussian lines on a constant continuum."""
+    rng = np.random.default_rng(0)
+    amp = rng.uniform(0.5, 1.5, shape)
+    mu = WAVE_REF + rng.uniform(-0.2, 0.2, shape)
+    sigma = rng.uniform(0.05, 0.1, shape)
+    line = amp[..., None] * np.exp(-0.5 * ((WAVE - mu[..., None]) / sigma[..., None])**2)
+    spec = CONT - line if absorption else CONT + line
+    return spec, (amp, mu, sigma)
+
+
+@pytest.mark.parametrize('absorption', [False, True])
+@pytest.mark.parametrize('chunksize', [64, 2])
+def test_line_moments(absorption, chunksize):
+    spec, (amp, mu, sigma) = _gauss_spectra(absorption)
+    offsets = [0.05, 0.1]
+    rb_width = 0.04
+    res = moments.line_moments(WAVE, spec, wave_ref=WAVE_REF, absorption=absorption, continuum=CONT,
+                               rb_offsets=offsets, rb_width=rb_width, chunksize=chunksize)
+    assert np.allclose(res['m0'], amp * sigma * np.sqrt(2 * np.pi))
+    assert np.allclose(res['centroid'], mu)
+    assert np.allclose(res['velocity'], moments.CC_KMS * (mu - WAVE_REF) / WAVE_REF)
+    assert np.allclose(res['width'], sigma)
+    assert np.allclose(res['skewness'], 0, atol=1e-6)
+    assert np.allclose(res['fwhm'], 2 * np.sqrt(2 * np.log(2)) * sigma, rtol=1e-3)
+    assert np.allclose(res['peak'], amp, rtol=1e-3)
+
+    def window(offset):   # mean of the Gaussian line over a window, divided by its peak
+        centre = WAVE_REF + offset
+        lo, hi = (centre - 0.5 * rb_width - mu) / sigma, (centre + 0.5 * rb_width - mu) / sigma
+        return sigma * np.sqrt(2 * np.pi) * (ndtr(hi) - ndtr(lo)) / rb_width
+    rb = [window(off) - window(-off) for off in offsets]
+    assert res['rb'].shape == (2, *spec.shape[:-1])
+    assert np.allclose(res['rb'], rb, atol=1e-3)
+
+
+def test_line_moments_1d():
+    """A single spectrum gives the same (0-d) results as a cube."""
+    spec, _ = _gauss_spectra()
+    cube = moments.line_moments(WAVE, spec, rb_offsets=[0.1])
+    single = moments.line_moments(WAVE, spec[2, 1], wave_ref=cube['centroid'].mean(), rb_offsets=[0.1])
+    for key, val in single.items():
+        assert np.shape(val) == np.shape(cube[key][..., 2, 1]), key
+        assert np.allclose(val, cube[key][..., 2, 1]), key
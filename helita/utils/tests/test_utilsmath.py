@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the utilsmath module
+"""
+
+import numpy as np
+import pytest
+
+try:
+    from helita.utils import utilsmath
+except ImportError:   # helita.utils needs the compiled utilsfast extension.
+    pytest.skip('helita.utils not built', allow_module_level=True)
+
+
+def test_binned_statistics_2d_edges():
+    """2D binning with a pair of bin edges of different lengths."""
+    rng = np.random.default_rng(0)
+    x, y = rng.random((2, 1000))
+    xedges, yedges = np.linspace(0, 1, 5), np.linspace(0, 1, 8)
+    result = utilsmath.binned_statistics(x, x, y=y, bins=[xedges, yedges], chunksize=300)
+    count, _, _ = np.histogram2d(x, y, bins=[xedges, yedges])
+    assert result['count'].shape == (4, 7)
+    assert np.array_equal(result['count'], count)
+    total, _, _ = np.histogram2d(x, y, bins=[xedges, yedges], weights=x)
+    assert np.allclose(result['sum'], total)
+
+
+def test_pystat2d_idx():
+    """pystat2d_idx gives the same result in any number of chunks."""
+    rng = np.random.default_rng(1)
+    x = rng.random((7, 5, 20))
+    lo = rng.integers(0, 10, (7, 5))
+    hi = lo + rng.integers(-2, 10, (7, 5))
+    result = utilsmath.pystat2d_idx(x, lo, hi)
+    assert np.array_equal(utilsmath.pystat2d_idx(x, lo, hi, chunksize=150), result, equal_nan=True)
+    i, j = np.nonzero((lo < hi) & (hi < 20))
+    for i, j in zip(i, j):
+        col = x[i, j, lo[i, j]:hi[i, j]]
+        assert np.allclose(result[:, i, j], [col.max(), col.min(), col.mean(), col.std()])
+    assert np.all(np.isnan(result[:, lo >= hi]))
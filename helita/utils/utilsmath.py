@@ -20,7 +20,10 @@ def hist2d(x, y, nbins=30, norm=False, rx=0.08):
     ylow = min(np.min(y) * (1 - rx), np.min(y) - 1.5 * yinc)
     yhigh = max(np.max(y) * (1 + rx), np.max(y) + 1.5 * yinc)
     r = [[xlow, xhigh], [ylow, yhigh]]
-    hist, xi, yi = np.histogram2d(x, y, bins=nbins, range=r, normed=norm)
+    stats = binned_statistics(x, bins=nbins, y=y, range=r)
+    hist, (xi, yi) = stats['count'], stats['edges']
+    if norm:   # probability density
+        hist = hist / (hist.sum() * np.outer(np.diff(xi), np.diff(yi)))
     # Take the middle point of the bins
     xbin = (xi[1:] + xi[:-1]) / 2.
     ybin = (yi[1:] + yi[:-1]) / 2.
@@ -60,15 +63,7 @@ def stat2d(x, y, x_range=None, nbins=10, percentiles=[25, 50, 75]):
         x_range = [np.min(x), np.max(x)]
     bins = np.linspace(x_range[0], x_range[1], nbins + 1)
     xbins = 0.5 * (bins[1:] + bins[:-1])
-    q1 = np.zeros(nbins)
-    q2 = np.zeros(nbins)
-    q3 = np.zeros(nbins)
-    for i in range(nbins):
-        idx = (x >= bins[i]) & (x < bins[i + 1])
-        sdata = y[idx]
-        q1[i] = np.percentile(sdata, percentiles[0])
-        q2[i] = np.percentile(sdata, percentiles[1])
-        q3[i] = np.percentile(sdata, percentiles[2])
+    q1, q2, q3 = binned_statistics(x, y, bins=bins, percentiles=percentiles[:3])['percentiles']
     return xbins, q1, q2, q3
 
 
@@ -250,13 +245,177 @@ def bin_quantities(x, y, bins, func, *args, **kwargs):
        Array with same shape as bins, containing the results of running
        func in the different regions.
     """
-    xx = x.ravel()
-    yy = y.ravel()
+    xx = np.ravel(x)
+    yy = np.ravel(y)
     idx = np.digitize(xx, bins)
     result = np.zeros(len(bins))
+    # sort once, then each bin is a contiguous block (instead of masking all data for each bin).
+    order = np.argsort(idx, kind='stable')
+    counts = np.bincount(idx, minlength=len(bins) + 1)
+    groups = np.split(yy[order], np.cumsum(counts)[:-1])
     for i in range(len(bins)):
-        if np.sum(idx == i) > 0:
-            result[i] = func(yy[idx == i], *args, **kwargs)
+        if counts[i] > 0:
+            result[i] = func(groups[i], *args, **kwargs)
+    return result
+
+
+def _bin_index(coord, edges):
+    """
+    Index of the bin containing each value of coord; -1 if outside of edges.
+    Bins include their left edge; the last bin also includes its right edge
+    (same convention as np.histogram).
+    """
+    nbins = len(edges) - 1
+    idx = np.searchsorted(edges, coord, side='right') - 1
+    idx[coord == edges[-1]] = nbins - 1
+    idx[(idx < 0) | (idx >= nbins) | ~np.isfinite(coord)] = -1
+    return idx
+
+
+def _chunks(arrays, chunksize):
+    """
+    Iterate through flattened arrays (None allowed) together, chunksize elements at a time.
+    Only one chunk of each array is read into memory at a time (useful for memmaps).
+    """
+    arrays = [None if a is None else np.asanyarray(a) for a in arrays]
+    size = next(a.size for a in arrays if a is not None)
+    flat = [None if a is None else a.reshape(-1) for a in arrays]
+    for start in range(0, size, chunksize):
+        yield [None if a is None else np.asarray(a[start:start + chunksize]) for a in flat]
+
+
+def binned_statistics(x, values=None, bins=10, y=None, weights=None, range=None,
+                      percentiles=(), chunksize=2**22):
+    """
+    Single-pass binned statistics of values, in 1D bins of x or 2D bins of (x, y).
+    Arrays are processed chunksize elements at a time, so x, y, values and
+    weights can be (memmapped) cubes much larger than the available memory.
+
+    Parameters
+    ----------
+    x - n-D array
+       Coordinate used for binning. Flattened.
+    values - n-D array, optional
+       Values for which to compute statistics in each bin. Same size as x.
+       If None, only counts (and sums of weights, if weights is given) are computed.
+    bins - int, 1-D array, or 2-element list of those
+       Number of bins or bin edges. For 2D bins (i.e. y is given), may be
+       a pair (bins for x, bins for y).
+    y - n-D array, optional
+       Second coordinate for 2D binning. Same size as x.
+    weights - n-D array, optional
+       Weights for each point. Used for sumw, sum, mean and std (not count, nor percentiles).
+    range - 2-element list, or pair of those for 2D, optional
+       (min, max) for bins given as an int. If not set, use min and max of the data.
+    percentiles - list of numbers, optional
+       Percentiles (0-100) of values to compute in each bin. Note that this
+       requires keeping values (and their bin indices) for all points in memory.
+    chunksize - int
+       Number of elements to process at a time.
+
+    Returns
+    -------
+    result - dict with:
+       edges - tuple of bin edges (1 or 2 arrays).
+       count - number of points in each bin.
+       sumw - sum of weights in each bin (only if weights is given).
+       sum, mean, std - weighted sum, mean, and standard deviation of values
+           in each bin (only if values is given).
+       percentiles - array with shape (len(percentiles), *bins shape) (only if percentiles is given).
+       Statistics have shape (nbinsx,) or (nbinsx, nbinsy). Empty bins have nan mean, std, percentiles.
+    """
+    coords = [x] if y is None else [x, y]
+    ndim = len(coords)
+    # a pair of per-axis bins may be ragged (e.g. edges of different lengths), so check before np.ndim.
+    if not (ndim == 2 and isinstance(bins, (list, tuple)) and len(bins) == 2 and np.ndim(bins[0]) <= 1):
+        bins = [bins] * ndim
+    if range is None or ndim == 1:
+        range = [range] * ndim
+    # bin edges. if number of bins given, first find range of data (1 pass through data).
+    edges = []
+    for i, (nb, rng) in enumerate(zip(bins, range)):
+        if np.ndim(nb) == 0:
+            if rng is None:
+                lo, hi = np.inf, -np.inf
+                for (c,) in _chunks([coords[i]], chunksize):
+                    c = c[np.isfinite(c)]
+                    if c.size > 0:
+                        lo, hi = min(lo, c.min()), max(hi, c.max())
+                rng = (lo, hi) if lo < hi else (lo - 0.5, lo + 0.5)
+            edges.append(np.linspace(rng[0], rng[1], int(nb) + 1))
+        else:
+            edges.append(np.asarray(nb, dtype='f8'))
+    shape = tuple(len(e) - 1 for e in edges)
+    ntot = int(np.prod(shape))
+    # accumulate moments per bin, merging chunks with the parallel Welford algorithm.
+    count = np.zeros(ntot)
+    sumw = np.zeros(ntot)
+    mean = np.zeros(ntot)
+    m2 = np.zeros(ntot)
+    kept_idx, kept_val = [], []
+    for chunk in _chunks([*coords, values, weights], chunksize):
+        *cs, v, w = chunk
+        flat = _bin_index(cs[0], edges[0])
+        if ndim == 2:
+            iy = _bin_index(cs[1], edges[1])
+            flat = np.where((flat >= 0) & (iy >= 0), flat * shape[1] + iy, -1)
+        ok = flat >= 0
+        if v is not None:
+            ok &= np.isfinite(v)
+        flat = flat[ok]
+        count += np.bincount(flat, minlength=ntot)
+        w = np.ones(flat.size) if w is None else w[ok].astype('f8')
+        sumw_b = np.bincount(flat, weights=w, minlength=ntot)
+        if v is not None:
+            v = v[ok].astype('f8')
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean_b = np.bincount(flat, weights=w * v, minlength=ntot) / sumw_b
+            mean_b[sumw_b == 0] = 0
+            m2_b = np.bincount(flat, weights=w * (v - mean_b[flat])**2, minlength=ntot)
+            total = sumw + sumw_b
+            with np.errstate(invalid='ignore', divide='ignore'):
+                delta = mean_b - mean
+                mean = np.where(total > 0, mean + delta * sumw_b / total, 0)
+                m2 = np.where(total > 0, m2 + m2_b + delta**2 * sumw * sumw_b / total, 0)
+            if len(percentiles) > 0:
+                kept_idx.append(flat)
+                kept_val.append(v)
+        sumw = sumw + sumw_b
+    # results
+    result = dict(edges=tuple(edges), count=count.reshape(shape))
+    if weights is not None:
+        result['sumw'] = sumw.reshape(shape)
+    if values is not None:
+        empty = sumw == 0
+        result['sum'] = (mean * sumw).reshape(shape)
+        result['mean'] = np.where(empty, np.nan, mean).reshape(shape)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result['std'] = np.where(empty, np.nan, np.sqrt(m2 / sumw)).reshape(shape)
+        if len(percentiles) > 0:
+            result['percentiles'] = _binned_percentiles(np.concatenate(kept_idx), np.concatenate(kept_val),
+                                                        ntot, percentiles).reshape(-1, *shape)
+    return result
+
+
+def _binned_percentiles(idx, val, nbins, percentiles):
+    """
+    Percentiles of val in each bin (idx = bin index of each val), via a single sort.
+    Uses linear interpolation between data points, like np.percentile. nan for empty bins.
+    """
+    order = np.lexsort((val, idx))
+    val = val[order]
+    counts = np.bincount(idx, minlength=nbins)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    result = np.full((len(percentiles), nbins), np.nan)
+    nonempty = counts > 0
+    n = counts[nonempty]
+    s = starts[nonempty]
+    for i, p in enumerate(percentiles):
+        pos = p / 100. * (n - 1)
+        lo = np.floor(pos).astype(int)
+        hi = np.minimum(lo + 1, n - 1)
+        frac = pos - lo
+        result[i, nonempty] = val[s + lo] * (1 - frac) + val[s + hi] * frac
     return result
 
 
@@ -459,24 +618,38 @@ def pinterp3d(x, y, new_x):
     return new_y
 
 
-def pystat2d_idx(x, idx_low, idx_high):
+def pystat2d_idx(x, idx_low, idx_high, chunksize=2**22):
     """
     vz2d(x, idx_low, idx_high)
 
+    Max, min, mean and std of x[i, j, idx_low[i, j]:idx_high[i, j]], for all i, j.
+    Returns array with shape (4, nx, ny); nan where the index range is invalid.
+    x is processed in blocks of columns (about chunksize elements) at a time,
+    to bound the size of the temporary arrays.
     """
-    nx = x.shape[0]
-    ny = x.shape[1]
+    nx, ny, nz = x.shape
+    res = np.full((4, nx, ny), np.nan, dtype='d')
+    step = max(1, chunksize // max(1, ny * nz))
+    for i0 in range(0, nx, step):
+        sl = slice(i0, i0 + step)
+        res[:, sl] = _stat2d_idx_rows(np.asarray(x[sl]), idx_low[sl], idx_high[sl])
+    return res
+
+
+def _stat2d_idx_rows(x, idx_low, idx_high):
+    """pystat2d_idx for a block of columns x[i0:i1]."""
     nz = x.shape[2]
-    res = np.empty((4, nx, ny), dtype='d')
-    for i in range(nx):
-        for j in range(ny):
-            if (idx_low[i, j] < idx_high[i, j]) and \
-               (idx_low[i, j] >= 0) and (idx_high[i, j] < nz):
-                arr = x[i, j, idx_low[i, j]:idx_high[i, j]]
-                res[0, i, j] = np.max(arr)
-                res[1, i, j] = np.min(arr)
-                res[2, i, j] = np.mean(arr)
-                res[3, i, j] = np.std(arr)
+    valid = (idx_low < idx_high) & (idx_low >= 0) & (idx_high < nz)
+    k = np.arange(nz)
+    inside = (k >= idx_low[..., None]) & (k < idx_high[..., None]) & valid[..., None]
+    n = np.maximum(inside.sum(axis=2), 1)
+    res = np.full((4, *x.shape[:2]), np.nan, dtype='d')
+    mean = np.where(inside, x, 0).sum(axis=2, dtype='d') / n
+    res[0] = np.where(valid, np.where(inside, x, -np.inf).max(axis=2), np.nan)
+    res[1] = np.where(valid, np.where(inside, x, np.inf).min(axis=2), np.nan)
+    res[2] = np.where(valid, mean, np.nan)
+    var = np.where(inside, (x - mean[..., None])**2, 0).sum(axis=2) / n
+    res[3] = np.where(valid, np.sqrt(var), np.nan)
     return res
 
 